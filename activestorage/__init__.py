@@ -1,4 +1,10 @@
+import logging
+
 from .active import Active
 
+# Log nothing unless the application configures logging, eg
+# logging.getLogger("activestorage").setLevel(logging.DEBUG).
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
 __version__ = "0.0.1"
 
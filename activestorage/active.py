@@ -1,12 +1,17 @@
+import asyncio
+import collections
 import concurrent.futures
 import contextlib
+import functools
+import logging
 import os
 import numpy as np
 import pathlib
+import pickle
+import time
 import urllib
 
 import h5netcdf
-import s3fs
 
 #FIXME: Consider using h5py throughout, for more generality
 from netCDF4 import Dataset
@@ -14,10 +19,24 @@ from zarr.indexing import (
     OrthogonalIndexer,
 )
 from activestorage.config import *
+from activestorage import backpressure
+from activestorage import cancellation
+from activestorage import concurrency
+from activestorage import hedging
+from activestorage import planning
+from activestorage import ranges
 from activestorage import reductionist
-from activestorage.storage import reduce_chunk
+from activestorage import result_cache
+from activestorage import retry
+from activestorage import routing
+from activestorage import servers
+from activestorage import sessions
+from activestorage import stats
+from activestorage.storage import reduce_chunk, reduce_chunk_bytes
 from activestorage import netcdf_to_zarr as nz
 
+logger = logging.getLogger(__name__)
+
 
 @contextlib.contextmanager
 def load_from_s3(uri, storage_options=None):
@@ -36,16 +55,12 @@ def load_from_s3(uri, storage_options=None):
     a Python binder straight to HDF5-netCDF4 interface, that doesn't need a "local" file
 
     storage_options: kwarg dict containing S3 credentials passed straight to Active
+    (if None, use pre-configured S3 credentials)
     """
-    if storage_options is None:  # use pre-configured S3 credentials
-        fs = s3fs.S3FileSystem(key=S3_ACCESS_KEY,  # eg "minioadmin" for Minio
-                               secret=S3_SECRET_KEY,  # eg "minioadmin" for Minio
-                               client_kwargs={'endpoint_url': S3_URL})  # eg "http://localhost:9000" for Minio
-    else:
-        fs = s3fs.S3FileSystem(**storage_options)  # use passed-in dictionary
+    fs = sessions.get_s3_filesystem(storage_options)
     with fs.open(uri, 'rb') as s3file:
         ds = h5netcdf.File(s3file, 'r', invalid_netcdf=True)
-        print(f"Dataset loaded from S3 via h5netcdf: {ds}")
+        logger.debug("Dataset loaded from S3 via h5netcdf: %s", ds)
         yield ds
 
 
@@ -80,7 +95,18 @@ class Active:
         storage_type=None,
         max_threads=100,
         storage_options=None,
-        active_storage_url=None
+        active_storage_url=None,
+        contiguous_chunk_size=4 * 1024 ** 2,
+        retries=retry.RETRIES,
+        hedge_quantile=None,
+        hedge_server=None,
+        max_inflight_bytes=backpressure.MAX_INFLIGHT_BYTES,
+        s3_mode="reductionist",
+        fallback=False,
+        batch_size=None,
+        result_cache=None,
+        http2=False,
+        cost_model=None,
     ):
         """
         Instantiate with a NetCDF4 dataset and the variable of interest within that file.
@@ -89,7 +115,65 @@ class Active:
         using keywords and avoid a metadata read.)
 
         :param storage_options: s3fs.S3FileSystem options
-        :param active_storage_url: Reductionist server URL
+        :param active_storage_url: Reductionist server URL, or a list of
+                                   URLs of a pool of servers; the requests
+                                   for the chunks of an object all go to
+                                   the same server (unless it fails), and
+                                   each server has its own concurrency
+                                   limit
+        :param contiguous_chunk_size: size in bytes of the virtual chunks that
+                                      contiguous (unchunked) variables are
+                                      split into; None disables splitting.
+                                      Chunks are smaller where an axis
+                                      length has no suitable divisor, and
+                                      a variable is left whole if that
+                                      would make them tiny (< 32 KiB).
+        :param retries: number of times a chunk request to Reductionist is
+                        retried after a transient failure. Chunks that still
+                        fail do not stop the others; their error is raised
+                        once all are done, and calling again with the same
+                        selection only processes the chunks that failed.
+        :param hedge_quantile: if set (e.g. 0.95), a Reductionist request
+                               taking longer than this quantile of the
+                               latencies seen in the same call is made again,
+                               and the first answer taken
+        :param hedge_server: Reductionist server URL to send those duplicate
+                             requests to, by default the same server
+        :param max_inflight_bytes: bound on the memory used by the chunks
+                                   being processed (estimated from their
+                                   compressed and decoded sizes); more chunks
+                                   are started as memory is released. None
+                                   for no bound.
+        :param s3_mode: how data in S3 is reduced: "reductionist", by the
+                        Reductionist server at active_storage_url,
+                        "direct", client side, reading the chunks with
+                        concurrent ranged GETs (nearby chunks being read
+                        together), or "auto", each chunk whichever of the
+                        two ways the cost model expects to be faster
+        :param fallback: if True, chunks that Reductionist can't reduce (an
+                         unsupported codec or data type, the server being
+                         unavailable, or a request failing with a server
+                         error) are read and reduced client side instead.
+                         Which way each chunk went is then in chunk_paths.
+        :param batch_size: if set, up to this many chunks of the same object
+                           are sent to Reductionist in one request, to save
+                           the overhead of a request per chunk with small
+                           chunks. Servers without the batch endpoint get
+                           one request per chunk, as do chunks that fail.
+        :param result_cache: optional `result_cache.ResultCache` of the
+                             results of Reductionist requests, keyed by the
+                             request and the ETag of the object, shared
+                             between calls and Active instances
+        :param http2: if True, synchronous requests to https Reductionist
+                      servers are multiplexed over a few HTTP/2 connections
+                      (negotiated over TLS) instead of a connection per
+                      request in flight. Needs the optional httpx and h2
+                      packages. Plain http servers speak HTTP/1.1, so they
+                      keep a connection per request.
+        :param cost_model: optional `routing.CostModel` of the chunks routed
+                           with s3_mode "auto", which learns from the
+                           timings of the chunks processed; share one
+                           between Active instances to share what it learns
         """
         # Assume NetCDF4 for now
         self.uri = uri
@@ -120,11 +204,107 @@ class Active:
         self._method = None
         self._lock = False
         self._max_threads = max_threads
+        self._contiguous_chunk_size = contiguous_chunk_size
+        self._retries = retries
+        self._resume = None
+        self._hedge_quantile = hedge_quantile
+        self._hedge_server = hedge_server
+        self._hedger = None
+        self._max_inflight_bytes = max_inflight_bytes
+        self._memory = None
+        if s3_mode not in ("reductionist", "direct", "auto"):
+            raise ValueError(f"Unknown s3_mode {s3_mode}, must be "
+                             "'reductionist', 'direct' or 'auto'")
+        self._s3_mode = s3_mode
+        self._reader = None
+        self._fallback = fallback
+        self._fallback_reason = None
+        self._fallback_reader = None
+        self._chunk_paths = {}
+        self._pool = None
+        self._batch_size = batch_size
+        self._templates = {}
+        self._etags = {}
+        self._codecs = None
+        self._result_cache = result_cache
+        self._http2 = http2
+        self._stats = stats.CallStats()
+        if cost_model is None:
+            cost_model = routing.CostModel()
+        self._cost_model = cost_model
+        self._routes = None
 
     def __getitem__(self, index):
         """ 
         Provides support for a standard get item.
         """
+        return self.get(index)
+
+    def get(self, index, timeout=None, cancel_token=None):
+        """
+        As a standard get item, with a deadline and a way to cancel it.
+
+        When cancelled, no more chunks are processed, and the call returns
+        without waiting for requests in flight; a later call for the same
+        selection only processes the chunks that were not done.
+
+        :param index: the selection
+        :param timeout: seconds after which to give up, raising
+                        `cancellation.DeadlineExceeded`
+        :param cancel_token: a `cancellation.CancelToken`; cancelling it,
+                             from another thread, makes this raise
+                             `cancellation.Cancelled`
+        """
+        token = cancellation.CancelToken(timeout, parent=cancel_token)
+        call_stats = self._stats = stats.CallStats()
+        began = time.perf_counter()
+        try:
+            return self._get(index, token)
+        finally:
+            call_stats.wall_seconds = time.perf_counter() - began
+            token.close()
+
+    def plan(self, index):
+        """
+        Work out what getting a selection would do, without reading or
+        reducing any data (only the metadata of the file, once): its
+        chunks, the bytes to read, the requests each storage backend would
+        make, the ranged reads coalescing saves and the memory needed.
+
+        :param index: the selection
+        :returns: a `planning.Plan`
+        """
+        self._load_kerchunk()
+        selection = self._prepare_selection(index)
+        return self._plan_selection(selection[0], selection[2], selection[-1])
+
+    def _plan_selection(self, stripped_indexer, out_shape, fsref):
+        """
+        Return the `planning.Plan` of the chunks of a selection, routed by
+        the cost model with s3_mode "auto".
+        """
+        chunks = [(chunk_coords, *self._get_chunk_ref(fsref, chunk_coords),
+                   planning.selected_elements(chunk_selection,
+                                              self.zds._chunks))
+                  for chunk_coords, chunk_selection, _ in stripped_indexer]
+        if self.storage_type != "s3":
+            backend = "local"
+        elif not self._use_reductionist():
+            backend = "s3"
+        elif self._s3_mode == "auto":
+            backend = "auto"
+        else:
+            backend = "reductionist"
+        plan = planning.Plan(chunks, self.zds._chunks, self._dtype,
+                             out_shape, method=self.method, backend=backend,
+                             batch_size=self._batch_size,
+                             max_inflight_bytes=self._max_inflight_bytes,
+                             max_threads=self._max_threads)
+        if backend == "auto":
+            self._cost_model.route(plan, self._batch_size)
+        return plan
+
+    def _get(self, index, cancel_token):
         # In version one this is done by explicitly looping over each chunk in the file
         # and returning the requested slice ourselves. In version 2, we can pass this
         # through to the default method.
@@ -132,6 +312,7 @@ class Active:
 
         if self.method is None and self._version == 0:
             # No active operation
+            cancel_token.check()
             lock = self.lock
             if lock:
                 lock.acquire()
@@ -151,7 +332,7 @@ class Active:
             return data
         
         elif self._version == 1:
-            return self._via_kerchunk(index)
+            return self._via_kerchunk(index, cancel_token)
         
         elif self._version  == 2:
             # No active operation either
@@ -159,7 +340,7 @@ class Active:
             if lock:
                 lock.acquire()
 
-            data = self._via_kerchunk(index)
+            data = self._via_kerchunk(index, cancel_token)
 
             if lock:
                 lock.release()
@@ -169,6 +350,93 @@ class Active:
         else:
             raise ValueError(f'Version {self._version} not supported')
 
+    async def aget(self, index, timeout=None, cancel_token=None):
+        """
+        Provides support for a standard get item, for use in an asyncio
+        event loop, without blocking it.
+
+        Instead of a thread pool, chunks are processed as tasks on the
+        running loop: Reductionist requests are made with an asynchronous
+        HTTP client and local reads are offloaded to the loop's default
+        executor. At most max_threads chunks are in flight at any time.
+
+        timeout and cancel_token are as for get; requests in flight are
+        aborted. Cancelling the task awaiting this also aborts it.
+        """
+        loop = asyncio.get_running_loop()
+        token = cancellation.CancelToken(timeout, parent=cancel_token)
+        call_stats = self._stats = stats.CallStats()
+        began = time.perf_counter()
+        task = asyncio.ensure_future(self._aget(index, token))
+
+        def cancel():
+            loop.call_soon_threadsafe(task.cancel)
+
+        token.add_callback(cancel)
+        timer = None
+        if token.deadline is not None:
+            timer = loop.call_later(token.remaining(), token.cancel)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if token.cancelled:
+                token.check()
+            raise
+        finally:
+            call_stats.wall_seconds = time.perf_counter() - began
+            if timer is not None:
+                timer.cancel()
+            token.remove_callback(cancel)
+            token.close()
+
+    async def _aget(self, index, cancel_token):
+        loop = asyncio.get_running_loop()
+        if self._version not in (1, 2):
+            # netCDF4 and h5netcdf reads block, so run them elsewhere
+            return await loop.run_in_executor(
+                None, functools.partial(self.get, index,
+                                        cancel_token=cancel_token))
+
+        lock = self.lock if self._version == 2 else False
+        if lock:
+            await loop.run_in_executor(None, lock.acquire)
+        try:
+            with self._stats.timer("metadata"):
+                await loop.run_in_executor(None, self._load_kerchunk)
+            return await self._afrom_storage(
+                *self._prepare_selection(index),
+                resume_key=self._resume_key(index))
+        finally:
+            if lock:
+                lock.release()
+
+    @property
+    def concurrency(self):
+        """
+        Adaptive limit on the requests in flight to the active storage
+        server (the first of a pool), at most max_threads, shared with other
+        Active instances using the same server. Its stats() report the
+        current limit and the observed throughput.
+        """
+        return self._get_controller(self._get_pool().servers[0])
+
+    @property
+    def chunk_paths(self):
+        """
+        Return how each chunk of the last call was reduced, as a dict of
+        chunk coordinates to "reductionist", "client" or "cache".
+        """
+        return dict(self._chunk_paths)
+
+    @property
+    def stats(self):
+        """
+        Return the `stats.CallStats` of the last call: the chunks touched,
+        the bytes read, decoded and returned, the time spent in each stage
+        and a histogram of chunk latencies.
+        """
+        return self._stats
+
     @property
     def components(self):
         """Return or set the components flag.
@@ -255,14 +523,23 @@ class Active:
         """
         raise NotImplementedError
 
-    def _via_kerchunk(self, index):
+    def _via_kerchunk(self, index, cancel_token=None):
         """ 
         The objective is to use kerchunk to read the slices ourselves. 
         """
+        with self._stats.timer("metadata"):
+            self._load_kerchunk()
+        return self._get_selection(index, cancel_token=cancel_token)
+
+    def _load_kerchunk(self):
+        """
+        Kerchunk the file, once, and keep the Zarr Array of the variable
+        and its attributes.
+        """
         # FIXME: Order of calls is hardcoded'
         if self.zds is None:
-            print(f"Kerchunking file {self.uri} with variable "
-                  f"{self.ncvar} for storage type {self.storage_type}")
+            logger.debug("Kerchunking file %s with variable %s for storage "
+                         "type %s", self.uri, self.ncvar, self.storage_type)
             ds, zarray, zattrs = nz.load_netcdf_zarr_generic(
                 self.uri,
                 self.ncvar,
@@ -274,6 +551,12 @@ class Active:
             # self.zds = make_an_array_instance_active(ds)
             self.zds = ds
 
+            # Contiguous variables come out of kerchunk as a single chunk,
+            # so split them up to read only what we need, in parallel.
+            if self._contiguous_chunk_size:
+                zarray = nz.split_contiguous(ds, self.ncvar, zarray,
+                                             self._contiguous_chunk_size)
+
             # Retain attributes and other information
             if zarray.get('fill_value') is not None:
                 zattrs['_FillValue'] = zarray['fill_value']
@@ -284,10 +567,14 @@ class Active:
             # FIXME: We do not get the correct byte order on the Zarr
             # Array's dtype when using S3, so capture it here.
             self._dtype = np.dtype(zarray['dtype'])
-            
-        return self._get_selection(index)
 
-    def _get_selection(self, *args):
+    def _get_selection(self, *args, cancel_token=None):
+        """Read (and reduce) a selection from storage."""
+        return self._from_storage(*self._prepare_selection(*args),
+                                  resume_key=self._resume_key(*args),
+                                  cancel_token=cancel_token)
+
+    def _prepare_selection(self, *args):
         """ 
         First we need to convert the selection into chunk coordinates,
         steps etc, via the Zarr machinery, then we get everything else we can
@@ -333,67 +620,443 @@ class Active:
         # fsref = self.zds.chunk_store._mutable_mapping.fs.references 
         fsref = self.zds.chunk_store.fs.references
 
-        return self._from_storage(stripped_indexer, drop_axes, out_shape,
-                                  out_dtype, compressor, filters, missing, fsref)
+        return (stripped_indexer, drop_axes, out_shape, out_dtype,
+                compressor, filters, missing, fsref)
 
     def _from_storage(self, stripped_indexer, drop_axes, out_shape, out_dtype,
-                      compressor, filters, missing, fsref):
-        method = self.method
-        if method is not None:
+                      compressor, filters, missing, fsref, resume_key=None,
+                      cancel_token=None):
+        out, counts, completed = self._resume_from(resume_key, out_shape,
+                                                   out_dtype)
+        self._choose_path(compressor, filters)
+        self._routes = self._route(stripped_indexer, out_shape, fsref)
+        self._templates = {}
+        self._etags = {}
+        self._codecs = (compressor, filters, missing)
+
+        # Get a session object, shared with other calls and Active instances.
+        if self._use_reductionist():
+            session = sessions.get_session(*self._get_credentials(),
+                                           S3_ACTIVE_STORAGE_CACERT,
+                                           http2=self._use_http2())
+        else:
+            session = None
+        # Chunks completed by a call that failed are not read again.
+        pending = [item for item in stripped_indexer
+                   if item[0] not in completed]
+        reader = self._new_reader(pending, fsref)
+
+        if cancel_token is None:
+            cancel_token = cancellation.CancelToken()
+        cancel_token.check()
+        # Completes when the token is cancelled, to stop waiting for chunks.
+        stopped = concurrent.futures.Future()
+
+        def stop():
+            stopped.set_result(None)
+
+        cancel_token.add_callback(stop)
+
+        # Chunks are started as memory allows, and the number waiting for
+        # a thread is kept small so that they can be cancelled quickly.
+        chunks = collections.deque(self._batches(pending, fsref))
+        memory = self._memory = backpressure.MemoryBudget(self._max_inflight_bytes)
+        max_queued = 2 * self._max_threads
+
+        # Process storage chunks using a thread pool.
+        errors = []
+        hedger = self._new_hedger()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_threads)
+        cancelled = False
+        try:
+            futures = {}
+            while True:
+                # Submit chunks for processing while there is memory for them.
+                while chunks and len(futures) < max_queued:
+                    batch = chunks[0]
+                    nbytes = sum(self._chunk_memory(fsref, item[0])
+                                 for item in batch)
+                    if not memory.fits(nbytes):
+                        break
+                    chunks.popleft()
+                    memory.take(nbytes)
+                    if len(batch) == 1:
+                        chunk_coords, chunk_selection, out_selection = batch[0]
+                        future = executor.submit(
+                            self._process_chunk,
+                            session, fsref, chunk_coords, chunk_selection,
+                            counts, out_selection,
+                            compressor, filters, missing,
+                            drop_axes=drop_axes, hedger=hedger,
+                            cancel_token=cancel_token, reader=reader,
+                            out=out if self.method is None else None)
+                    else:
+                        future = executor.submit(
+                            self._process_batch,
+                            session, fsref, batch, compressor, filters,
+                            missing, drop_axes=drop_axes,
+                            cancel_token=cancel_token, reader=reader)
+                    futures[future] = batch, nbytes
+                if not futures:
+                    break
+
+                # Wait for completion, cancellation or the deadline.
+                done, _ = concurrent.futures.wait(
+                    [*futures, stopped], timeout=cancel_token.remaining(),
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                cancel_token.check()
+                for future in done:
+                    batch, nbytes = futures.pop(future)
+                    if future.cancelled():
+                        memory.release(nbytes)
+                        continue
+                    try:
+                        results = future.result()
+                    except reductionist.BatchesUnsupported:
+                        # Send the chunks of the batch on their own.
+                        memory.release(nbytes)
+                        chunks.extendleft([item] for item in reversed(batch))
+                        continue
+                    except Exception as exc:
+                        results = [exc]
+                    else:
+                        if len(batch) == 1:
+                            results = [results]
+                    for (chunk_coords, _, _), result in zip(batch, results):
+                        if not isinstance(result, Exception):
+                            completed.add(chunk_coords)
+                            self._collect(out, counts, result)
+                            continue
+                        errors.append(result)
+                        # Carry on with the other chunks after transient
+                        # errors, but not after errors every chunk is
+                        # likely to get.
+                        if not reductionist.is_retryable(result):
+                            chunks.clear()
+                            for other in futures:
+                                other.cancel()
+                    memory.release(nbytes)
+        except cancellation.Cancelled:
+            cancelled = True
+            # Chunks still running give up at their next check.
+            cancel_token.cancel()
+            self._keep_completed(resume_key, out, counts, completed)
+            raise
+        finally:
+            cancel_token.remove_callback(stop)
+            # Don't wait for requests in flight when cancelled.
+            executor.shutdown(wait=not cancelled, cancel_futures=True)
+            if hedger is not None:
+                hedger.close()
+
+        self._finish(resume_key, out, counts, completed, errors)
+        with self._stats.timer("aggregate"):
+            return self._aggregate(out, counts, out_shape)
+
+    def _new_hedger(self):
+        """Return a Hedger of the Reductionist requests of one call, or None."""
+        if not self._use_reductionist() or not self._hedge_quantile:
+            self._hedger = None
+        else:
+            self._hedger = hedging.Hedger(quantile=self._hedge_quantile,
+                                          max_workers=2 * self._max_threads)
+        return self._hedger
+
+    def _resume_key(self, *args):
+        """Return what identifies a selection and reduction."""
+        return pickle.dumps((self.ncvar, args, self._method))
+
+    def _resume_from(self, resume_key, out_shape, out_dtype):
+        """
+        Return the output, counts and coordinates of the chunks already
+        processed for the selection and reduction resume_key by a call that
+        failed, or a new output, counts and no chunks.
+        """
+        if resume_key is not None and self._resume is not None:
+            key, out, counts, completed = self._resume
+            if key == resume_key:
+                return out, counts, set(completed)
+        out, counts = self._new_output(out_shape, out_dtype)
+        return out, counts, set()
+
+    def _keep_completed(self, resume_key, out, counts, completed):
+        """
+        Keep the output of the chunks processed by a call that failed, so
+        that the next call for the same selection and reduction only
+        processes the other chunks.
+        """
+        if resume_key is not None:
+            self._resume = (resume_key, out, counts, completed)
+
+    def _finish(self, resume_key, out, counts, completed, errors):
+        """Raise the first error, if any, keeping the completed chunks."""
+        if errors:
+            self._keep_completed(resume_key, out, counts, completed)
+            raise errors[0]
+        self._resume = None
+
+    def _new_output(self, out_shape, out_dtype):
+        """Return the (empty) output and list of counts for a selection."""
+        if self.method is not None:
             out = []
             counts = []
         else:
             out = np.empty(out_shape, dtype=out_dtype, order=self.zds._order)
             counts = None  # should never get touched with no method!
+        return out, counts
 
-        # Create a shared session object.
-        if self.storage_type == "s3":
-            if self.storage_options is not None:
-                key, secret = None, None
-                if "key" in self.storage_options:
-                    key = self.storage_options["key"]
-                if "secret" in self.storage_options:
-                    secret = self.storage_options["secret"]
-                if key and secret:
-                    session = reductionist.get_session(key, secret,
-                                                       S3_ACTIVE_STORAGE_CACERT)
-                else:
-                    session = reductionist.get_session(S3_ACCESS_KEY, S3_SECRET_KEY,
-                                                       S3_ACTIVE_STORAGE_CACERT)
-            else:
-                session = reductionist.get_session(S3_ACCESS_KEY, S3_SECRET_KEY,
-                                                   S3_ACTIVE_STORAGE_CACERT)
+    def _collect(self, out, counts, result):
+        """Add the result of processing a chunk to the output."""
+        if self.method is not None:
+            result, count = result
+            out.append(result)
+            counts.append(count)
         else:
+            # store selected data in output, unless already there
+            result, selection = result
+            if result is not None:
+                out[selection] = result
+
+    async def _afrom_storage(self, stripped_indexer, drop_axes, out_shape,
+                             out_dtype, compressor, filters, missing, fsref,
+                             resume_key=None):
+        """Asynchronous version of _from_storage."""
+        out, counts, completed = self._resume_from(resume_key, out_shape,
+                                                   out_dtype)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._choose_path, compressor, filters)
+        self._routes = self._route(stripped_indexer, out_shape, fsref)
+        self._templates = {}
+        self._etags = {}
+        self._codecs = (compressor, filters, missing)
+        # Chunks completed by a call that failed are not read again.
+        pending = [item for item in stripped_indexer
+                   if item[0] not in completed]
+        chunks = iter(await asyncio.get_running_loop().run_in_executor(
+            None, self._batches, pending, fsref))
+        errors = []
+        stop = asyncio.Event()
+        hedger = self._new_hedger()
+        reader = self._new_reader(pending, fsref)
+        memory = self._memory = backpressure.MemoryBudget(self._max_inflight_bytes)
+
+        async def worker(session):
+            # Workers share the chunk iterator, so there are never more
+            # than max_threads chunks in flight, and wait for memory for
+            # their next chunk.
+            for batch in chunks:
+                nbytes = sum(self._chunk_memory(fsref, item[0])
+                             for item in batch)
+                await memory.acquire(nbytes)
+                try:
+                    if len(batch) == 1:
+                        chunk_coords, chunk_selection, out_selection = batch[0]
+                        results = [await self._aprocess_chunk(
+                            session, fsref, chunk_coords, chunk_selection,
+                            out_selection, compressor, filters, missing,
+                            drop_axes=drop_axes, hedger=hedger,
+                            reader=reader,
+                            out=out if self.method is None else None)]
+                    else:
+                        results = await self._aprocess_batch(
+                            session, fsref, batch, compressor, filters,
+                            missing, drop_axes=drop_axes, reader=reader)
+                except Exception as exc:
+                    results = [exc]
+                memory.release(nbytes)
+                for (chunk_coords, _, _), result in zip(batch, results):
+                    if not isinstance(result, Exception):
+                        completed.add(chunk_coords)
+                        self._collect(out, counts, result)
+                        continue
+                    errors.append(result)
+                    # Stop all workers after errors every chunk is likely
+                    # to get.
+                    if not reductionist.is_retryable(result):
+                        stop.set()
+                        return
+
+        async with contextlib.AsyncExitStack() as stack:
             session = None
-
-        # Process storage chunks using a thread pool.
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_threads) as executor:
-            futures = []
-            # Submit chunks for processing.
-            for chunk_coords, chunk_selection, out_selection in stripped_indexer:
-                future = executor.submit(
-                    self._process_chunk,
-                    session, fsref, chunk_coords, chunk_selection,
-                    counts, out_selection,
-                    compressor, filters, missing,
-                    drop_axes=drop_axes)
-                futures.append(future)
-            # Wait for completion.
-            for future in concurrent.futures.as_completed(futures):
+            if self._use_reductionist():
+                session = await stack.enter_async_context(
+                    reductionist.get_async_session(*self._get_credentials(),
+                                                   S3_ACTIVE_STORAGE_CACERT,
+                                                   limit=self._max_threads))
+            nworkers = max(1, min(self._max_threads, len(stripped_indexer)))
+            tasks = [asyncio.ensure_future(worker(session))
+                     for _ in range(nworkers)]
+            try:
+                pending = tasks
+                while pending and not stop.is_set():
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                self._keep_completed(resume_key, out, counts, completed)
+                raise
+            finally:
+                # Also on cancellation of this coroutine.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._finish(resume_key, out, counts, completed, errors)
+        with self._stats.timer("aggregate"):
+            return self._aggregate(out, counts, out_shape)
+
+    async def _aprocess_chunk(self, session, fsref, chunk_coords,
+                              chunk_selection, out_selection, compressor,
+                              filters, missing, drop_axes=None, hedger=None,
+                              reader=None, out=None):
+        """Asynchronous version of _process_chunk."""
+        began = time.perf_counter()
+        rfile, offset, size = self._get_chunk_ref(fsref, chunk_coords)
+        dest = self._destination(out, out_selection, hedger)
+
+        remote = self._reduces_remotely(chunk_coords)
+        key, cached = None, None
+        if remote and self._result_cache is not None:
+            key, cached = await asyncio.get_running_loop().run_in_executor(
+                None, self._cache_lookup, rfile, offset, size,
+                chunk_selection, compressor, filters, missing)
+        if cached is not None:
+            tmp, count = cached
+        elif remote:
+            source, bucket, object, template = self._get_request_template(
+                rfile, compressor, filters, missing)
+            dest_kwargs = {} if dest is None else {"out": dest}
+
+            async def reduction(server):
+                requested = time.perf_counter()
+                result = await reductionist.areduce_chunk(
+                    session, server, source, bucket, object, offset, size,
+                    compressor, filters, missing, self._dtype,
+                    self.zds._chunks, self.zds._order, chunk_selection,
+                    operation=self._method, template=template, **dest_kwargs)
+                self._observe_reductionist(requested, [size], [result])
+                return result
+
+            async def request(server, hedge=False):
+                # Hedges are few, and must not wait for the request they hedge.
+                if hedge:
+                    return await reduction(server)
+                async with self._get_controller(server).aslot():
+                    return await reduction(server)
+
+            async def attempt():
+                # Each attempt goes to the first healthy server for the object.
+                server, hedge_server = self._pick_servers(bucket, object)
                 try:
-                    result = future.result()
+                    if hedger is None:
+                        result = await request(server)
+                    else:
+                        result = await hedger.acall(
+                            functools.partial(request, server),
+                            functools.partial(request, hedge_server,
+                                              hedge=True))
                 except Exception as exc:
+                    self._request_failed(server, exc)
                     raise
-                else:
-                    if method is not None:
-                        result, count = result
-                        out.append(result)
-                        counts.append(count)
-                    else:
-                        # store selected data in output
-                        result, selection = result
-                        out[selection] = result
-
+                self._get_pool().succeeded(server)
+                return result
+
+            requested = time.perf_counter()
+            try:
+                tmp, count = await retry.acall(attempt,
+                                               reductionist.is_retryable,
+                                               self._retries)
+            except Exception as exc:
+                self._stats.add_time("io", time.perf_counter() - requested)
+                if not self._falls_back(chunk_coords, exc):
+                    raise
+                remote = False
+            else:
+                self._stats.add_time("io", time.perf_counter() - requested)
+                self._cache_result(key, tmp, count)
+        if not remote:
+            loop = asyncio.get_running_loop()
+            tmp, count = await loop.run_in_executor(
+                None, functools.partial(self._reduce_chunk_here,
+                                        reader or self._fallback_reader,
+                                        rfile, offset, size, compressor,
+                                        filters, missing, chunk_selection))
+        self._chunk_paths[chunk_coords] = self._chunk_path(remote, cached)
+        self._record_chunk(began, size, tmp, cached is not None)
+        if out is not None:
+            return self._write_out(out, out_selection, dest, tmp)
+
+        return self._chunk_result(tmp, count, out_selection, drop_axes)
+
+    async def _aprocess_batch(self, session, fsref, batch, compressor,
+                              filters, missing, drop_axes=None, reader=None):
+        """Asynchronous version of _process_batch."""
+        bucket, object, requests_data, keys = self._batch_requests(
+            fsref, batch, compressor, filters, missing)
+        sizes = [self._get_chunk_ref(fsref, chunk_coords)[2]
+                 for chunk_coords, _, _ in batch]
+
+        async def attempt():
+            server, _ = self._pick_servers(bucket, object)
+            try:
+                async with self._get_controller(server).aslot():
+                    requested = time.perf_counter()
+                    result = await reductionist.areduce_chunks(
+                        session, server, requests_data,
+                        operation=self._method, split=False)
+                    self._observe_reductionist(requested, sizes, result)
+            except Exception as exc:
+                self._request_failed(server, exc)
+                raise
+            self._get_pool().succeeded(server)
+            return result
+
+        began = time.perf_counter()
+        try:
+            results = await retry.acall(attempt, reductionist.is_retryable,
+                                        self._retries)
+        except reductionist.BatchesUnsupported:
+            # Send the chunks on their own, at once.
+            return await asyncio.gather(*[
+                self._aprocess_chunk(session, fsref, chunk_coords,
+                                     chunk_selection, out_selection,
+                                     compressor, filters, missing,
+                                     drop_axes=drop_axes, reader=reader)
+                for chunk_coords, chunk_selection, out_selection in batch],
+                return_exceptions=True)
+        except Exception as exc:
+            results = [exc] * len(batch)
+        self._stats.add_time("io", time.perf_counter() - began)
+        processed = []
+        for item, key, size, result in zip(batch, keys, sizes, results):
+            chunk_coords, chunk_selection, out_selection = item
+            if isinstance(result, Exception):
+                try:
+                    result = await self._aprocess_chunk(
+                        session, fsref, chunk_coords, chunk_selection,
+                        out_selection, compressor, filters, missing,
+                        drop_axes=drop_axes, reader=reader)
+                except Exception as exc:
+                    result = exc
+            else:
+                self._cache_result(key, *result)
+                self._chunk_paths[chunk_coords] = "reductionist"
+                self._record_chunk(began, size, result[0])
+                result = self._chunk_result(*result, out_selection, drop_axes)
+            processed.append(result)
+        return processed
+
+    def _get_credentials(self):
+        """Return the S3 (username, password) to pass to Reductionist."""
+        if self.storage_options is not None:
+            key = self.storage_options.get("key")
+            secret = self.storage_options.get("secret")
+            if key and secret:
+                return key, secret
+        return S3_ACCESS_KEY, S3_SECRET_KEY
+
+    def _aggregate(self, out, counts, out_shape):
+        """Combine the per-chunk results of the active method, if any."""
+        method = self.method
         if method is not None:
             # Apply the method (again) to aggregate the result
             out = method(out)
@@ -448,7 +1111,8 @@ class Active:
 
     def _process_chunk(self, session, fsref, chunk_coords, chunk_selection, counts,
                        out_selection, compressor, filters, missing, 
-                       drop_axes=None):
+                       drop_axes=None, hedger=None, cancel_token=None,
+                       reader=None, out=None):
         """
         Obtain part or whole of a chunk.
 
@@ -457,67 +1121,460 @@ class Active:
 
         Note the need to use counts for some methods
 
+        When selecting data, out is the output array: the data is written
+        to it here (Reductionist responses being read straight into it when
+        possible) rather than returned.
         """
-        coord = '.'.join([str(c) for c in chunk_coords])
-        key = f"{self.ncvar}/{coord}"
-        rfile, offset, size = tuple(fsref[key])
+        if cancel_token is not None:
+            cancel_token.check()
+        began = time.perf_counter()
+        rfile, offset, size = self._get_chunk_ref(fsref, chunk_coords)
+        dest = self._destination(out, out_selection, hedger)
 
         # S3: pass in pre-configured storage options (credentials)
-        if self.storage_type == "s3":
-            print("S3 rfile is:", rfile)
-            parsed_url = urllib.parse.urlparse(rfile)
-            bucket = parsed_url.netloc
-            object = parsed_url.path
+        remote = self._reduces_remotely(chunk_coords)
+        key, cached = None, None
+        if remote:
+            key, cached = self._cache_lookup(rfile, offset, size,
+                                             chunk_selection, compressor,
+                                             filters, missing)
+        if cached is not None:
+            tmp, count = cached
+        elif remote:
+            source, bucket, object, template = self._get_request_template(
+                rfile, compressor, filters, missing)
             # FIXME: We do not get the correct byte order on the Zarr Array's dtype
             # when using S3, so use the value captured earlier.
             dtype = self._dtype
-            # for certain S3 servers rfile needs to contain the bucket eg "bucket/filename"
-            # as a result the parser above finds empty string bucket
-            if bucket == "":
-                bucket = os.path.dirname(object)
-                object = os.path.basename(object)
-            print("S3 bucket:", bucket)
-            print("S3 file:", object)
-            if self.storage_options is None:
-                tmp, count = reductionist.reduce_chunk(session,
-                                                       S3_ACTIVE_STORAGE_URL,
-                                                       S3_URL,
+            dest_kwargs = {} if dest is None else {"out": dest}
+
+            def request(server, hedge=False):
+                # Hedges are few, and must not wait for the request they hedge.
+                slot = (contextlib.nullcontext() if hedge
+                        else self._get_controller(server).slot())
+                with slot:
+                    # Requests in flight can't be aborted, but at least
+                    # they don't outlive the deadline.
+                    kwargs = {}
+                    if cancel_token is not None:
+                        cancel_token.check()
+                        if cancel_token.deadline is not None:
+                            kwargs["timeout"] = cancel_token.remaining()
+                    requested = time.perf_counter()
+                    result = reductionist.reduce_chunk(session,
+                                                       server,
+                                                       source,
                                                        bucket, object, offset,
-                                                       size, compressor, filters,
-                                                       missing, dtype,
+                                                       size, compressor,
+                                                       filters, missing, dtype,
                                                        self.zds._chunks,
                                                        self.zds._order,
                                                        chunk_selection,
-                                                       operation=self._method)
+                                                       operation=self._method,
+                                                       template=template,
+                                                       **dest_kwargs,
+                                                       **kwargs)
+                    self._observe_reductionist(requested, [size], [result])
+                    return result
+
+            def attempt():
+                # Each attempt goes to the first healthy server for the object.
+                server, hedge_server = self._pick_servers(bucket, object)
+                try:
+                    if hedger is None:
+                        result = request(server)
+                    else:
+                        result = hedger.call(
+                            functools.partial(request, server),
+                            functools.partial(request, hedge_server,
+                                              hedge=True))
+                except Exception as exc:
+                    self._request_failed(server, exc)
+                    raise
+                self._get_pool().succeeded(server)
+                return result
+
+            requested = time.perf_counter()
+            try:
+                tmp, count = retry.call(attempt,
+                                        reductionist.is_retryable,
+                                        self._retries)
+            except Exception as exc:
+                self._stats.add_time("io", time.perf_counter() - requested)
+                if not self._falls_back(chunk_coords, exc):
+                    raise
+                remote = False
             else:
-                # special case for "anon=True" buckets that work only with e.g.
-                # fs = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': S3_URL})
-                # where file uri = bucketX/fileY.mc
-                print("S3 Storage options to Reductionist:", self.storage_options)
-                if self.storage_options.get("anon", None) == True:
-                    bucket = os.path.dirname(parsed_url.path)  # bucketX
-                    object = os.path.basename(parsed_url.path)  # fileY
-                    print("S3 anon=True Bucket and File:", bucket, object)
-                tmp, count = reductionist.reduce_chunk(session,
-                                                       self.active_storage_url,
-                                                       self._get_endpoint_url(),
-                                                       bucket, object, offset,
-                                                       size, compressor, filters,
-                                                       missing, dtype,
-                                                       self.zds._chunks,
-                                                       self.zds._order,
-                                                       chunk_selection,
-                                                       operation=self._method)
-        else:
+                self._stats.add_time("io", time.perf_counter() - requested)
+                self._cache_result(key, tmp, count)
+        if not remote:
+            tmp, count = self._reduce_chunk_here(reader or self._fallback_reader,
+                                                 rfile, offset, size,
+                                                 compressor, filters, missing,
+                                                 chunk_selection)
+        self._chunk_paths[chunk_coords] = self._chunk_path(remote, cached)
+        self._record_chunk(began, size, tmp, cached is not None)
+        if out is not None:
+            return self._write_out(out, out_selection, dest, tmp)
+
+        return self._chunk_result(tmp, count, out_selection, drop_axes)
+
+    def _process_batch(self, session, fsref, batch, compressor, filters,
+                       missing, drop_axes=None, cancel_token=None,
+                       reader=None):
+        """
+        Obtain part or whole of a batch of chunks of the same object, with
+        one request to Reductionist.
+
+        Chunks without a result, because the server failed to process them
+        or the whole request failed, are then processed on their own.
+        Returns the result of each chunk, or the exception it raised.
+        Raises `reductionist.BatchesUnsupported` if the server does not have
+        the batch endpoint, for the chunks to be sent on their own at once.
+        """
+        if cancel_token is not None:
+            cancel_token.check()
+        bucket, object, requests_data, keys = self._batch_requests(
+            fsref, batch, compressor, filters, missing)
+        sizes = [self._get_chunk_ref(fsref, chunk_coords)[2]
+                 for chunk_coords, _, _ in batch]
+
+        def attempt():
+            server, _ = self._pick_servers(bucket, object)
+            try:
+                with self._get_controller(server).slot():
+                    kwargs = {}
+                    if cancel_token is not None:
+                        cancel_token.check()
+                        if cancel_token.deadline is not None:
+                            kwargs["timeout"] = cancel_token.remaining()
+                    requested = time.perf_counter()
+                    result = reductionist.reduce_chunks(
+                        session, server, requests_data,
+                        operation=self._method, split=False, **kwargs)
+                    self._observe_reductionist(requested, sizes, result)
+            except Exception as exc:
+                self._request_failed(server, exc)
+                raise
+            self._get_pool().succeeded(server)
+            return result
+
+        began = time.perf_counter()
+        try:
+            results = retry.call(attempt, reductionist.is_retryable,
+                                 self._retries)
+        except (cancellation.Cancelled, reductionist.BatchesUnsupported):
+            raise
+        except Exception as exc:
+            results = [exc] * len(batch)
+        self._stats.add_time("io", time.perf_counter() - began)
+        processed = []
+        for item, key, size, result in zip(batch, keys, sizes, results):
+            chunk_coords, chunk_selection, out_selection = item
+            if isinstance(result, Exception):
+                try:
+                    result = self._process_chunk(
+                        session, fsref, chunk_coords, chunk_selection, None,
+                        out_selection, compressor, filters, missing,
+                        drop_axes=drop_axes, cancel_token=cancel_token,
+                        reader=reader)
+                except cancellation.Cancelled:
+                    raise
+                except Exception as exc:
+                    result = exc
+            else:
+                self._cache_result(key, *result)
+                self._chunk_paths[chunk_coords] = "reductionist"
+                self._record_chunk(began, size, result[0])
+                result = self._chunk_result(*result, out_selection, drop_axes)
+            processed.append(result)
+        return processed
+
+    def _batches(self, items, fsref):
+        """
+        Split the chunks of a call into units of work: with batch_size,
+        batches of chunks of the same object sent to Reductionist in one
+        request, else single chunks.
+        """
+        if not self._batch_size or not self._use_reductionist():
+            return [[item] for item in items]
+        by_file = {}
+        single = []
+        supported = {}
+        for item in items:
+            chunk_coords, chunk_selection, _ = item
+            # Chunks routed client side are processed on their own.
+            if not self._reduces_remotely(chunk_coords):
+                single.append([item])
+                continue
+            rfile, offset, size = self._get_chunk_ref(fsref, chunk_coords)
+            if rfile not in supported:
+                _, bucket, object = self._get_reductionist_target(rfile)
+                server, _ = self._pick_servers(bucket, object)
+                supported[rfile] = reductionist.supports_batches(server)
+            key = self._cache_key(rfile, offset, size, chunk_selection,
+                                  *self._codecs)
+            # Cached chunks are served on their own, from the cache, as are
+            # chunks for a server without the batch endpoint.
+            if (not supported[rfile]
+                    or key is not None and self._result_cache.contains(key)):
+                single.append([item])
+            else:
+                by_file.setdefault(rfile, []).append(item)
+        return single + [group[start:start + self._batch_size]
+                         for group in by_file.values()
+                         for start in range(0, len(group), self._batch_size)]
+
+    def _batch_requests(self, fsref, batch, compressor, filters, missing):
+        """
+        Return the bucket and object of a batch of chunks, and the
+        Reductionist request data and result cache key of each chunk.
+        """
+        requests_data = []
+        keys = []
+        for chunk_coords, chunk_selection, _ in batch:
+            rfile, offset, size = self._get_chunk_ref(fsref, chunk_coords)
+            _, bucket, object, template = self._get_request_template(
+                rfile, compressor, filters, missing)
+            requests_data.append(template.encode(offset, size,
+                                                 chunk_selection))
+            keys.append(self._cache_key(rfile, offset, size, chunk_selection,
+                                        compressor, filters, missing))
+        return bucket, object, requests_data, keys
+
+    def _get_request_template(self, rfile, compressor, filters, missing):
+        """
+        Return the S3 URL, bucket and object of the file rfile, and the
+        Reductionist request template of the chunks of the variable in it,
+        made once per call.
+        """
+        target = self._templates.get(rfile)
+        if target is None:
+            source, bucket, object = self._get_reductionist_target(rfile)
+            # FIXME: We do not get the correct byte order on the Zarr
+            # Array's dtype when using S3, so use the value captured earlier.
+            template = reductionist.RequestTemplate(
+                source, bucket, object, compressor, filters, missing,
+                self._dtype, self.zds._chunks, self.zds._order)
+            target = self._templates.setdefault(
+                rfile, (source, bucket, object, template))
+        return target
+
+    def _cache_key(self, rfile, offset, size, chunk_selection, compressor,
+                   filters, missing):
+        """Return the result cache key of a chunk request, or None if
+        results are not cached."""
+        if self._result_cache is None:
+            return None
+        etag = self._get_etag(rfile)
+        if etag is None:
+            return None
+        template = self._get_request_template(rfile, compressor, filters,
+                                              missing)[3]
+        return result_cache.cache_key(
+            self._method, template.encode(offset, size, chunk_selection), etag)
+
+    def _cache_lookup(self, rfile, offset, size, chunk_selection, compressor,
+                      filters, missing):
+        """Return the result cache key of a chunk request and its cached
+        (result, count), or None."""
+        key = self._cache_key(rfile, offset, size, chunk_selection,
+                              compressor, filters, missing)
+        if key is None:
+            return None, None
+        return key, self._result_cache.get(key)
+
+    def _cache_result(self, key, tmp, count):
+        """Cache the result of a chunk request."""
+        if key is not None:
+            self._result_cache.put(key, tmp, count)
+
+    def _get_etag(self, rfile):
+        """
+        Return the ETag of the object rfile, once per call, or None if it
+        has none.
+        """
+        if rfile not in self._etags:
+            fs = sessions.get_s3_filesystem(self.storage_options)
+            try:
+                info = fs.info(rfile)
+            except (OSError, ValueError) as exc:
+                logger.warning("Not caching results of %s: %s", rfile, exc)
+                info = {}
+            self._etags[rfile] = info.get("ETag") or info.get("etag")
+        return self._etags[rfile]
+
+    def _observe_reductionist(self, began, sizes, results):
+        """
+        Record a Reductionist request, started at began once it had a
+        slot, for the cost model: the bytes of the chunks, of the given
+        sizes, and of their results, leaving out chunks that failed.
+        """
+        nbytes = sum(size + getattr(result[0], "nbytes", 0)
+                     for size, result in zip(sizes, results)
+                     if not isinstance(result, Exception))
+        if nbytes:
+            self._cost_model.observe_reductionist(
+                time.perf_counter() - began, nbytes)
+
+    def _record_chunk(self, began, size, tmp, cached=False):
+        """Add a chunk processed since began, of size bytes in storage, with
+        result tmp, to the stats of the call."""
+        decoded = 0
+        if not cached:
+            decoded = int(np.prod(self.zds._chunks)) * self.zds._dtype.itemsize
+        self._stats.add_chunk(0 if cached else size, decoded,
+                              getattr(tmp, "nbytes", 0),
+                              time.perf_counter() - began)
+
+    @staticmethod
+    def _chunk_path(remote, cached):
+        """Return how a chunk was reduced, for chunk_paths."""
+        if cached is not None:
+            return "cache"
+        return "reductionist" if remote else "client"
+
+    def _reduce_chunk_here(self, reader, rfile, offset, size, compressor,
+                           filters, missing, chunk_selection):
+        """
+        Read and reduce a chunk in this process: from a POSIX file, or with
+        a ranged read from S3 if reader is a `ranges.RangeReader`.
+        """
+        if reader is None:
             # note there is an ongoing discussion about this interface, and what it returns
             # see https://github.com/valeriupredoi/PyActiveStorage/issues/33
             # so neither the returned data or the interface should be considered stable
             # although we will version changes.
-            tmp, count = reduce_chunk(rfile, offset, size, compressor, filters,
-                                      missing, self.zds._dtype,
-                                      self.zds._chunks, self.zds._order,
-                                      chunk_selection, method=self.method)
+            return reduce_chunk(rfile, offset, size, compressor, filters,
+                                missing, self.zds._dtype,
+                                self.zds._chunks, self.zds._order,
+                                chunk_selection, method=self.method,
+                                stats=self._stats)
+        with self._stats.timer("io"):
+            chunk = reader.read(rfile, offset, size)
+        began = time.perf_counter()
+        # FIXME: We do not get the correct byte order on the Zarr Array's dtype
+        # when using S3, so use the value captured earlier.
+        result = reduce_chunk_bytes(chunk,
+                                    compressor, filters, missing, self._dtype,
+                                    self.zds._chunks, self.zds._order,
+                                    chunk_selection, method=self.method,
+                                    stats=self._stats)
+        self._cost_model.observe_decode(
+            time.perf_counter() - began,
+            int(np.prod(self.zds._chunks)) * self._dtype.itemsize)
+        return result
+
+    def _use_reductionist(self):
+        """Whether chunks are reduced by Reductionist (or routed)."""
+        return (self.storage_type == "s3"
+                and self._s3_mode in ("reductionist", "auto")
+                and self._fallback_reason is None)
+
+    def _reduces_remotely(self, chunk_coords):
+        """Whether a chunk is reduced by Reductionist, rather than routed
+        client side."""
+        if not self._use_reductionist():
+            return False
+        return self._routes is None or self._routes.get(chunk_coords, True)
+
+    def _route(self, stripped_indexer, out_shape, fsref):
+        """
+        With s3_mode "auto", return whether each chunk of a selection is
+        reduced by Reductionist, by chunk coordinates, whichever way the
+        cost model expects to be faster; else None.
+        """
+        if self._s3_mode != "auto" or not self._use_reductionist():
+            return None
+        routes = self._plan_selection(stripped_indexer, out_shape,
+                                      fsref).routes
+        logger.debug("Routed %d of %d chunks to Reductionist",
+                     sum(routes.values()), len(routes))
+        return routes
+
+    def _choose_path(self, compressor, filters):
+        """
+        With fallback, or s3_mode "auto", check before a call whether
+        Reductionist can reduce its chunks, and if not, reduce them all
+        client side.
+        """
+        self._fallback_reason = None
+        self._chunk_paths = {}
+        if (not (self._fallback or self._s3_mode == "auto")
+                or not self._use_reductionist()):
+            return
+        reason = reductionist.unsupported(compressor, filters, self._dtype)
+        if reason is None:
+            session = sessions.get_session(*self._get_credentials(),
+                                           S3_ACTIVE_STORAGE_CACERT,
+                                           http2=self._use_http2())
+            reason = self._get_pool().check(session)
+        if reason is not None:
+            logger.warning("Reducing all chunks client side: %s", reason)
+        self._fallback_reason = reason
+
+    def _falls_back(self, chunk_coords, exc):
+        """
+        Return whether a chunk whose Reductionist request failed with exc
+        is reduced client side instead. If no server is left in the pool,
+        the chunks not yet started are too.
+        """
+        if (not self._fallback or isinstance(exc, cancellation.Cancelled)
+                or not reductionist.is_overload(exc)):
+            return False
+        logger.warning("Reducing chunk %s client side: %s", chunk_coords, exc)
+        if not self._get_pool().healthy_servers():
+            self._fallback_reason = f"No Reductionist server available: {exc}"
+        return True
+
+    def _request_failed(self, server, exc):
+        """Record a failed Reductionist request, for server ejection."""
+        if not isinstance(exc, cancellation.Cancelled):
+            self._get_pool().failed(server, exc)
+
+    def _new_reader(self, stripped_indexer, fsref):
+        """
+        Return a RangeReader of the chunks of a selection still to be
+        processed, for reductions done client side of data in S3, or None.
+        """
+        self._reader = self._fallback_reader = None
+        if self.storage_type != "s3":
+            pass
+        elif not self._use_reductionist() or self._routes is not None:
+            # The chunks reduced client side, nearby ones read together.
+            fs = sessions.get_s3_filesystem(self.storage_options)
+            self._reader = ranges.RangeReader(
+                fs, [self._get_chunk_ref(fsref, chunk_coords)
+                     for chunk_coords, _, _ in stripped_indexer
+                     if not self._reduces_remotely(chunk_coords)],
+                observer=self._cost_model.observe_fetch)
+        elif self._fallback:
+            # Only for the chunks that fall back, read one at a time.
+            fs = sessions.get_s3_filesystem(self.storage_options)
+            self._fallback_reader = ranges.RangeReader(
+                fs, [], observer=self._cost_model.observe_fetch)
+        return self._reader
+
+    def _chunk_memory(self, fsref, chunk_coords):
+        """
+        Estimate the memory needed to process a chunk: its compressed and
+        decoded data, or when Reductionist does that, the data it returns.
+        """
+        nbytes = int(np.prod(self.zds._chunks)) * self.zds._dtype.itemsize
+        size = self._get_chunk_ref(fsref, chunk_coords)[2]
+        return planning.chunk_memory(size, nbytes,
+                                     self._reduces_remotely(chunk_coords),
+                                     self.method)
+
+    def _get_chunk_ref(self, fsref, chunk_coords):
+        """Return the (file, offset, size) of a chunk."""
+        coord = '.'.join([str(c) for c in chunk_coords])
+        key = f"{self.ncvar}/{coord}"
+        return tuple(fsref[key])
 
+    def _chunk_result(self, tmp, count, out_selection, drop_axes):
+        """Return the reduced chunk and its count, or the selected data and
+        where it goes in the output."""
         if self.method is not None:
             return tmp, count
         else:
@@ -525,6 +1582,108 @@ class Active:
                 tmp = np.squeeze(tmp, axis=drop_axes)
             return tmp, out_selection
 
+    @staticmethod
+    def _destination(out, out_selection, hedger):
+        """
+        Return where in the output the data selected from a chunk goes,
+        for Reductionist to read it into, or None.
+
+        Not with hedging, as the request that loses may still be writing,
+        nor when the output selection has integer arrays, as indexing with
+        them makes a copy rather than a view of the output.
+        """
+        if (out is None or hedger is not None
+                or not Active._basic_selection(out_selection)):
+            return None
+        return out[out_selection]
+
+    @staticmethod
+    def _basic_selection(selection):
+        """Whether a selection is only slices and integers, so that
+        indexing an array with it gives a view."""
+        if not isinstance(selection, tuple):
+            selection = (selection,)
+        return all(isinstance(item, (slice, int, np.integer))
+                   for item in selection)
+
+    @staticmethod
+    def _write_out(out, out_selection, dest, tmp):
+        """
+        Write the data selected from a chunk to the output, unless it was
+        read there already, and return the result of the chunk as written.
+        """
+        # Dropped axes are of length 1, so reshaping drops them.
+        if dest is None and not Active._basic_selection(out_selection):
+            out[out_selection] = np.reshape(tmp, out[out_selection].shape)
+        else:
+            if dest is None:
+                dest = out[out_selection]
+            if tmp is not dest:
+                dest[...] = np.reshape(tmp, dest.shape)
+        return None, out_selection
+
+    def _get_pool(self):
+        """Return the pool of Reductionist servers."""
+        if self.storage_options is None:
+            urls = S3_ACTIVE_STORAGE_URL
+        else:
+            urls = self.active_storage_url
+        if urls is None or isinstance(urls, str):
+            urls = [urls]
+        if self._pool is None or self._pool.servers != list(urls):
+            self._pool = servers.ServerPool(urls)
+        return self._pool
+
+    def _use_http2(self):
+        """
+        Return whether to multiplex requests over HTTP/2. It is only
+        negotiated over TLS, and over HTTP/1.1 the few connections of an
+        HTTP/2 session would limit the requests in flight.
+        """
+        return self._http2 and all((server or "").startswith("https://")
+                                   for server in self._get_pool().servers)
+
+    def _get_controller(self, server):
+        """Return the concurrency limit of a Reductionist server."""
+        return concurrency.get_controller(server, self._max_threads)
+
+    def _pick_servers(self, bucket, object):
+        """
+        Return the Reductionist server for a request for a chunk of an
+        object, and the server to send a hedge of that request to.
+        """
+        order = self._get_pool().servers_for(bucket, object)
+        hedge_server = self._hedge_server or order[min(1, len(order) - 1)]
+        return order[0], hedge_server
+
+    def _get_reductionist_target(self, rfile):
+        """
+        Return the S3 URL, bucket and object for a chunk of the file rfile.
+        """
+        parsed_url = urllib.parse.urlparse(rfile)
+        bucket = parsed_url.netloc
+        object = parsed_url.path
+        # for certain S3 servers rfile needs to contain the bucket eg "bucket/filename"
+        # as a result the parser above finds empty string bucket
+        if bucket == "":
+            bucket = os.path.dirname(object)
+            object = os.path.basename(object)
+        if self.storage_options is None:
+            logger.debug("S3 bucket and object of %s: %s %s", rfile, bucket,
+                         object)
+            return S3_URL, bucket, object
+
+        # special case for "anon=True" buckets that work only with e.g.
+        # fs = s3fs.S3FileSystem(anon=True, client_kwargs={'endpoint_url': S3_URL})
+        # where file uri = bucketX/fileY.mc
+        if self.storage_options.get("anon", None) == True:
+            bucket = os.path.dirname(parsed_url.path)  # bucketX
+            object = os.path.basename(parsed_url.path)  # fileY
+        # Not the storage options themselves, which hold credentials.
+        logger.debug("S3 bucket and object of %s: %s %s (anon=%s)", rfile,
+                     bucket, object, self.storage_options.get("anon", False))
+        return self._get_endpoint_url(), bucket, object
+
     def _mask_data(self, data, ds_var):
         """ppp"""
         # TODO: replace with cfdm.NetCDFIndexer, hopefully.
@@ -0,0 +1,59 @@
+"""
+Bound on the memory used by the chunks being processed.
+
+Limiting the number of threads does not limit memory: with large chunks,
+each one decoded in memory (and, when selecting data, held until it is
+copied to the output), a hundred threads can use tens of GB. The chunks of
+a selection are therefore only started while the memory they are estimated
+to need fits in a MemoryBudget, and more are started as it is released.
+"""
+import asyncio
+import collections
+
+
+# Default bound on the memory used by the chunks being processed
+MAX_INFLIGHT_BYTES = 2 * 1024 ** 3
+
+
+class MemoryBudget:
+    """
+    Bytes in use by the chunks being processed, and their bound.
+
+    A chunk always fits when nothing else is in flight, so chunks larger
+    than the bound are processed one at a time. Not thread safe: use from
+    the thread, or event loop, that schedules the chunks.
+
+    :param limit: bound in bytes, or None for no bound
+    """
+
+    def __init__(self, limit=MAX_INFLIGHT_BYTES):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self._waiters = collections.deque()
+
+    def fits(self, nbytes):
+        """Return whether nbytes more can be used now."""
+        return (self.limit is None or self.in_use == 0
+                or self.in_use + nbytes <= self.limit)
+
+    def take(self, nbytes):
+        """Use nbytes, whether they fit or not."""
+        self.in_use += nbytes
+        self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes):
+        """Stop using nbytes."""
+        self.in_use -= nbytes
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def acquire(self, nbytes):
+        """Wait until nbytes fit, and use them."""
+        while not self.fits(nbytes):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        self.take(nbytes)
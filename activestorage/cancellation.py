@@ -0,0 +1,89 @@
+"""
+Cancellation and deadlines for Active operations.
+
+A CancelToken is passed to Active.get or Active.aget, and can be cancelled
+from any thread to abort the operation: no more chunks are started, those
+waiting are dropped and the call raises Cancelled without waiting for
+requests in flight. A token can also carry a deadline, after which the call
+raises DeadlineExceeded.
+"""
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Raised by an operation that was cancelled."""
+
+
+class DeadlineExceeded(Cancelled, TimeoutError):
+    """Raised by an operation that did not finish before its deadline."""
+
+
+class CancelToken:
+    """
+    Cancels an operation, on request or at a deadline.
+
+    :param timeout: seconds from now to the deadline, or None for no
+                    deadline
+    :param parent: another token; cancelling it cancels this one
+    """
+
+    def __init__(self, timeout=None, parent=None):
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        if parent is not None and parent.deadline is not None:
+            if self.deadline is None or parent.deadline < self.deadline:
+                self.deadline = parent.deadline
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._parent = parent
+        if parent is not None:
+            parent.add_callback(self.cancel)
+
+    def cancel(self):
+        """Cancel the operation. Safe to call from any thread, repeatedly."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    @property
+    def cancelled(self):
+        """Whether cancel() was called on this token or its parent."""
+        return self._event.is_set()
+
+    def remaining(self):
+        """Return the seconds left until the deadline (at least 0), or None."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Raise Cancelled or DeadlineExceeded if the operation should stop."""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceeded("Deadline exceeded")
+        if self._event.is_set():
+            raise Cancelled("Operation cancelled")
+
+    def add_callback(self, callback):
+        """Call callback (with no arguments) when the token is cancelled, or
+        now if it already is."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        """Forget a callback added with add_callback."""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def close(self):
+        """Stop following the parent token, once the operation is over."""
+        if self._parent is not None:
+            self._parent.remove_callback(self.cancel)
@@ -0,0 +1,244 @@
+"""
+Adaptive concurrency control for requests to an active storage server.
+
+A fixed number of requests in flight is either too many for a small
+Reductionist deployment (requests queue, and eventually fail with 5xx
+errors) or too few for a large one. AIMDController adapts the limit the
+way TCP congestion control does:
+
+* slow start: until the first decrease, the limit grows by one for every
+  request completed, i.e. doubles every round trip, so that it gets to a
+  large deployment's capacity within a few round trips;
+* additive increase: after that, while latency stays close to the lowest latency seen,
+  the limit grows by about one for every limit requests completed, i.e. by
+  one per round trip;
+* multiplicative decrease: on an overload error (5xx, timeout, connection
+  failure) the limit is halved, and when latency rises well above the
+  lowest seen it is cut by a smaller factor. It is decreased at most once
+  per round trip, since requests in flight when the server got overloaded
+  all see it.
+
+Threads wait for a slot with slot(), tasks in an asyncio event loop with
+aslot(); both can share a controller.
+"""
+import asyncio
+import collections
+import contextlib
+import threading
+import time
+
+from activestorage import reductionist
+
+
+# Limit on requests in flight before any have completed
+INITIAL_LIMIT = 8
+
+# Latency above this multiple of the lowest seen means the server is queueing
+LATENCY_TOLERANCE = 2.0
+
+# Factors applied to the limit on an overload error and on rising latency
+ERROR_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+
+# Weight of a new latency in the smoothed latency
+SMOOTHING = 0.2
+
+# Period over which throughput is measured, in seconds
+THROUGHPUT_WINDOW = 10.0
+
+
+class AIMDController:
+    """
+    Additive increase, multiplicative decrease limit on requests in flight.
+
+    :param initial: limit to start from
+    :param minimum: lowest limit
+    :param maximum: highest limit
+    :param is_overload: function of an exception raised by a request,
+                        returning True if it means the server is overloaded;
+                        by default every exception does
+    :param slow_start: whether to double the limit every round trip until
+                       the first decrease, rather than add one
+    """
+
+    def __init__(self, initial=INITIAL_LIMIT, minimum=1, maximum=100,
+                 is_overload=None, slow_start=True):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.is_overload = is_overload or (lambda exc: True)
+        self.slow_start = slow_start
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.requests = 0
+        self.errors = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._completions = collections.deque()
+        self._condition = threading.Condition()
+        self._async_waiters = collections.deque()
+
+    def _try_acquire(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """Wait until a request can be made."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def aacquire(self):
+        """Wait in the running event loop until a request can be made."""
+        loop = asyncio.get_running_loop()
+        while not self._try_acquire():
+            waiter = loop.create_future()
+            with self._condition:
+                self._async_waiters.append((loop, waiter))
+            # A slot may have been freed before the waiter was added
+            if self._try_acquire():
+                break
+            await waiter
+
+    def release(self, started, error=None, record=True):
+        """
+        Record the outcome of a request and free its slot.
+
+        :param started: time.perf_counter() when the request was made
+        :param error: the exception the request raised, if any
+        :param record: False if the request was abandoned, so says nothing
+                       about the server
+        """
+        now = time.perf_counter()
+        latency = now - started
+        with self._condition:
+            self.in_flight -= 1
+            if record:
+                self.requests += 1
+                self._completions.append(now)
+                if error is None:
+                    self._update(now, latency)
+                elif self.is_overload(error):
+                    self.errors += 1
+                    self._decrease(now, ERROR_DECREASE)
+            while self._completions and self._completions[0] < now - THROUGHPUT_WINDOW:
+                self._completions.popleft()
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, collections.deque()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def _update(self, now, latency):
+        """Update the latency estimates and the limit after a success."""
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            # let the baseline follow a server that got slower for good
+            self.baseline_latency += 0.01 * (latency - self.baseline_latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += SMOOTHING * (latency - self.latency)
+
+        if self.latency > LATENCY_TOLERANCE * self.baseline_latency:
+            self._decrease(now, LATENCY_DECREASE)
+        elif self.slow_start:
+            self.limit = min(self.limit + 1.0, self.maximum)
+        else:
+            self.limit = min(self.limit + 1.0 / self.limit, self.maximum)
+
+    def _decrease(self, now, factor):
+        # at most once per round trip
+        if now - self._last_decrease < (self.latency or 0.0):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.slow_start = False
+        self.limit = max(self.limit * factor, self.minimum)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Context manager making one request."""
+        self.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as exc:
+            self.release(started, exc)
+            raise
+        self.release(started)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        """Asynchronous context manager making one request."""
+        await self.aacquire()
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # not the server's fault
+            self.release(started, record=False)
+            raise
+        except BaseException as exc:
+            self.release(started, exc)
+            raise
+        self.release(started)
+
+    def throughput(self):
+        """Requests completed per second over the last few seconds."""
+        with self._condition:
+            if len(self._completions) < 2:
+                return 0.0
+            elapsed = time.perf_counter() - self._completions[0]
+            return len(self._completions) / max(elapsed, 1e-9)
+
+    def stats(self):
+        """Return the current limit, requests in flight and throughput."""
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "baseline_latency": self.baseline_latency,
+            "throughput": self.throughput(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "decreases": self.decreases,
+            "slow_start": self.slow_start,
+        }
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_lock = threading.Lock()
+_controllers = {}
+
+
+def get_controller(server, maximum=100):
+    """
+    Return the controller of requests to a server, shared by everything
+    making requests to it with the same maximum.
+
+    :param server: server URL
+    :param maximum: highest limit on requests in flight
+    """
+    key = (server, maximum)
+    with _lock:
+        controller = _controllers.get(key)
+        if controller is None:
+            controller = AIMDController(maximum=maximum,
+                                        is_overload=reductionist.is_overload)
+            _controllers[key] = controller
+        return controller
+
+
+def clear_controllers():
+    """Forget all controllers, and what they learnt about their servers."""
+    with _lock:
+        _controllers.clear()
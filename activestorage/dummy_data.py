@@ -85,6 +85,14 @@ def make_byte_order_ncdata(filename='test_vanilla.nc', chunksize=(3, 3, 1), n=10
     return make_ncdata(filename, chunksize, n, byte_order=byte_order)
 
 
+def make_contiguous_ncdata(filename='test_contiguous.nc', n=10):
+    """
+    Make a vanilla test dataset whose data variable is stored contiguously
+    (unchunked) rather than in HDF5 chunks.
+    """
+    return make_ncdata(filename, None, n, contiguous=True)
+
+
 def make_vanilla_ncdata(filename='test_vanilla.nc', chunksize=(3, 3, 1), n=10):
     """
     Make a vanilla test dataset which is three dimensional with indices and values that
@@ -101,7 +109,8 @@ def make_ncdata(filename, chunksize, n, compression=None,
                 valid_max=None,
                 partially_missing_data=False,
                 shuffle=False,
-                byte_order='native'):
+                byte_order='native',
+                contiguous=False):
     """ 
     If compression is required, it can be passed in via keyword
     and is applied to all variables.
@@ -121,6 +130,9 @@ def make_ncdata(filename, chunksize, n, compression=None,
 
     byte_order: Byte order (endianness) of the data. Must be 'big', 'little',
                 or 'native'.
+
+    contiguous: if True, store the data variable contiguously (no chunking,
+                so chunksize is ignored); cannot be combined with compression.
     """
     if partially_missing_data and not missing:
         raise ValueError(f'Missing data value keyword provided and set to {missing} '
@@ -150,7 +162,8 @@ def make_ncdata(filename, chunksize, n, compression=None,
                              compression=compression,
                              shuffle=shuffle,
                              fill_value=fillvalue,
-                             endian=byte_order)
+                             endian=byte_order,
+                             contiguous=contiguous)
 
     dvar[:] = data
 
@@ -0,0 +1,171 @@
+"""
+Hedged requests, to cut the tail latency of a job made of many requests.
+
+The time taken by a reduction is that of its slowest chunk requests, and a
+few requests stuck behind a slow disk or a busy server can take many times
+longer than the rest. A Hedger measures the latency of the requests of a
+job and, once a request has taken longer than a high quantile of those, makes
+the same request again (possibly to another server) and takes whichever
+answer comes first. Only a small fraction of requests are ever duplicated,
+so the extra load on the servers is bounded.
+"""
+import asyncio
+import bisect
+import concurrent.futures
+import threading
+import time
+
+
+# Quantile of the latencies seen after which a request is hedged
+QUANTILE = 0.95
+
+# Requests measured before any is hedged
+MIN_SAMPLES = 20
+
+# Upper bound on hedged requests, as a fraction of all requests
+MAX_FRACTION = 0.05
+
+
+class Hedger:
+    """
+    Hedges the requests of one job.
+
+    :param quantile: quantile of the latencies seen so far after which a
+                     request is hedged
+    :param min_samples: number of latencies to measure before hedging
+    :param max_fraction: upper bound on the fraction of requests hedged
+    :param max_workers: upper bound on the threads making hedged requests
+                        for call(); requests are made in the calling thread
+                        until hedging starts
+    """
+
+    def __init__(self, quantile=QUANTILE, min_samples=MIN_SAMPLES,
+                 max_fraction=MAX_FRACTION, max_workers=100):
+        self.quantile = quantile
+        self.min_samples = max(1, min_samples)
+        self.max_fraction = max_fraction
+        self.max_workers = max_workers
+        self.latencies = []
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def delay(self):
+        """Return how long to wait before hedging, or None not to."""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            index = min(int(self.quantile * len(self.latencies)),
+                        len(self.latencies) - 1)
+            return self.latencies[index]
+
+    def _start(self):
+        with self._lock:
+            self.requests += 1
+
+    def _take_hedge(self):
+        """Return whether there is budget left for one more hedge."""
+        with self._lock:
+            if self.hedges + 1 > self.max_fraction * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def _won(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def _record(self, started):
+        with self._lock:
+            bisect.insort(self.latencies, time.perf_counter() - started)
+
+    def _timed(self, func):
+        started = time.perf_counter()
+        result = func()
+        self._record(started)
+        return result
+
+    async def _atimed(self, func):
+        started = time.perf_counter()
+        result = await func()
+        self._record(started)
+        return result
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            return self._executor
+
+    def call(self, func, hedge_func):
+        """
+        Call func, or hedge_func as well if func takes too long, and return
+        the first result. If both fail, raise the error of func.
+
+        :param func: function of no arguments making a request
+        :param hedge_func: function of no arguments making the same request
+        """
+        self._start()
+        delay = self.delay()
+        if delay is None:
+            return self._timed(func)
+
+        executor = self._get_executor()
+        primary = executor.submit(self._timed, func)
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        if done or not self._take_hedge():
+            return primary.result()
+        hedge = executor.submit(self._timed, hedge_func)
+        # The loser can't be aborted, but its result is not waited for.
+        for future in concurrent.futures.as_completed([primary, hedge]):
+            if future.exception() is None:
+                if future is hedge:
+                    self._won()
+                return future.result()
+        return primary.result()
+
+    async def acall(self, func, hedge_func):
+        """As call, for coroutine functions; the loser is cancelled."""
+        self._start()
+        delay = self.delay()
+        if delay is None:
+            return await self._atimed(func)
+
+        primary = asyncio.ensure_future(self._atimed(func))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait([primary], timeout=delay)
+            if done or not self._take_hedge():
+                return await primary
+            hedge = asyncio.ensure_future(self._atimed(hedge_func))
+            tasks.append(hedge)
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._won()
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self):
+        """Stop waiting for the requests that lost."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self):
+        """Return the number of requests, hedges and hedges that won."""
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "delay": self.delay(),
+        }
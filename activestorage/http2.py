@@ -0,0 +1,182 @@
+"""
+HTTP/2 transport for the Reductionist client.
+
+A requests.Session makes one TCP (and TLS) connection per request in
+flight, so a client with 100 threads holds 100 connections to each
+Reductionist server, and so does every dask worker. Over HTTP/2, requests
+are multiplexed as streams over a few connections instead. HTTP2Session
+wraps an httpx.Client, which needs the optional httpx and h2 packages
+(pip install "httpx[http2]"), with the subset of the requests.Session API
+that the reductionist module uses, so that either can be used as a session.
+
+HTTP/2 is negotiated with TLS (ALPN): servers without it are spoken to
+with HTTP/1.1 on the same few connections, one request at a time each, so
+Active only uses an HTTP2Session for https servers.
+
+Streamed responses (selections read into place) are read as they arrive,
+as with requests.
+"""
+import io
+import json
+import threading
+
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Upper bound on the connections to each server; each carries many
+# requests at once over HTTP/2.
+MAX_CONNECTIONS = 4
+
+
+def _translate_errors(func):
+    """Call func, raising httpx transport errors as the requests exceptions
+    they correspond to."""
+    try:
+        return func()
+    except httpx.TimeoutException as exc:
+        raise requests.exceptions.Timeout(str(exc)) from exc
+    except httpx.TransportError as exc:
+        raise requests.exceptions.ConnectionError(str(exc)) from exc
+
+
+class StreamReader(io.RawIOBase):
+    """A file-like reader of the body of a streamed httpx.Response, like
+    the raw attribute of a streamed requests.Response."""
+
+    def __init__(self, response):
+        self._pieces = response.iter_bytes()
+        self._piece = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._piece:
+            piece = _translate_errors(lambda: next(self._pieces, None))
+            if piece is None:
+                return 0
+            self._piece = memoryview(piece)
+        size = min(len(buffer), len(self._piece))
+        buffer[:size] = self._piece[:size]
+        self._piece = self._piece[size:]
+        return size
+
+
+class Response:
+    """The parts of a requests.Response used by the reductionist module,
+    for an httpx.Response.
+
+    With stream, the body is left to be read from raw, as it arrives.
+    """
+
+    def __init__(self, response, stream=False):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.http_version = response.http_version
+        if stream:
+            self.raw = StreamReader(response)
+        else:
+            self.raw = io.BytesIO(response.content)
+
+    @property
+    def content(self):
+        if isinstance(self.raw, StreamReader):
+            return _translate_errors(self._response.read)
+        return self._response.content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def close(self):
+        if isinstance(self.raw, StreamReader):
+            self._response.close()
+
+    def json(self):
+        try:
+            return json.loads(self.content)
+        except ValueError as exc:
+            raise requests.exceptions.JSONDecodeError(
+                str(exc), self.content.decode(errors="replace"), 0) from exc
+
+
+class HTTP2Session:
+    """
+    A Reductionist client session multiplexing requests over HTTP/2.
+
+    Safe to share between threads. Transport errors are raised as the
+    requests exceptions they correspond to, so that retries, health checks
+    and fallbacks treat them the same.
+
+    :param username: S3 username / access key
+    :param password: S3 password / secret key
+    :param cacert: Reductionist CA certificate path
+    :param max_connections: upper bound on the connections to each server
+    :param headers: headers sent with every request
+    """
+
+    def __init__(self, username, password, cacert,
+                 max_connections=MAX_CONNECTIONS, headers=None):
+        if httpx is None:
+            raise ImportError('HTTP/2 needs httpx and h2: '
+                              'pip install "httpx[http2]"')
+        self.headers = dict(headers or {})
+        self._client = httpx.Client(
+            http2=True,
+            auth=(username, password),
+            verify=cacert or False,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            timeout=None,
+        )
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.http2_responses = 0
+
+    def post(self, url, data=None, json=None, headers=None, timeout=None,
+             stream=False):
+        """Post data (bytes) or json, like requests.Session.post."""
+        return self._request("POST", url, content=data, json=json,
+                             headers=headers, timeout=timeout, stream=stream)
+
+    def get(self, url, headers=None, timeout=None):
+        """Get a URL, like requests.Session.get."""
+        return self._request("GET", url, headers=headers, timeout=timeout)
+
+    def _request(self, method, url, headers=None, timeout=None,
+                 stream=False, **kwargs):
+        headers = {**self.headers, **(headers or {})}
+        request = self._client.build_request(method, url, headers=headers,
+                                             timeout=timeout, **kwargs)
+        response = _translate_errors(
+            lambda: self._client.send(request, stream=stream))
+        with self._lock:
+            self.requests += 1
+            if response.http_version == "HTTP/2":
+                self.http2_responses += 1
+        return Response(response, stream=stream)
+
+    def connections(self):
+        """Return the number of connections open, or None if unknown."""
+        pool = getattr(self._client._transport, "_pool", None)
+        if pool is None:
+            return None
+        return len(pool.connections)
+
+    def stats(self):
+        """Return the requests made, how many were answered over HTTP/2,
+        and the connections open."""
+        with self._lock:
+            return {"requests": self.requests,
+                    "http2_responses": self.http2_responses,
+                    "connections": self.connections()}
+
+    def close(self):
+        """Close all connections."""
+        self._client.close()
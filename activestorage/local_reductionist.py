@@ -0,0 +1,317 @@
+"""
+In-process stand-in for a Reductionist server, for testing and benchmarks.
+
+The S3 code path (requests to Reductionist, retries, batches, concurrency)
+normally needs a live object store and Reductionist server. A
+LocalReductionist serves the same API from a thread of the current process,
+over local files: the object of a request is read from <root>/<bucket>/<object>
+and reduced with storage.reduce_chunk. Latency and errors can be injected,
+to load test the client against slow or failing servers without a network.
+
+    with LocalReductionist(root, latency=0.01, error_rate=0.05) as server:
+        active = Active(uri, "data", "s3", storage_options=options,
+                        active_storage_url=server.url)
+"""
+import http.server
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import numcodecs
+import numpy as np
+
+from activestorage import reductionist
+from activestorage import storage
+
+
+# Reduction of each operation; select has none
+OPERATIONS = {
+    "select": None,
+    "min": np.min,
+    "max": np.max,
+    "sum": np.sum,
+    "count": np.size,
+}
+
+
+class RequestError(Exception):
+    """A request that can't be processed, and its HTTP status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_missing(missing):
+    """Decode the missing data of a request into the 4-tuple used by
+    storage.reduce_chunk, the inverse of reductionist.encode_missing."""
+    if not missing:
+        return (None, None, None, None)
+    missing_value = missing.get("missing_value", missing.get("missing_values"))
+    valid_min, valid_max = missing.get("valid_range",
+                                       (missing.get("valid_min"),
+                                        missing.get("valid_max")))
+    return (None, missing_value, valid_min, valid_max)
+
+
+def decode_codecs(request_data):
+    """Return the numcodecs compression codec and filters of a request."""
+    compression = request_data.get("compression")
+    if compression is not None:
+        if compression["id"] not in reductionist.SUPPORTED_COMPRESSION:
+            raise RequestError(400, f"Unsupported compression {compression}")
+        compression = numcodecs.get_codec(compression)
+    filters = []
+    for filter in request_data.get("filters", []):
+        if filter["id"] not in reductionist.SUPPORTED_FILTERS:
+            raise RequestError(400, f"Unsupported filter {filter}")
+        filters.append(numcodecs.Shuffle(elementsize=filter["element_size"]))
+    return compression, filters
+
+
+def reduce_request(root, operation, request_data):
+    """
+    Perform the operation of a request, with storage.reduce_chunk.
+
+    :param root: directory of the buckets
+    :param operation: name of the operation, a key of OPERATIONS
+    :param request_data: decoded JSON request data
+    :returns: the result as a numpy array and its count
+    :raises RequestError: if the request is invalid or the object missing
+    """
+    try:
+        path = os.path.join(root, request_data["bucket"],
+                            request_data["object"])
+        dtype = np.dtype(request_data["dtype"])
+        byte_order = request_data.get("byte_order")
+        if byte_order is not None:
+            dtype = dtype.newbyteorder("<" if byte_order == "little" else ">")
+        offset = request_data.get("offset", 0)
+        size = request_data.get("size")
+        if size is None:
+            size = os.path.getsize(path) - offset
+        shape = tuple(request_data.get("shape", (size // dtype.itemsize,)))
+        selection = tuple(slice(*s) for s in request_data.get(
+            "selection", [[None, None, None]] * len(shape)))
+        compression, filters = decode_codecs(request_data)
+        missing = decode_missing(request_data.get("missing"))
+    except (KeyError, TypeError, ValueError) as exc:
+        raise RequestError(400, f"Invalid request data: {exc}") from exc
+    except OSError as exc:
+        raise RequestError(404, f"No such object: {exc}") from exc
+    try:
+        result, count = storage.reduce_chunk(
+            path, offset, size, compression, filters, missing, dtype, shape,
+            request_data.get("order", "C"), selection, OPERATIONS[operation])
+    except FileNotFoundError as exc:
+        raise RequestError(404, f"No such object: {exc}") from exc
+    except (OSError, ValueError, RuntimeError) as exc:
+        raise RequestError(400, f"Failed to reduce chunk: {exc}") from exc
+    result = np.asarray(result)
+    if count is None:
+        count = result.size
+    return result, count
+
+
+class LocalReductionist:
+    """
+    A Reductionist API server over the files in a directory, in a thread.
+
+    :param root: directory of the buckets, each a directory of objects
+    :param latency: seconds added to every request
+    :param error_rate: fraction of chunk and batch requests answered with
+                       error_status instead
+    :param error_status: HTTP status code of injected errors
+    :param batches: whether to serve the batch endpoint
+    :param frames: whether to answer with framed responses when asked to
+    :param seed: optional seed of the injected errors
+    :param host: address to listen on; the port is chosen by the system
+    """
+
+    def __init__(self, root, latency=0.0, error_rate=0.0, error_status=503,
+                 batches=True, frames=True, seed=None, host="127.0.0.1"):
+        self.root = root
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.batches = batches
+        self.frames = frames
+        self.host = host
+        self.requests = 0
+        self.chunks = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """URL of the server, once started."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving requests, and return the URL of the server."""
+        handler = type("Handler", (_Handler,), {"reductionist": self})
+        self._server = http.server.ThreadingHTTPServer((self.host, 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """Stop serving requests."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        """Return the requests and chunks processed, errors injected and
+        the most requests handled at once."""
+        with self._lock:
+            return {"requests": self.requests, "chunks": self.chunks,
+                    "errors": self.errors,
+                    "peak_in_flight": self.peak_in_flight}
+
+    def _count(self, chunks):
+        """Count a request for chunks, and return whether to fail it."""
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            self.chunks += chunks
+            return False
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Handles the requests to a LocalReductionist."""
+
+    # Keep connections open between requests, as Reductionist does.
+    protocol_version = "HTTP/1.1"
+    reductionist = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == reductionist.HEALTH_PATH:
+            self._send(200, {"Content-Type": "application/json"},
+                       json.dumps({"openapi": "3.0.0"}).encode())
+        else:
+            self._send_error(404, f"No such path {self.path}")
+
+    def do_POST(self):
+        server = self.reductionist
+        with server._lock:
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight,
+                                        server.in_flight)
+        try:
+            self._post()
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+
+    def _post(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.reductionist
+        if server.latency:
+            time.sleep(server.latency)
+        parts = urllib.parse.urlparse(self.path).path.strip("/").split("/")
+        if (len(parts) not in (2, 3) or parts[0] != "v1"
+                or parts[1] not in OPERATIONS
+                or len(parts) == 3 and (parts[2] != "batch"
+                                        or not server.batches)):
+            self._send_error(404, f"No such path {self.path}")
+            return
+        operation = parts[1]
+        try:
+            request_data = json.loads(body)
+        except ValueError as exc:
+            self._send_error(400, f"Invalid JSON: {exc}")
+            return
+        if len(parts) == 3:
+            self._batch(operation, request_data.get("chunks", []))
+        else:
+            self._chunk(operation, request_data)
+
+    def _chunk(self, operation, request_data):
+        if self.reductionist._count(1):
+            self._send_error(self.reductionist.error_status, "Injected error")
+            return
+        try:
+            result, count = reduce_request(self.reductionist.root, operation,
+                                           request_data)
+        except RequestError as exc:
+            self._send_error(exc.status, str(exc))
+            return
+        accept = self.headers.get("Accept", "")
+        if self.reductionist.frames and reductionist.FRAME_MEDIA_TYPE in accept:
+            compression = None
+            if operation == "select":
+                compression = self._compression()
+            self._send(200, {"Content-Type": reductionist.FRAME_MEDIA_TYPE},
+                       reductionist.encode_frame(result, count, compression))
+            return
+        self._send(200, {
+            "Content-Type": "application/octet-stream",
+            "x-activestorage-dtype": result.dtype.name,
+            "x-activestorage-byte-order": reductionist.encode_byte_order(
+                result.dtype),
+            "x-activestorage-shape": json.dumps(result.shape),
+            "x-activestorage-count": json.dumps(count),
+        }, result.tobytes())
+
+    def _batch(self, operation, chunks):
+        if self.reductionist._count(len(chunks)):
+            self._send_error(self.reductionist.error_status, "Injected error")
+            return
+        results = []
+        for request_data in chunks:
+            try:
+                results.append(reduce_request(self.reductionist.root,
+                                              operation, request_data))
+            except RequestError as exc:
+                results.append((exc.status, {"message": str(exc)}))
+        self._send(200, {"Content-Type": "application/octet-stream"},
+                   reductionist.encode_batch(results))
+
+    def _compression(self):
+        """Return the first codec asked for that numcodecs has, or None."""
+        asked = self.headers.get(reductionist.COMPRESSION_HEADER, "")
+        for codec_id in (c.strip() for c in asked.split(",")):
+            try:
+                numcodecs.get_codec({"id": codec_id})
+            except (KeyError, ValueError):
+                continue
+            return codec_id
+        return None
+
+    def _send_error(self, status, message):
+        self._send(status, {"Content-Type": "application/json"},
+                   json.dumps({"error": {"message": message}}).encode())
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,281 @@
+"""
+Index netCDF3 (classic, 64-bit offset and 64-bit data) files.
+
+netCDF3 files are not HDF5 files, so kerchunk's SingleHdf5ToZarr can't read
+them. They are however never compressed, and the header tells us where every
+variable starts, so the byte range of any part of the data can be computed.
+This module parses the header and builds the same kind of reference
+dictionary that kerchunk produces, so that the rest of the stack (Zarr
+indexer, storage and Reductionist) does not know the difference.
+
+Non-record variables are stored contiguously and are described as a single
+chunk. Record variables are interleaved record by record, so each record is
+its own chunk, located at the start of the variable plus the record number
+times the size of a whole record.
+
+See https://docs.unidata.ucar.edu/netcdf-c/current/file_format_specifications.html
+"""
+import numpy as np
+import ujson
+
+
+MAGIC = b"CDF"
+
+# Header tags
+ABSENT = 0
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+# Number of records is not known (file still being written), in classic
+# and 64-bit offset files, and in CDF5 files where it is 64-bit
+STREAMING = 0xFFFFFFFF
+STREAMING_64 = 0xFFFFFFFFFFFFFFFF
+
+# netCDF3 external types, all big-endian
+NC_TYPES = {
+    1: ">i1",  # NC_BYTE
+    2: "S1",  # NC_CHAR
+    3: ">i2",  # NC_SHORT
+    4: ">i4",  # NC_INT
+    5: ">f4",  # NC_FLOAT
+    6: ">f8",  # NC_DOUBLE
+    7: ">u1",  # NC_UBYTE (CDF5 only)
+    8: ">u2",  # NC_USHORT (CDF5 only)
+    9: ">u4",  # NC_UINT (CDF5 only)
+    10: ">i8",  # NC_INT64 (CDF5 only)
+    11: ">u8",  # NC_UINT64 (CDF5 only)
+}
+
+# Fill value of a variable without a _FillValue attribute, by type: the
+# netCDF default fill values (NC_FILL_SHORT etc). As in netCDF4-python,
+# bytes and chars have none, since every value of them is commonly valid.
+DEFAULT_FILL_VALUES = {
+    ">i2": -32767,
+    ">i4": -2147483647,
+    ">f4": 9.9692099683868690e+36,
+    ">f8": 9.9692099683868690e+36,
+    ">u2": 65535,
+    ">u4": 4294967295,
+    ">i8": -9223372036854775806,
+    ">u8": 18446744073709551614,
+}
+
+
+def is_netcdf3(fileobj):
+    """Return True if the open file looks like a netCDF3 file."""
+    place = fileobj.tell()
+    magic = fileobj.read(4)
+    fileobj.seek(place)
+    return magic[:3] == MAGIC and magic[3:] in (b"\x01", b"\x02", b"\x05")
+
+
+def _padded(size):
+    """Round size up to the next 4-byte boundary."""
+    return -(-size // 4) * 4
+
+
+class _HeaderReader:
+    """Sequential reader of the big-endian values in a netCDF3 header."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        magic = fileobj.read(4)
+        if magic[:3] != MAGIC:
+            raise ValueError("Not a netCDF3 file: bad magic number")
+        self.version = magic[3]
+        if self.version not in (1, 2, 5):
+            raise ValueError(f"Unsupported netCDF3 version {self.version}")
+
+    def read(self, size):
+        data = self.fileobj.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated netCDF3 header")
+        return data
+
+    def int32(self):
+        return int(np.frombuffer(self.read(4), ">u4")[0])
+
+    def int64(self):
+        return int(np.frombuffer(self.read(8), ">u8")[0])
+
+    def nelems(self):
+        """A count; 64-bit in CDF5 files."""
+        return self.int64() if self.version == 5 else self.int32()
+
+    def offset(self):
+        """A file offset; 64-bit in 64-bit offset and CDF5 files."""
+        return self.int32() if self.version == 1 else self.int64()
+
+    def name(self):
+        size = self.nelems()
+        return self.read(_padded(size))[:size].decode("utf-8")
+
+    def values(self, nc_type, count):
+        dtype = np.dtype(NC_TYPES[nc_type])
+        data = self.read(_padded(count * dtype.itemsize))
+        return np.frombuffer(data[:count * dtype.itemsize], dtype)
+
+    def list_header(self, expected_tag):
+        tag = self.int32()
+        count = self.nelems()
+        if tag == ABSENT:
+            return 0
+        if tag != expected_tag:
+            raise ValueError(f"Bad netCDF3 header: got tag {tag}, "
+                             f"expected {expected_tag}")
+        return count
+
+    def attributes(self):
+        attrs = {}
+        for _ in range(self.list_header(NC_ATTRIBUTE)):
+            name = self.name()
+            nc_type = self.int32()
+            attrs[name] = self.values(nc_type, self.nelems())
+        return attrs
+
+
+def _decode_attribute(value):
+    """Convert an attribute to something JSON can encode."""
+    if value.dtype.kind == "S":
+        return value.tobytes().decode("utf-8", "replace").rstrip("\x00")
+    if value.dtype.kind == "f":
+        value = [None if np.isnan(v) else float(v) for v in value]
+    else:
+        value = [int(v) for v in value]
+    return value[0] if len(value) == 1 else value
+
+
+def read_header(fileobj):
+    """
+    Parse the header of a netCDF3 file.
+
+    Returns a dictionary with the format version ("version", 1, 2 or 5), the
+    global attributes ("attrs"), the number of records ("numrecs"), the
+    dimensions ("dims", name to length, with None for
+    the record dimension) and the variables ("variables", name to a
+    dictionary of dims, attrs, dtype and begin offset).
+    """
+    reader = _HeaderReader(fileobj)
+    numrecs = reader.nelems()
+
+    dims = []
+    for _ in range(reader.list_header(NC_DIMENSION)):
+        name = reader.name()
+        length = reader.nelems()
+        dims.append((name, length or None))
+
+    attrs = reader.attributes()
+
+    variables = {}
+    for _ in range(reader.list_header(NC_VARIABLE)):
+        name = reader.name()
+        dimids = [reader.nelems() for _ in range(reader.nelems())]
+        var_attrs = reader.attributes()
+        nc_type = reader.int32()
+        reader.nelems()  # vsize: unreliable for large variables, recomputed
+        begin = reader.offset()
+        if nc_type not in NC_TYPES:
+            raise ValueError(f"Unsupported netCDF3 type {nc_type} "
+                             f"for variable {name}")
+        variables[name] = {
+            "dims": [dims[i][0] for i in dimids],
+            "shape": [dims[i][1] for i in dimids],
+            "attrs": var_attrs,
+            "dtype": np.dtype(NC_TYPES[nc_type]),
+            "begin": begin,
+        }
+
+    return {
+        "version": reader.version,
+        "attrs": attrs,
+        "numrecs": numrecs,
+        "dims": dict(dims),
+        "variables": variables,
+    }
+
+
+def _record_layout(header, fileobj):
+    """
+    Return the size of one record and the number of records.
+
+    The record size is the sum of the padded per-record sizes of all the
+    record variables, except that there is no padding if there is only one
+    record variable.
+    """
+    record_vars = [var for var in header["variables"].values()
+                   if var["shape"] and var["shape"][0] is None]
+    sizes = [int(np.prod(var["shape"][1:])) * var["dtype"].itemsize
+             for var in record_vars]
+    if len(sizes) == 1:
+        recsize = sizes[0]
+    else:
+        recsize = sum(_padded(size) for size in sizes)
+
+    numrecs = header["numrecs"]
+    streaming = STREAMING_64 if header["version"] == 5 else STREAMING
+    if numrecs == streaming:
+        if recsize:
+            start = min(var["begin"] for var in record_vars)
+            numrecs = max(0, (fileobj.seek(0, 2) - start) // recsize)
+        else:
+            numrecs = 0
+    return recsize, numrecs
+
+
+def translate(fileobj, url):
+    """
+    Build a kerchunk-style reference dictionary for a netCDF3 file.
+
+    :param fileobj: open, seekable binary file-like object
+    :param url: location of the file, as it should appear in the references
+    :returns: dictionary of the form {"version": 1, "refs": {...}}
+    """
+    header = read_header(fileobj)
+    recsize, numrecs = _record_layout(header, fileobj)
+
+    refs = {
+        ".zgroup": ujson.dumps({"zarr_format": 2}),
+        ".zattrs": ujson.dumps({k: _decode_attribute(v)
+                                for k, v in header["attrs"].items()}),
+    }
+    for name, var in header["variables"].items():
+        attrs = {k: _decode_attribute(v) for k, v in var["attrs"].items()}
+        dtype = var["dtype"]
+        fill_value = attrs.pop("_FillValue",
+                               DEFAULT_FILL_VALUES.get(dtype.str))
+        attrs["_ARRAY_DIMENSIONS"] = var["dims"]
+
+        shape = list(var["shape"])
+        is_record = bool(shape) and shape[0] is None
+        if is_record:
+            shape[0] = numrecs
+            chunks = [1] + shape[1:]
+        else:
+            chunks = list(shape)
+        chunk_bytes = int(np.prod(chunks)) * dtype.itemsize
+
+        refs[f"{name}/.zarray"] = ujson.dumps({
+            "chunks": chunks,
+            "compressor": None,
+            "dtype": dtype.str,
+            "fill_value": fill_value,
+            "filters": None,
+            "order": "C",
+            "shape": shape,
+            "zarr_format": 2,
+        })
+        refs[f"{name}/.zattrs"] = ujson.dumps(attrs)
+
+        if not shape:
+            refs[f"{name}/0"] = [url, var["begin"], chunk_bytes]
+        elif is_record:
+            zeros = "".join(".0" for _ in shape[1:])
+            for record in range(numrecs):
+                refs[f"{name}/{record}{zeros}"] = [
+                    url, var["begin"] + record * recsize, chunk_bytes]
+        elif chunk_bytes:
+            key = ".".join(["0"] * len(shape))
+            refs[f"{name}/{key}"] = [url, var["begin"], chunk_bytes]
+
+    return {"version": 1, "refs": refs}
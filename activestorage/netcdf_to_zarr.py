@@ -1,14 +1,22 @@
+import logging
 import os
 import numpy as np
 import zarr
 import ujson
 import fsspec
-import s3fs
 import tempfile
 
 from activestorage.config import *
+from activestorage import netcdf3
+from activestorage import sessions
 from kerchunk.hdf import SingleHdf5ToZarr
 
+logger = logging.getLogger(__name__)
+
+# virtual chunks of at least this many bytes are worth having even when the
+# axis being split has no divisor close to the wanted chunk length
+MIN_VIRTUAL_CHUNK_SIZE = 32 * 1024
+
 
 def _correct_compressor_and_filename(content, varname, bryan_bucket=False):
     """
@@ -52,21 +60,33 @@ def _correct_compressor_and_filename(content, varname, bryan_bucket=False):
     return new_content
 
 
+def _translate(fileobj, file_url):
+    """
+    Index an open netCDF4/HDF5 or netCDF3 file into kerchunk references.
+
+    netCDF3 (classic) files are not HDF5, so kerchunk can't read them; we
+    compute their references ourselves.
+    """
+    if netcdf3.is_netcdf3(fileobj):
+        return netcdf3.translate(fileobj, file_url)
+
+    # inline threshold adjusts the Size below which binary blocks are
+    # included directly in the output
+    # a higher inline threshold can result in a larger json file but
+    # faster loading time
+    # for active storage, we don't want anything inline
+    h5chunks = SingleHdf5ToZarr(fileobj, file_url, inline_threshold=0)
+    return h5chunks.translate()
+
+
 def gen_json(file_url, varname, outf, storage_type, storage_options):
     """Generate a json file that contains the kerchunk-ed data for Zarr."""
     # S3 configuration presets
     if storage_type == "s3" and storage_options is None:
-        fs = s3fs.S3FileSystem(key=S3_ACCESS_KEY,
-                               secret=S3_SECRET_KEY,
-                               client_kwargs={'endpoint_url': S3_URL},
-                               default_fill_cache=False,
-                               default_cache_type="first"  # best for HDF5
-        )
+        fs = sessions.get_s3_filesystem()
         fs2 = fsspec.filesystem('')
-        with fs.open(file_url, 'rb') as s3file:
-            h5chunks = SingleHdf5ToZarr(s3file, file_url,
-                                        inline_threshold=0)
-
+        with fs.open(file_url, 'rb', fill_cache=False,
+                     cache_type="first") as s3file:  # best for HDF5
             # TODO absolute crap, this needs to go
             # see comments in _correct_compressor_and_filename
             bryan_bucket = False
@@ -74,7 +94,7 @@ def gen_json(file_url, varname, outf, storage_type, storage_options):
                 bryan_bucket = True
 
             with fs2.open(outf, 'wb') as f:
-                content = h5chunks.translate()
+                content = _translate(s3file, file_url)
                 content = _correct_compressor_and_filename(content,
                                                            varname,
                                                            bryan_bucket=bryan_bucket)
@@ -82,12 +102,10 @@ def gen_json(file_url, varname, outf, storage_type, storage_options):
 
     # S3 passed-in configuration
     elif storage_type == "s3" and storage_options is not None:
-        storage_options = storage_options.copy()
-        storage_options['default_fill_cache'] = False
-        storage_options['default_cache_type'] = "first"  # best for HDF5
-        fs = s3fs.S3FileSystem(**storage_options)
+        fs = sessions.get_s3_filesystem(storage_options)
         fs2 = fsspec.filesystem('')
-        with fs.open(file_url, 'rb') as s3file:
+        with fs.open(file_url, 'rb', fill_cache=False,
+                     cache_type="first") as s3file:  # best for HDF5
 
             # Kerchunk wants the correct file name in S3 format
             if not file_url.startswith("s3://"):
@@ -99,10 +117,8 @@ def gen_json(file_url, varname, outf, storage_type, storage_options):
             if "bnl" in file_url:
                 bryan_bucket = True
 
-            h5chunks = SingleHdf5ToZarr(s3file, file_url,
-                                        inline_threshold=0)
             with fs2.open(outf, 'wb') as f:
-                content = h5chunks.translate()
+                content = _translate(s3file, file_url)
                 content = _correct_compressor_and_filename(content,
                                                            varname,
                                                            bryan_bucket=bryan_bucket)
@@ -112,21 +128,13 @@ def gen_json(file_url, varname, outf, storage_type, storage_options):
         fs = fsspec.filesystem('')
         with fs.open(file_url, 'rb') as local_file:
             try:
-                h5chunks = SingleHdf5ToZarr(local_file, file_url,
-                                            inline_threshold=0)
+                content = _translate(local_file, file_url)
             except OSError as exc:
-                raiser_1 = f"Unable to open file {file_url}. "
-                raiser_2 = "Check if file is netCDF3 or netCDF-classic"
-                print(raiser_1 + raiser_2)
+                logger.error("Unable to open file %s. Check if file is "
+                             "netCDF4/HDF5 or netCDF3", file_url)
                 raise exc
 
-            # inline threshold adjusts the Size below which binary blocks are
-            # included directly in the output
-            # a higher inline threshold can result in a larger json file but
-            # faster loading time
-            # for active storage, we don't want anything inline
             with fs.open(outf, 'wb') as f:
-                content = h5chunks.translate()
                 content = _correct_compressor_and_filename(content,
                                                            varname,
                                                            bryan_bucket=False)
@@ -154,17 +162,109 @@ def open_zarr_group(out_json, varname):
     try:
         zarr_array = getattr(zarr_group, varname)
     except AttributeError as attrerr:
-        print(f"Zarr Group does not contain variable {varname}. "
-              f"Zarr Group info: {zarr_group.info}")
+        logger.error("Zarr Group does not contain variable %s. "
+                     "Zarr Group info: %s", varname, zarr_group.info)
         raise attrerr
     #print("Zarr array info:",  zarr_array.info)
     
     return zarr_array
 
 
-def load_netcdf_zarr_generic(fileloc, varname, storage_type, storage_options, build_dummy=True):
+def _virtual_chunk_shape(shape, itemsize, chunk_size):
+    """
+    Work out the shape of the virtual chunks for a contiguous variable.
+
+    Virtual chunks must each be a single contiguous run of bytes, so the
+    trailing axes are kept whole for as long as they fit into chunk_size, the
+    next axis is split and any leading axes get a chunk length of 1. The split
+    axis uses the largest divisor of its length that fits, so that there are
+    no partial edge chunks that would need to be padded. When the axis length
+    has no divisor near the wanted length (e.g. it is prime), the split is
+    still made as long as the chunks come to at least MIN_VIRTUAL_CHUNK_SIZE
+    bytes (or a quarter of chunk_size, if that is smaller).
+
+    Returns None if the variable should not be split.
+    """
+    chunks = list(shape)
+    inner = itemsize
+    for axis in reversed(range(len(shape))):
+        if inner * shape[axis] <= chunk_size:
+            inner *= shape[axis]
+            continue
+        wanted = max(1, chunk_size // inner)
+        divisors = set()
+        for d in range(1, int(shape[axis] ** 0.5) + 1):
+            if shape[axis] % d == 0:
+                divisors.update((d, shape[axis] // d))
+        length = max(d for d in divisors if d <= wanted)
+        # a prime-ish axis length would shatter a small variable into tiny
+        # chunks; better to keep it in one piece
+        if length * 4 < wanted and \
+                length * inner < min(MIN_VIRTUAL_CHUNK_SIZE, chunk_size // 4):
+            return None
+        chunks[axis] = length
+        for leading in range(axis):
+            chunks[leading] = 1
+        return chunks
+
+    # the whole variable fits in a single chunk anyway
+    return None
+
+
+def split_contiguous(zarr_array, varname, zarray, chunk_size):
+    """
+    Split a contiguously stored (unchunked) variable into virtual chunks.
+
+    Kerchunk presents a contiguous HDF5 dataset as one chunk that spans the
+    whole variable, which means that any selection reads all of it in a
+    single task. Since the data is neither compressed nor filtered, we can
+    compute the offset of any part of it, so we rewrite the references into
+    virtual chunks of at most chunk_size bytes, and reload the Zarr Array
+    metadata so that the indexer only visits the ones that are needed.
+
+    Returns the (possibly updated) zarray metadata dictionary.
+    """
+    if zarray["compressor"] is not None or zarray["filters"]:
+        return zarray
+    shape = zarray["shape"]
+    if not shape or list(zarray["chunks"]) != list(shape):
+        return zarray
+
+    refs = zarr_array.chunk_store.fs.references
+    key = f"{varname}/" + ".".join(["0"] * len(shape))
+    ref = refs.get(key)
+    if not isinstance(ref, list) or len(ref) != 3:
+        return zarray
+    rfile, offset, size = ref
+
+    itemsize = np.dtype(zarray["dtype"]).itemsize
+    if size != np.prod(shape) * itemsize:
+        return zarray
+    chunks = _virtual_chunk_shape(shape, itemsize, chunk_size)
+    if chunks is None:
+        return zarray
+
+    strides = [int(np.prod(shape[axis + 1:])) * itemsize
+               for axis in range(len(shape))]
+    chunk_bytes = int(np.prod(chunks)) * itemsize
+    del refs[key]
+    for coords in np.ndindex(*[s // c for s, c in zip(shape, chunks)]):
+        chunk_offset = offset + sum(i * c * stride for i, c, stride
+                                    in zip(coords, chunks, strides))
+        chunk_key = f"{varname}/" + ".".join([str(i) for i in coords])
+        refs[chunk_key] = [rfile, chunk_offset, chunk_bytes]
+
+    zarray = dict(zarray, chunks=chunks)
+    refs[f"{varname}/.zarray"] = ujson.dumps(zarray)
+    zarr_array._load_metadata()
+
+    return zarray
+
+
+def load_netcdf_zarr_generic(fileloc, varname, storage_type, storage_options,
+                             build_dummy=True):
     """Pass a netCDF4 file to be shaped as Zarr file by kerchunk."""
-    print(f"Storage type {storage_type}")
+    logger.debug("Storage type %s", storage_type)
 
     # Write the Zarr group JSON to a temporary file.
     with tempfile.NamedTemporaryFile() as out_json:
@@ -175,7 +275,7 @@ def load_netcdf_zarr_generic(fileloc, varname, storage_type, storage_options, bu
                                      storage_options)
 
         # open this monster
-        print(f"Attempting to open and convert {fileloc}.")
+        logger.debug("Attempting to open and convert %s.", fileloc)
         ref_ds = open_zarr_group(out_json.name, varname)
 
     return ref_ds, zarray, zattrs
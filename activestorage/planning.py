@@ -0,0 +1,175 @@
+"""
+Plans of Active selections: what a call would cost, from metadata alone.
+
+Active.plan(index) works out the chunks of a selection, as a call would,
+without reading or reducing any data, so that a scheduler can size a job
+(or reject it) before running it: the bytes to read, the requests each way
+of reading them would make, how many of those ranged reads coalescing would
+save, and the memory the call would need.
+"""
+import numpy as np
+
+from activestorage import backpressure
+from activestorage import ranges
+
+
+# Ways the chunks of a selection are read and reduced: local files, ranged
+# GETs from S3 reduced client side, requests to Reductionist, or either of
+# the last two, chunk by chunk (see the routing module).
+BACKENDS = ("local", "s3", "reductionist", "auto")
+
+
+def selected_elements(chunk_selection, chunk_shape):
+    """
+    Return the number of elements of a chunk in a selection.
+
+    :param chunk_selection: selection of the chunk, per dimension a slice,
+                            an integer or an array of integers or booleans
+    :param chunk_shape: shape of the chunk
+    """
+    count = 1
+    for selection, length in zip(chunk_selection, chunk_shape):
+        if isinstance(selection, slice):
+            count *= len(range(*selection.indices(length)))
+        elif np.ndim(selection):
+            selection = np.asarray(selection)
+            if selection.dtype == bool:
+                count *= int(np.count_nonzero(selection))
+            else:
+                count *= selection.size
+    return count
+
+
+def chunk_memory(size, chunk_nbytes, remote, method):
+    """
+    Estimate the memory needed to process a chunk: its compressed and
+    decoded data, or when Reductionist does that, the data it returns.
+
+    :param size: compressed size of the chunk in bytes
+    :param chunk_nbytes: decoded size of the chunk in bytes
+    :param remote: whether the chunk is reduced by Reductionist
+    :param method: the reduction, or None when selecting data
+    """
+    if remote:
+        return 0 if method is not None else chunk_nbytes
+    return size + chunk_nbytes
+
+
+class Plan:
+    """
+    What a call for a selection would do, from metadata alone.
+
+    :param chunks: list of (chunk_coords, file, offset, size, selected) of
+                   the chunks of the selection, selected being the number
+                   of their elements in it
+    :param chunk_shape: shape of the chunks
+    :param dtype: data type of the variable
+    :param out_shape: shape of the selection
+    :param method: the reduction, or None when selecting data
+    :param backend: how the chunks would be read, one of BACKENDS
+    :param batch_size: chunks of an object per Reductionist request, or None
+    :param max_inflight_bytes: bound on the memory of the chunks in flight
+    :param max_threads: number of chunks processed at once
+    :param routes: with the "auto" backend, whether each chunk would be
+                   reduced by Reductionist, by chunk coordinates, as set by
+                   `routing.CostModel.route`
+    """
+
+    def __init__(self, chunks, chunk_shape, dtype, out_shape, method=None,
+                 backend="local", batch_size=None,
+                 max_inflight_bytes=backpressure.MAX_INFLIGHT_BYTES,
+                 max_threads=100, routes=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, must be one of "
+                             f"{BACKENDS}")
+        self.chunks = chunks
+        self.backend = backend
+        self.method = method
+        self.out_shape = out_shape
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_threads = max_threads
+        self.routes = routes
+        self.itemsize = itemsize = np.dtype(dtype).itemsize
+        self.chunk_nbytes = int(np.prod(chunk_shape)) * itemsize
+        self.compressed_bytes = sum(chunk[3] for chunk in chunks)
+        self.decoded_bytes = len(chunks) * self.chunk_nbytes
+        self.selected_bytes = sum(chunk[4] for chunk in chunks) * itemsize
+
+        # Ranged GETs, with nearby chunks of an object read together.
+        self.coalesced = ranges.coalesce(chunk[1:4] for chunk in chunks)
+        fetched = sum(end - start for _, start, end, _ in self.coalesced)
+        unique = sum(len(members) for *_, members in self.coalesced)
+        self.coalescing = {
+            "ranges": unique,
+            "requests": len(self.coalesced),
+            "saved": unique - len(self.coalesced),
+            "gap_bytes": fetched - sum(size for *_, members in self.coalesced
+                                       for _, size in members),
+        }
+
+        # Reductionist requests, with batches of chunks of the same object.
+        per_file = {}
+        for chunk in chunks:
+            per_file[chunk[1]] = per_file.get(chunk[1], 0) + 1
+        if batch_size:
+            batches = sum(-(-n // batch_size) for n in per_file.values())
+        else:
+            batches = len(chunks)
+        self.requests = {"local": len(chunks),
+                         "s3": len(self.coalesced),
+                         "reductionist": batches}
+
+    @property
+    def memory(self):
+        """Estimated memory of a chunk, of the chunks in flight, of the
+        output and in total, in bytes."""
+        # The chunks in flight are bounded by the memory budget, and by the
+        # number of them queued for the threads.
+        memories = sorted((chunk_memory(chunk[3], self.chunk_nbytes,
+                                        self.remote(chunk[0]), self.method)
+                           for chunk in self.chunks), reverse=True)
+        inflight = sum(memories[:2 * self.max_threads])
+        if self.max_inflight_bytes is not None and memories:
+            inflight = min(inflight, max(self.max_inflight_bytes, memories[0]))
+        if self.method is None:
+            output = int(np.prod(self.out_shape)) * self.itemsize
+        else:
+            output = self.nchunks * self.itemsize
+        return {
+            "chunk": memories[0] if memories else 0,
+            "inflight": inflight,
+            "output": output,
+            "total": inflight + output,
+        }
+
+    def remote(self, chunk_coords):
+        """Return whether a chunk would be reduced by Reductionist."""
+        if self.routes is not None:
+            return self.routes.get(chunk_coords, False)
+        return self.backend == "reductionist"
+
+    @property
+    def nchunks(self):
+        """Number of chunks of the selection."""
+        return len(self.chunks)
+
+    def as_dict(self):
+        """Return the plan as a dict, without the list of chunks."""
+        plan = {
+            "backend": self.backend,
+            "chunks": self.nchunks,
+            "compressed_bytes": self.compressed_bytes,
+            "decoded_bytes": self.decoded_bytes,
+            "selected_bytes": self.selected_bytes,
+            "requests": dict(self.requests),
+            "coalescing": dict(self.coalescing),
+            "memory": self.memory,
+        }
+        if self.routes is not None:
+            remote = sum(self.routes.values())
+            plan["routes"] = {"reductionist": remote,
+                              "client": len(self.routes) - remote}
+        return plan
+
+    def __repr__(self):
+        return f"Plan({self.as_dict()})"
@@ -0,0 +1,113 @@
+"""
+Concurrent, coalesced reads of chunk byte ranges from object stores.
+
+Without an active storage server near the data, chunks are read with
+ranged GETs and reduced client side. Each request costs a round trip, so
+the ranges of chunks close together in an object are merged into one
+request, as long as the bytes in between that are read for nothing cost
+less than the request saved. RangeReader is shared by the threads (or
+tasks) processing the chunks of a selection: the first one to need a merged
+range fetches it, the others wait for it, and the data is dropped once the
+last of its chunks has been read.
+"""
+import threading
+import time
+
+
+# Largest gap between two ranges merged into one request
+MAX_GAP = 1024 * 1024
+
+# Largest merged request, to keep some parallelism and bound memory
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+def coalesce(ranges, max_gap=MAX_GAP, max_size=MAX_REQUEST_SIZE):
+    """
+    Merge byte ranges into fewer, larger ones.
+
+    :param ranges: iterable of (path, offset, size)
+    :param max_gap: largest gap between ranges merged together
+    :param max_size: largest merged range, unless a single range is larger
+    :returns: list of (path, start, end, members), members being the
+              (offset, size) of the ranges merged
+    """
+    merged = []
+    for path, offset, size in sorted(set(ranges)):
+        if merged:
+            last_path, start, end, members = merged[-1]
+            if (path == last_path and offset - end <= max_gap
+                    and max(end, offset + size) - start <= max_size):
+                merged[-1] = (path, start, max(end, offset + size),
+                              members + [(offset, size)])
+                continue
+        merged.append((path, offset, offset + size, [(offset, size)]))
+    return merged
+
+
+class _Block:
+    """A merged range, fetched at most once."""
+
+    def __init__(self, path, start, end, nreads):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.nreads = nreads
+        self.data = None
+        self.lock = threading.Lock()
+
+
+class RangeReader:
+    """
+    Reads the byte ranges of a job, merging nearby ones.
+
+    :param fs: fsspec file system with cat_file(path, start, end)
+    :param ranges: iterable of the (path, offset, size) to be read
+    :param max_gap: largest gap between ranges merged together
+    :param max_size: largest merged request
+    :param observer: optional callable, called with the seconds taken and
+                     the bytes fetched by each request
+    """
+
+    def __init__(self, fs, ranges, max_gap=MAX_GAP, max_size=MAX_REQUEST_SIZE,
+                 observer=None):
+        self.fs = fs
+        self.observer = observer
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._lock = threading.Lock()
+        self._blocks = {}
+        for path, start, end, members in coalesce(ranges, max_gap, max_size):
+            block = _Block(path, start, end, len(members))
+            for member in members:
+                self._blocks[(path,) + member] = block
+
+    def read(self, path, offset, size):
+        """Return the bytes of a range given to the constructor (or of any
+        other range, unmerged)."""
+        block = self._blocks.get((path, offset, size))
+        if block is None:
+            return self._fetch(path, offset, offset + size)
+        with block.lock:
+            if block.data is None:
+                block.data = self._fetch(path, block.start, block.end)
+            data = block.data
+            block.nreads -= 1
+            if block.nreads <= 0:
+                # every chunk in the block has been read
+                block.data = None
+        start = offset - block.start
+        return data[start:start + size]
+
+    def _fetch(self, path, start, end):
+        began = time.perf_counter()
+        data = self.fs.cat_file(path, start=start, end=end)
+        if self.observer is not None:
+            self.observer(time.perf_counter() - began, len(data))
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += len(data)
+        return data
+
+    def stats(self):
+        """Return the requests made and bytes fetched so far."""
+        return {"requests": self.requests, "bytes_fetched": self.bytes_fetched}
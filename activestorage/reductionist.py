@@ -1,31 +1,118 @@
 """Reductionist S3 Active Storage server storage interface module."""
 
+import aiohttp
+import asyncio
 import collections.abc
 import http.client
 import json
+import logging
 import requests
 import numcodecs
 import numpy as np
+import ssl
 import sys
+import threading
+import time
 import typing
 
+from activestorage import http2 as http2_transport
 
-def get_session(username: str, password: str, cacert: typing.Optional[str]) -> requests.Session:
+logger = logging.getLogger(__name__)
+
+
+# Codecs and data types that the Reductionist server can decode
+SUPPORTED_COMPRESSION = {"gzip", "zlib"}
+SUPPORTED_FILTERS = {"shuffle"}
+SUPPORTED_DTYPES = {"int32", "int64", "uint32", "uint64", "float32", "float64"}
+
+# Path requested to check that a Reductionist server is up
+HEALTH_PATH = "/.well-known/reductionist-schema"
+
+# Timeout of that request, and for how long its result is reused, in seconds
+HEALTH_TIMEOUT = 5
+HEALTH_TTL = 30
+
+# Server URL -> (time checked, None if up or why not)
+_health = {}
+_health_lock = threading.Lock()
+
+# Headers of a request with data already encoded as JSON
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Media type of framed binary responses, which carry the dtype, shape and
+# count of a result before its data instead of in x-activestorage-* headers.
+# Servers that don't know it answer with the usual headers.
+FRAME_MEDIA_TYPE = "application/vnd.activestorage.frame"
+ACCEPT_HEADERS = {
+    "Accept": f"{FRAME_MEDIA_TYPE}, application/octet-stream;q=0.9",
+}
+FRAME_MAGIC = b"ASF1"
+COMPRESSED_FRAME_MAGIC = b"ASZ1"
+
+# Select responses expected to be at least this large are asked for
+# compressed, in a frame, with one of these numcodecs codecs.
+COMPRESSION_THRESHOLD = 1024 * 1024
+RESPONSE_COMPRESSION = ["zstd", "zlib"]
+COMPRESSION_HEADER = "x-activestorage-accept-compression"
+
+# Bytes read at a time from a select response streamed into an array
+READ_SIZE = 1024 * 1024
+
+# Per-thread buffers that select responses are read into when they can't be
+# read straight into their destination
+_buffers = threading.local()
+
+# HTTP status codes of a server without the batch endpoint
+NO_BATCH_STATUS_CODES = {404, 405}
+
+# Servers found not to have the batch endpoint
+_no_batch = set()
+
+
+def get_session(username: str, password: str, cacert: typing.Optional[str],
+                http2: bool = False) -> requests.Session:
     """Create and return a client session object.
 
     :param username: S3 username / access key
     :param password: S3 password / secret key
+    :param http2: if True, return an `http2.HTTP2Session` multiplexing
+                  requests over a few HTTP/2 connections instead of a
+                  requests.Session with a connection per request in flight
     :returns: a client session object.
     """
+    if http2:
+        return http2_transport.HTTP2Session(username, password, cacert,
+                                            headers=ACCEPT_HEADERS)
     session = requests.Session()
     session.auth = (username, password)
     session.verify = cacert or False
+    session.headers.update(ACCEPT_HEADERS)
     return session
 
 
+def get_async_session(username: str, password: str, cacert: typing.Optional[str],
+                      limit: int = 100) -> aiohttp.ClientSession:
+    """Create and return an asyncio client session object.
+
+    This must be called, used and closed in a running event loop.
+
+    :param username: S3 username / access key
+    :param password: S3 password / secret key
+    :param cacert: Reductionist CA certificate path
+    :param limit: maximum number of simultaneous connections
+    :returns: an asyncio client session object.
+    """
+    ssl_context = ssl.create_default_context(cafile=cacert) if cacert else False
+    connector = aiohttp.TCPConnector(limit=limit, ssl=ssl_context)
+    return aiohttp.ClientSession(auth=aiohttp.BasicAuth(username, password),
+                                 connector=connector,
+                                 headers=ACCEPT_HEADERS)
+
+
 def reduce_chunk(session, server, source, bucket, object,
                  offset, size, compression, filters, missing, dtype, shape,
-                 order, chunk_selection, operation):
+                 order, chunk_selection, operation, timeout=None,
+                 template=None, out=None):
     """Perform a reduction on a chunk using Reductionist.
 
     :param server: Reductionist server URL
@@ -48,20 +135,231 @@ def reduce_chunk(session, server, source, bucket, object,
                             this defines the part of the chunk which is to be
                             obtained or operated upon.
     :param operation: name of operation to perform
-    :returns: the reduced data as a numpy array or scalar
+    :param timeout: optional timeout of the request, in seconds
+    :param template: optional RequestTemplate made from the same source,
+                     bucket, object, compression, filters, missing, dtype,
+                     shape and order, to encode the request data with
+    :param out: optional array where the selected data will go, for a
+                select. The response is streamed into it if it is C
+                contiguous and has the dtype and size of the data, else
+                into a buffer reused by the thread, until its next request.
+    :returns: the reduced data as a numpy array or scalar (out, if the data
+              was read into it)
     :raises ReductionistError: if the request to Reductionist fails
     """
 
-    request_data = build_request_data(source, bucket, object, offset, size, compression, filters, missing, dtype, shape, order, chunk_selection)
-    print("Reductionist request data dictionary:", request_data)
+    if template is not None:
+        request_data = template.encode(offset, size, chunk_selection)
+    else:
+        request_data = build_request_data(source, bucket, object, offset, size, compression, filters, missing, dtype, shape, order, chunk_selection)
+        logger.debug("Reductionist request data dictionary: %s", request_data)
+    api_operation = "sum" if operation == "mean" else operation or "select"
+    url = f'{server}/v1/{api_operation}/'
+    kwargs = {}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    headers = compression_headers(operation, dtype, shape, chunk_selection)
+    if headers:
+        kwargs["headers"] = headers
+    if out is not None and operation is None:
+        kwargs["stream"] = True
+    response = request(session, url, request_data, **kwargs)
+
+    if not response.ok:
+        decode_and_raise_error(response)
+    if kwargs.get("stream"):
+        try:
+            return read_result(response, out)
+        finally:
+            response.close()
+    return decode_result(response)
+
+
+async def areduce_chunk(session, server, source, bucket, object,
+                        offset, size, compression, filters, missing, dtype, shape,
+                        order, chunk_selection, operation, template=None,
+                        out=None):
+    """Perform a reduction on a chunk using Reductionist, asynchronously.
+
+    As reduce_chunk, but session is an asyncio client session object from
+    get_async_session, and select responses are only streamed into out if
+    they fit it (there is no buffer to reuse between tasks).
+    """
+    if template is not None:
+        request_data = template.encode(offset, size, chunk_selection)
+    else:
+        request_data = build_request_data(source, bucket, object, offset, size, compression, filters, missing, dtype, shape, order, chunk_selection)
     api_operation = "sum" if operation == "mean" else operation or "select"
     url = f'{server}/v1/{api_operation}/'
-    response = request(session, url, request_data)
+    headers = compression_headers(operation, dtype, shape, chunk_selection)
+    async with session.post(url, **post_kwargs(request_data, headers)) as response:
+        if response.ok and out is not None and operation is None:
+            return await aread_result(response, out)
+        content = await response.read()
+        if response.ok:
+            return decode_content(response.headers, content)
+        else:
+            raise_error(response.status, content)
+
+
+def unsupported(compression, filters, dtype):
+    """Return why Reductionist cannot reduce chunks with these codecs and
+    data type, or None if it can."""
+    if compression and compression.codec_id not in SUPPORTED_COMPRESSION:
+        return f"Unsupported compression {compression.codec_id}"
+    for filter in filters or []:
+        if filter.codec_id not in SUPPORTED_FILTERS:
+            return f"Unsupported filter {filter.codec_id}"
+    if np.dtype(dtype).name not in SUPPORTED_DTYPES:
+        return f"Unsupported data type {np.dtype(dtype).name}"
+    return None
+
+
+def check_health(session, server, timeout=HEALTH_TIMEOUT):
+    """Check that a Reductionist server is up.
 
-    if response.ok:
-        return decode_result(response)
+    The result is reused for HEALTH_TTL seconds.
+
+    :param session: a client session object from get_session
+    :param server: Reductionist server URL
+    :returns: None if the server is up, or why it is not
+    """
+    checked = _get_health_record(server)
+    if checked is not None:
+        return checked[1]
+    try:
+        response = session.get(f"{server}{HEALTH_PATH}", timeout=timeout)
+    except requests.exceptions.RequestException as exc:
+        reason = f"Reductionist server {server} unavailable: {exc}"
     else:
-        decode_and_raise_error(response)
+        reason = None
+        if response.status_code >= 500:
+            reason = (f"Reductionist server {server} unavailable: "
+                      f"HTTP {response.status_code}")
+    mark_health(server, reason)
+    return reason
+
+
+def _get_health_record(server):
+    """Return the (time checked, reason) of a server if still valid."""
+    with _health_lock:
+        checked = _health.get(server)
+    if checked is not None and time.monotonic() - checked[0] < HEALTH_TTL:
+        return checked
+    return None
+
+
+def get_health(server):
+    """Return why a Reductionist server was found to be down, if within the
+    last HEALTH_TTL seconds, else None."""
+    checked = _get_health_record(server)
+    return None if checked is None else checked[1]
+
+
+def mark_health(server, reason=None):
+    """Record that a Reductionist server is up, or why it is not."""
+    with _health_lock:
+        _health[server] = (time.monotonic(), reason)
+
+
+def clear_health():
+    """Forget the health of all Reductionist servers."""
+    with _health_lock:
+        _health.clear()
+
+
+def supports_batches(server):
+    """Return whether a Reductionist server is not known to lack the batch
+    endpoint."""
+    return server not in _no_batch
+
+
+def reduce_chunks(session, server, requests_data, operation, timeout=None,
+                  split=True):
+    """Perform reductions on many chunks using Reductionist, with one request.
+
+    Servers without the batch endpoint get one request per chunk instead,
+    one after the other, unless split is False.
+
+    :param server: Reductionist server URL
+    :param requests_data: list of the request data of each chunk, from
+                          build_request_data or RequestTemplate.encode
+    :param operation: name of operation to perform
+    :param timeout: optional timeout of each request, in seconds
+    :param split: whether to send the chunks on their own to a server
+                  without the batch endpoint
+    :returns: for each chunk, the reduced data and count as a 2-tuple, or
+              the ReductionistError the server returned for it
+    :raises ReductionistError: if the batch request fails
+    :raises BatchesUnsupported: if the server does not have the batch
+                                endpoint and split is False
+    """
+    api_operation = "sum" if operation == "mean" else operation or "select"
+    kwargs = {} if timeout is None else {"timeout": timeout}
+    if server not in _no_batch:
+        url = f'{server}/v1/{api_operation}/batch/'
+        response = request(session, url, encode_batch_request(requests_data),
+                           **kwargs)
+        if response.ok:
+            return decode_batch(response.content)
+        if response.status_code not in NO_BATCH_STATUS_CODES:
+            decode_and_raise_error(response)
+        logger.info("Reductionist server %s does not support batches", server)
+        _no_batch.add(server)
+    if not split:
+        raise BatchesUnsupported(server)
+    url = f'{server}/v1/{api_operation}/'
+    results = []
+    for request_data in requests_data:
+        response = request(session, url, request_data, **kwargs)
+        if response.ok:
+            results.append(decode_result(response))
+        else:
+            results.append(decode_error(response))
+    return results
+
+
+async def areduce_chunks(session, server, requests_data, operation,
+                         split=True):
+    """Perform reductions on many chunks using Reductionist, with one
+    request, asynchronously.
+
+    As reduce_chunks, but session is an asyncio client session object from
+    get_async_session.
+    """
+    api_operation = "sum" if operation == "mean" else operation or "select"
+    if server not in _no_batch:
+        url = f'{server}/v1/{api_operation}/batch/'
+        batch_data = encode_batch_request(requests_data)
+        async with session.post(url, **post_kwargs(batch_data)) as response:
+            content = await response.read()
+            if response.ok:
+                return decode_batch(content)
+            if response.status not in NO_BATCH_STATUS_CODES:
+                raise_error(response.status, content)
+        logger.info("Reductionist server %s does not support batches", server)
+        _no_batch.add(server)
+    if not split:
+        raise BatchesUnsupported(server)
+    url = f'{server}/v1/{api_operation}/'
+
+    async def reduce(request_data):
+        async with session.post(url, **post_kwargs(request_data)) as response:
+            content = await response.read()
+            if response.ok:
+                return decode_content(response.headers, content)
+            try:
+                raise_error(response.status, content)
+            except ReductionistError as exc:
+                return exc
+
+    return await asyncio.gather(*[reduce(request_data)
+                                  for request_data in requests_data])
+
+
+def clear_batch_support():
+    """Forget which Reductionist servers were found not to support batches."""
+    _no_batch.clear()
 
 
 def encode_byte_order(dtype):
@@ -127,6 +425,54 @@ def encode_missing(missing):
     assert False, "Expected missing values not found"
 
 
+class RequestTemplate:
+    """The request data of the chunks of a variable, encoded once.
+
+    Only the offset, size and selection vary from chunk to chunk, so the
+    rest is encoded to JSON once, and encode() appends the fields of a
+    chunk to it. Most chunks of a selection have the same chunk selection,
+    so those are kept encoded too. Arguments as for build_request_data.
+    """
+
+    # Encoded chunk selections kept
+    MAX_SELECTIONS = 1024
+
+    def __init__(self, source, bucket, object, compression, filters, missing,
+                 dtype, shape, order):
+        self.data = build_request_data(source, bucket, object, None, None,
+                                       compression, filters, missing, dtype,
+                                       shape, order, None)
+        # The JSON object without its closing brace.
+        self._prefix = json.dumps(self.data)[:-1].encode()
+        if self.data:
+            self._prefix += b", "
+        self._selections = {}
+
+    def encode(self, offset, size, selection):
+        """Return the request data of a chunk, encoded as JSON bytes."""
+        fields = []
+        if offset is not None:
+            fields.append(b'"offset": %d' % offset)
+        if size is not None:
+            fields.append(b'"size": %d' % size)
+        if selection:
+            fields.append(self._encode_selection(selection))
+        if not fields:
+            return json.dumps(self.data).encode()
+        return self._prefix + b", ".join(fields) + b"}"
+
+    def _encode_selection(self, selection):
+        key = tuple((s.start, s.stop, s.step) if isinstance(s, slice) else s
+                    for s in selection)
+        encoded = self._selections.get(key)
+        if encoded is None:
+            encoded = (b'"selection": '
+                       + json.dumps(encode_selection(selection)).encode())
+            if len(self._selections) < self.MAX_SELECTIONS:
+                self._selections[key] = encoded
+        return encoded
+
+
 def build_request_data(source: str, bucket: str, object: str, offset: int,
                        size: int, compression, filters, missing, dtype, shape,
                        order, selection) -> dict:
@@ -158,30 +504,408 @@ def build_request_data(source: str, bucket: str, object: str, offset: int,
     return {k: v for k, v in request_data.items() if v is not None}
 
 
-def request(session: requests.Session, url: str, request_data: dict):
-    """Make a request to a Reductionist API."""
+def request(session: requests.Session, url: str,
+            request_data: typing.Union[dict, bytes],
+            timeout: typing.Optional[float] = None,
+            headers: typing.Optional[dict] = None,
+            stream: bool = False):
+    """Make a request to a Reductionist API.
+
+    With stream, the body of the response is left to be read from
+    response.raw.
+    """
+    kwargs = {"stream": True} if stream else {}
     response = session.post(
         url,
-        json=request_data,
+        **post_kwargs(request_data, headers),
+        timeout=timeout,
+        **kwargs,
     )
     return response
 
 
+def post_kwargs(request_data, headers=None):
+    """Return the arguments to post request data, a dict or bytes already
+    encoded as JSON, with optional extra headers."""
+    if isinstance(request_data, bytes):
+        kwargs = {"data": request_data, "headers": dict(JSON_HEADERS)}
+    else:
+        kwargs = {"json": request_data}
+    if headers:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **headers}
+    return kwargs
+
+
+def selection_nbytes(dtype, shape, selection):
+    """Return the size in bytes of a selection of a chunk, or None if
+    unknown."""
+    if not shape:
+        return None
+    if not selection:
+        return int(np.prod(shape)) * np.dtype(dtype).itemsize
+    size = 1
+    for s, n in zip(selection, shape):
+        if isinstance(s, slice):
+            size *= len(range(*s.indices(n)))
+    return size * np.dtype(dtype).itemsize
+
+
+def compression_headers(operation, dtype, shape, selection):
+    """Return the headers asking for a compressed response to a select
+    expected to return at least COMPRESSION_THRESHOLD bytes, or None.
+
+    A server that does not compress responses ignores them.
+    """
+    if operation is not None:
+        return None
+    nbytes = selection_nbytes(dtype, shape, selection)
+    if nbytes is None or nbytes < COMPRESSION_THRESHOLD:
+        return None
+    return {COMPRESSION_HEADER: ", ".join(RESPONSE_COMPRESSION)}
+
+
+def encode_batch_request(requests_data):
+    """Return the request data of a batch, from that of each chunk."""
+    if requests_data and all(isinstance(request_data, bytes)
+                             for request_data in requests_data):
+        return b'{"chunks": [' + b", ".join(requests_data) + b"]}"
+    return {"chunks": [json.loads(request_data)
+                       if isinstance(request_data, bytes) else request_data
+                       for request_data in requests_data]}
+
+
 def decode_result(response):
     """Decode a successful response, return as a 2-tuple of (numpy array or scalar, count)."""
-    dtype = response.headers['x-activestorage-dtype']
-    shape = json.loads(response.headers['x-activestorage-shape'])
-    result = np.frombuffer(response.content, dtype=dtype)
+    return decode_content(response.headers, response.content)
+
+
+def decode_content(headers, content):
+    """Decode the headers and body of a successful response, return as a 2-tuple of (numpy array or scalar, count)."""
+    if headers.get("Content-Type", "").startswith(FRAME_MEDIA_TYPE):
+        return decode_frame(content)
+    dtype, shape, count = decode_headers(headers)
+    result = np.frombuffer(content, dtype=dtype)
     result = result.reshape(shape)
-    count = json.loads(response.headers['x-activestorage-count'])
     return result, count
 
 
+def decode_headers(headers):
+    """Return the dtype, shape and count of a result from the headers of an
+    unframed response."""
+    dtype = np.dtype(headers['x-activestorage-dtype'])
+    shape = json.loads(headers['x-activestorage-shape'])
+    count = json.loads(headers['x-activestorage-count'])
+    return dtype, shape, count
+
+
+def encode_frame(result, count, compression=None):
+    """Encode a result and its count as the body of a framed binary response.
+
+    The frame is FRAME_MAGIC, the length (2 bytes) and string of the dtype,
+    the number of dimensions (1 byte) and shape (8 bytes each) of the
+    result, then the same for the count, an int64 array, then the count and
+    the result data. All integers are little endian. A frame with the
+    result data compressed starts with COMPRESSED_FRAME_MAGIC and the length
+    (1 byte) and string of the numcodecs codec id instead.
+
+    :param compression: optional numcodecs codec id to compress the data with
+    """
+    result = np.asarray(result)
+    count = np.asarray(count, dtype="<i8")
+    dtype = result.dtype.str.encode()
+    if compression:
+        codec_id = compression.encode()
+        parts = [COMPRESSED_FRAME_MAGIC, len(codec_id).to_bytes(1, "little"),
+                 codec_id]
+    else:
+        parts = [FRAME_MAGIC]
+    parts += [len(dtype).to_bytes(2, "little"), dtype]
+    for array in (result, count):
+        parts.append(array.ndim.to_bytes(1, "little"))
+        parts.extend(n.to_bytes(8, "little") for n in array.shape)
+    parts.append(count.tobytes())
+    data = np.ascontiguousarray(result)
+    if compression:
+        data = numcodecs.get_codec({"id": compression}).encode(data)
+    parts.append(bytes(data) if compression else data.tobytes())
+    return b"".join(parts)
+
+
+def decode_frame(content):
+    """Decode the body of a framed binary response, return as a 2-tuple of
+    (numpy array or scalar, count)."""
+    position = 0
+
+    def read(size):
+        nonlocal position
+        position += size
+        return content[position - size:position]
+
+    compression, dtype, shape, count = read_frame_header(read)
+    if compression:
+        return decode_frame_data(compression, memoryview(content)[position:],
+                                 dtype, shape, count)
+    result = np.frombuffer(content, dtype=dtype, count=int(np.prod(shape)),
+                           offset=position)
+    return result.reshape(shape), count
+
+
+def read_frame_header(read):
+    """Read the header of a frame, up to the result data, with read(size)
+    returning the next size bytes.
+
+    :returns: the codec id of compressed data (or None), and the dtype,
+              shape and count of the result
+    """
+    def read_int(size):
+        return int.from_bytes(read(size), "little")
+
+    compression = None
+    magic = read(len(FRAME_MAGIC))
+    if magic == COMPRESSED_FRAME_MAGIC:
+        compression = bytes(read(read_int(1))).decode()
+    elif magic != FRAME_MAGIC:
+        raise ReductionistError(200, "Invalid framed response")
+    dtype = np.dtype(bytes(read(read_int(2))).decode())
+    shapes = []
+    for _ in range(2):
+        ndim = read_int(1)
+        shapes.append(tuple(read_int(8) for _ in range(ndim)))
+    shape, count_shape = shapes
+    count = np.frombuffer(read(8 * int(np.prod(count_shape))), dtype="<i8")
+    return compression, dtype, shape, count.reshape(count_shape).tolist()
+
+
+def read_result(response, out):
+    """Read the body of a successful select response streamed by request
+    into out, or into a buffer reused by the thread; return as
+    decode_result.
+
+    The body is read a piece at a time straight into place, rather than
+    buffered whole, decoded, then copied to the output.
+    """
+    raw = response.raw
+
+    def read(size):
+        data = raw.read(size)
+        while len(data) < size:
+            more = raw.read(size - len(data))
+            if not more:
+                raise ReductionistError(response.status_code,
+                                        "Truncated response")
+            data += more
+        return data
+
+    if response.headers.get("Content-Type", "").startswith(FRAME_MEDIA_TYPE):
+        compression, dtype, shape, count = read_frame_header(read)
+        if compression:
+            return decode_frame_data(compression, raw.read(), dtype, shape,
+                                     count, out)
+    else:
+        dtype, shape, count = decode_headers(response.headers)
+    result = _destination(out, dtype, shape)
+    if result is None:
+        result = _get_buffer(dtype, shape)
+    view = memoryview(result.reshape(-1).view(np.uint8))
+    filled = 0
+    while filled < len(view):
+        size = raw.readinto(view[filled:filled + READ_SIZE])
+        if not size:
+            raise ReductionistError(response.status_code, "Truncated response")
+        filled += size
+    return result, count
+
+
+async def aread_result(response, out):
+    """As read_result, for an aiohttp response, only streaming the body
+    into out if it fits; otherwise it is read whole and decoded."""
+    if response.headers.get("Content-Type", "").startswith(FRAME_MEDIA_TYPE):
+        async def aread(size):
+            return await response.content.readexactly(size)
+
+        compression, dtype, shape, count = await _aread_frame_header(aread)
+        if compression:
+            return decode_frame_data(compression, await response.read(),
+                                     dtype, shape, count, out)
+    else:
+        dtype, shape, count = decode_headers(response.headers)
+    result = _destination(out, dtype, shape)
+    if result is None:
+        return (np.frombuffer(await response.read(), dtype=dtype)
+                .reshape(shape), count)
+    view = memoryview(result.reshape(-1).view(np.uint8))
+    filled = 0
+    async for data in response.content.iter_chunked(READ_SIZE):
+        if filled + len(data) > len(view):
+            raise ReductionistError(response.status, "Oversized response")
+        view[filled:filled + len(data)] = data
+        filled += len(data)
+    if filled < len(view):
+        raise ReductionistError(response.status, "Truncated response")
+    return result, count
+
+
+async def _aread_frame_header(aread):
+    """As read_frame_header, with a coroutine function aread."""
+    def read_int(data):
+        return int.from_bytes(data, "little")
+
+    compression = None
+    magic = await aread(len(FRAME_MAGIC))
+    if magic == COMPRESSED_FRAME_MAGIC:
+        compression = (await aread(read_int(await aread(1)))).decode()
+    elif magic != FRAME_MAGIC:
+        raise ReductionistError(200, "Invalid framed response")
+    dtype = np.dtype((await aread(read_int(await aread(2)))).decode())
+    shapes = []
+    for _ in range(2):
+        ndim = read_int(await aread(1))
+        shapes.append(tuple([read_int(await aread(8)) for _ in range(ndim)]))
+    shape, count_shape = shapes
+    count = np.frombuffer(await aread(8 * int(np.prod(count_shape))),
+                          dtype="<i8")
+    return compression, dtype, shape, count.reshape(count_shape).tolist()
+
+
+def decode_frame_data(compression, data, dtype, shape, count, out=None):
+    """Decompress the data of a compressed frame into out, if it fits, or a
+    new array; return as decode_result."""
+    # Decode straight into the result array.
+    result = _destination(out, dtype, shape)
+    if result is None:
+        result = np.empty(shape, dtype=dtype)
+    numcodecs.get_codec({"id": compression}).decode(data, out=result)
+    return result, count
+
+
+def _destination(out, dtype, shape):
+    """Return out if the data of a result can be written to it in place."""
+    if (out is None or out.dtype != dtype
+            or out.size != int(np.prod(shape))
+            or not out.flags.c_contiguous or not out.flags.writeable):
+        return None
+    return out
+
+
+def _get_buffer(dtype, shape):
+    """Return an array of dtype and shape in the buffer of this thread,
+    grown as needed."""
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) < nbytes:
+        buffer = _buffers.buffer = np.empty(nbytes, dtype=np.uint8)
+    return buffer[:nbytes].view(dtype).reshape(shape)
+
+
+# Size of the length of the index at the start of a batch response
+BATCH_INDEX_LENGTH_SIZE = 8
+
+
+def decode_batch(content):
+    """Decode the body of a successful batch response.
+
+    The body is the length of an index (8 bytes, little endian), the index,
+    a JSON list describing the result of each chunk, then the data of the
+    results. A result is described by its dtype, shape, count and size in
+    bytes, or for a chunk that failed, by a status code and error.
+
+    :returns: for each chunk, a 2-tuple of (numpy array or scalar, count),
+              or a ReductionistError
+    """
+    length = int.from_bytes(content[:BATCH_INDEX_LENGTH_SIZE], "little")
+    start = BATCH_INDEX_LENGTH_SIZE + length
+    index = json.loads(content[BATCH_INDEX_LENGTH_SIZE:start])
+    results = []
+    for entry in index:
+        if "error" in entry:
+            results.append(ReductionistError(entry["status"],
+                                             json.dumps(entry["error"])))
+            continue
+        end = start + entry["size"]
+        result = np.frombuffer(content[start:end], dtype=entry["dtype"])
+        results.append((result.reshape(entry["shape"]), entry["count"]))
+        start = end
+    return results
+
+
+def encode_batch(results):
+    """Encode the body of a batch response, the inverse of decode_batch.
+
+    :param results: for each chunk, a 2-tuple of (numpy array, count), or
+                    a 2-tuple of (HTTP status code, error) for a chunk that
+                    failed
+    """
+    index, data = [], []
+    for result, count in results:
+        if isinstance(result, int):
+            index.append({"status": result, "error": count})
+            continue
+        result = np.asarray(result)
+        index.append({"dtype": result.dtype.str, "shape": result.shape,
+                      "count": count, "size": result.nbytes})
+        data.append(result.tobytes())
+    index = json.dumps(index).encode()
+    return b"".join([len(index).to_bytes(BATCH_INDEX_LENGTH_SIZE, "little"),
+                     index] + data)
+
+
 class ReductionistError(Exception):
     """Exception for Reductionist failures."""
 
     def __init__(self, status_code, error):
         super(ReductionistError, self).__init__(f"Reductionist error: HTTP {status_code}: {error}")
+        self.status_code = status_code
+
+
+class BatchesUnsupported(ReductionistError):
+    """Exception for a batch sent to a server without the batch endpoint."""
+
+    def __init__(self, server):
+        super().__init__(404, f"{server} does not support batches")
+        self.server = server
+
+
+# HTTP status codes of transient failures
+RETRYABLE_STATUS_CODES = {408, 429, 502, 503, 504}
+
+
+def is_retryable(exc):
+    """Return whether an exception raised by a request means that the same
+    request may succeed if made again."""
+    if isinstance(exc, ReductionistError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout,
+                            aiohttp.ClientConnectionError,
+                            asyncio.TimeoutError))
+
+
+def is_overload(exc):
+    """Return whether an exception raised by a request means that the
+    Reductionist server is overloaded (or unavailable) rather than that the
+    request was bad."""
+    if isinstance(exc, ReductionistError):
+        # too many requests, or a server error
+        return exc.status_code == 429 or exc.status_code >= 500
+    return isinstance(exc, (requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout,
+                            aiohttp.ClientConnectionError,
+                            asyncio.TimeoutError))
+
+
+def is_unreachable(exc):
+    """Return whether an exception raised by a request means that the
+    Reductionist server could not be reached."""
+    return isinstance(exc, (requests.exceptions.ConnectionError,
+                            aiohttp.ClientConnectionError))
+
+
+def decode_error(response):
+    """Decode an error response and return a ReductionistError."""
+    try:
+        decode_and_raise_error(response)
+    except ReductionistError as exc:
+        return exc
 
 
 def decode_and_raise_error(response):
@@ -191,3 +915,12 @@ def decode_and_raise_error(response):
         raise ReductionistError(response.status_code, error)
     except requests.exceptions.JSONDecodeError as exc:
         raise ReductionistError(response.status_code, "-") from exc
+
+
+def raise_error(status_code, content):
+    """Decode the body of an error response and raise ReductionistError."""
+    try:
+        error = json.dumps(json.loads(content))
+    except ValueError as exc:
+        raise ReductionistError(status_code, "-") from exc
+    raise ReductionistError(status_code, error)
@@ -0,0 +1,182 @@
+"""
+Client-side cache of Reductionist results.
+
+Dashboards ask for the same reductions of the same data many times, and
+without a cache every one of them is a round trip to Reductionist for every
+chunk. A ResultCache keeps the result of each chunk request, keyed by a hash
+of the operation, the canonical request data and the ETag of the object, so
+that a new version of an object never serves old results. Entries expire
+after a TTL, the memory they use is bounded (least recently used entries
+are dropped first), and they can also be kept in a directory to survive
+restarts or be shared between processes. Entries are stored as framed
+responses (see reductionist.encode_frame).
+"""
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from activestorage import reductionist
+
+
+# Upper bound on the memory used by cached results
+MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+# Time after which results are not used, in seconds
+TTL = 3600
+
+
+def cache_key(operation, request_data, etag):
+    """
+    Return the key of a chunk request.
+
+    :param operation: name of the operation, None for select
+    :param request_data: request data dict, or bytes encoded by a
+                         reductionist.RequestTemplate
+    :param etag: ETag of the object
+    """
+    if isinstance(request_data, bytes):
+        request_data = json.loads(request_data)
+    canonical = json.dumps(request_data, sort_keys=True, default=_to_json)
+    digest = hashlib.sha256()
+    for part in (str(operation), canonical, str(etag)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _to_json(value):
+    """Convert numpy scalars in request data to Python ones."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Can't encode {value!r} in a cache key")
+
+
+class ResultCache:
+    """
+    Cache of the results of chunk requests.
+
+    :param max_size: upper bound on the memory used, in bytes
+    :param ttl: seconds after which an entry is not used
+    :param directory: optional directory to also keep the entries in
+    """
+
+    def __init__(self, max_size=MAX_CACHE_SIZE, ttl=TTL, directory=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the (result, count) of a key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored, result, count = entry
+                if now - stored < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result, count
+                self._drop(key)
+        entry = self._load(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, *entry)
+        return entry[1], entry[2]
+
+    def contains(self, key):
+        """Return whether a key has an entry that has not expired, without
+        counting a hit or miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                return True
+        if self.directory is None:
+            return False
+        try:
+            return now - os.path.getmtime(self._path(key)) < self.ttl
+        except OSError:
+            return False
+
+    def put(self, key, result, count):
+        """Cache a copy of the (result, count) of a key."""
+        result = np.array(result)
+        stored = time.time()
+        with self._lock:
+            self._insert(key, stored, result, count)
+        self._save(key, result, count)
+
+    def clear(self):
+        """Drop all entries, including those in the directory."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".frame"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        """Return the hits, misses, number of entries and memory used."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "size": self.size}
+
+    def _insert(self, key, stored, result, count):
+        if result.nbytes > self.max_size:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (stored, result, count)
+        self.size += result.nbytes
+        while self.size > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, result, _ = self._entries.pop(key)
+        self.size -= result.nbytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.frame")
+
+    def _load(self, key, now):
+        """Return the (time stored, result, count) of a key in the
+        directory, or None."""
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            stored = os.path.getmtime(path)
+            if now - stored >= self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                result, count = reductionist.decode_frame(f.read())
+        except (OSError, ValueError, reductionist.ReductionistError):
+            return None
+        return stored, result, count
+
+    def _save(self, key, result, count):
+        if self.directory is None:
+            return
+        # Write then rename, so that readers never see part of an entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(reductionist.encode_frame(result, count))
+        os.replace(tmp_path, self._path(key))
@@ -0,0 +1,57 @@
+"""
+Retries with jittered exponential backoff.
+
+A transient failure (a busy or restarting server, a dropped connection) of
+one of thousands of chunk requests should not fail a whole reduction.
+Requests are retried after a random delay of up to base * 2 ** attempt
+seconds ("full jitter"), so that clients that failed together do not all
+come back at once.
+"""
+import asyncio
+import itertools
+import random
+import time
+
+
+# Retries after the first attempt
+RETRIES = 3
+
+# Bounds, in seconds, on the delay before a retry
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 10.0
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Return the delay before retry number attempt (from 0)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call(func, is_retryable, retries=RETRIES):
+    """
+    Call func until it succeeds, retrying on retryable errors.
+
+    :param func: function of no arguments
+    :param is_retryable: function of an exception raised by func, returning
+                         True if func may succeed if called again
+    :param retries: maximum number of retries
+    :returns: what func returns
+    :raises: the last exception raised by func
+    """
+    for attempt in itertools.count():
+        try:
+            return func()
+        except Exception as exc:
+            if attempt >= retries or not is_retryable(exc):
+                raise
+        time.sleep(backoff(attempt))
+
+
+async def acall(func, is_retryable, retries=RETRIES):
+    """As call, for a coroutine function func."""
+    for attempt in itertools.count():
+        try:
+            return await func()
+        except Exception as exc:
+            if attempt >= retries or not is_retryable(exc):
+                raise
+        await asyncio.sleep(backoff(attempt))
@@ -0,0 +1,186 @@
+"""
+Cost-based routing of chunks between Reductionist and the client.
+
+Whether a chunk in S3 is reduced faster by Reductionist, or by reading it
+with a ranged GET and reducing it here, depends on its compressed and
+decoded sizes, how much of it is selected (a selection comes back whole
+from Reductionist), how many nearby chunks one GET can read with it, and
+the bandwidth and latency of the links involved. With s3_mode "auto",
+Active asks a CostModel, for each chunk of a call, which way is expected to
+be faster, and sends it that way.
+
+The model is linear in bytes: a Reductionist request costs an overhead
+plus a time per byte read and returned, a ranged GET an overhead plus a
+time per byte fetched, and reducing a chunk here a time per decoded byte.
+The coefficients start from defaults, and follow the timings observed as
+chunks are processed, so a model shared between calls (and Active
+instances) learns the links it is used over.
+"""
+import threading
+
+
+# Weight of each past observation relative to the next one
+DECAY = 0.98
+
+# Spread of the bytes observed at which observations weigh as much as the
+# default slope of a fit
+PRIOR_BYTES = 1024 ** 2
+
+# Default seconds per request, and seconds per byte, of each cost
+REDUCTIONIST_SECONDS = 0.005
+REDUCTIONIST_SECONDS_PER_BYTE = 1 / (500 * 1024 ** 2)
+GET_SECONDS = 0.02
+GET_SECONDS_PER_BYTE = 1 / (100 * 1024 ** 2)
+DECODE_SECONDS_PER_BYTE = 1 / (1024 ** 3)
+
+
+class _LinearFit:
+    """
+    seconds = intercept + slope * bytes, fitted by least squares to
+    exponentially decayed observations, starting from a default. Not
+    thread safe.
+    """
+
+    def __init__(self, intercept, slope):
+        self.intercept = intercept
+        self.slope = slope
+        self._default_slope = slope
+        self._sums = [0.0] * 5
+
+    def observe(self, nbytes, seconds):
+        """Add an observation, and fit the line again."""
+        sums = self._sums
+        for i, value in enumerate((1.0, nbytes, seconds, nbytes * nbytes,
+                                   nbytes * seconds)):
+            sums[i] = sums[i] * DECAY + value
+        weight, x, y, xx, xy = sums
+        mean_x, mean_y = x / weight, y / weight
+        # The slope is pulled towards its default, until observations of
+        # different sizes outweigh it.
+        prior = PRIOR_BYTES ** 2
+        self.slope = max((xy - x * mean_y + prior * self._default_slope)
+                         / (xx - x * mean_x + prior), 0.0)
+        self.intercept = max(mean_y - self.slope * mean_x, 0.0)
+
+    def __call__(self, nbytes):
+        """Return the seconds expected for nbytes."""
+        return self.intercept + self.slope * nbytes
+
+
+class CostModel:
+    """
+    Expected cost of reducing a chunk with Reductionist or client side,
+    from the timings observed. Thread safe, and can be shared.
+
+    :param reductionist_seconds: default overhead of a Reductionist request
+    :param reductionist_seconds_per_byte: default time per byte read and
+                                          returned by Reductionist
+    :param get_seconds: default overhead of a ranged GET
+    :param get_seconds_per_byte: default time per byte fetched by a GET
+    :param decode_seconds_per_byte: default time per decoded byte to
+                                    decode and reduce a chunk here
+    """
+
+    def __init__(self, reductionist_seconds=REDUCTIONIST_SECONDS,
+                 reductionist_seconds_per_byte=REDUCTIONIST_SECONDS_PER_BYTE,
+                 get_seconds=GET_SECONDS,
+                 get_seconds_per_byte=GET_SECONDS_PER_BYTE,
+                 decode_seconds_per_byte=DECODE_SECONDS_PER_BYTE):
+        self._reductionist = _LinearFit(reductionist_seconds,
+                                        reductionist_seconds_per_byte)
+        self._get = _LinearFit(get_seconds, get_seconds_per_byte)
+        self._decode = _LinearFit(0.0, decode_seconds_per_byte)
+        self._lock = threading.Lock()
+
+    def observe_reductionist(self, seconds, nbytes):
+        """Record a Reductionist request for nbytes of chunks (compressed)
+        and results that took seconds."""
+        with self._lock:
+            self._reductionist.observe(nbytes, seconds)
+
+    def observe_fetch(self, seconds, nbytes):
+        """Record a ranged GET of nbytes that took seconds."""
+        with self._lock:
+            self._get.observe(nbytes, seconds)
+
+    def observe_decode(self, seconds, nbytes):
+        """Record decoding and reducing nbytes of chunk here in seconds."""
+        with self._lock:
+            self._decode.observe(nbytes, seconds)
+
+    def reductionist_cost(self, size, returned, per_request=1):
+        """
+        Return the seconds expected to reduce a chunk with Reductionist.
+
+        :param size: compressed size of the chunk
+        :param returned: bytes of its result
+        :param per_request: chunks sharing the overhead of the request
+        """
+        with self._lock:
+            fit = self._reductionist
+            return fit.intercept / per_request + fit.slope * (size + returned)
+
+    def client_cost(self, fetched, decoded, per_request=1):
+        """
+        Return the seconds expected to read a chunk and reduce it here.
+
+        :param fetched: bytes fetched for the chunk
+        :param decoded: decoded size of the chunk
+        :param per_request: chunks read by the same ranged GET
+        """
+        with self._lock:
+            fit = self._get
+            return (fit.intercept / per_request + fit.slope * fetched
+                    + self._decode(decoded))
+
+    def route(self, plan, batch_size=None):
+        """
+        Choose, for each chunk of a plan, whether Reductionist or the client
+        reduces it, and set plan.routes.
+
+        Chunks read by the client are assumed to be read with the nearby
+        chunks of the plan, in coalesced GETs sharing their overhead and
+        the bytes between them.
+
+        :param plan: a `planning.Plan`
+        :param batch_size: chunks of an object per Reductionist request
+        :returns: dict of whether each chunk goes to Reductionist, by
+                  chunk coordinates
+        """
+        shares = {}
+        for path, start, end, members in plan.coalesced:
+            gap = (end - start) - sum(size for _, size in members)
+            for offset, size in members:
+                shares[(path, offset, size)] = (len(members),
+                                                size + gap / len(members))
+        per_file = {}
+        for _, path, _, _, _ in plan.chunks:
+            per_file[path] = per_file.get(path, 0) + 1
+        routes = {}
+        for chunk_coords, path, offset, size, selected in plan.chunks:
+            if plan.method is None:
+                returned = selected * plan.itemsize
+            else:
+                returned = plan.itemsize
+            per_request = min(batch_size or 1, per_file[path])
+            per_get, fetched = shares[(path, offset, size)]
+            routes[chunk_coords] = (
+                self.reductionist_cost(size, returned, per_request)
+                <= self.client_cost(fetched, plan.chunk_nbytes, per_get))
+        plan.routes = routes
+        return routes
+
+    def as_dict(self):
+        """Return the coefficients of the model, in seconds and seconds per
+        byte."""
+        with self._lock:
+            return {
+                "reductionist_seconds": self._reductionist.intercept,
+                "reductionist_seconds_per_byte": self._reductionist.slope,
+                "get_seconds": self._get.intercept,
+                "get_seconds_per_byte": self._get.slope,
+                "decode_seconds_per_byte": self._decode.slope,
+            }
+
+    def __repr__(self):
+        return f"CostModel({self.as_dict()})"
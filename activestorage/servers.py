@@ -0,0 +1,120 @@
+"""
+Load balancing of chunk requests across a pool of Reductionist servers.
+
+Requests for the chunks of an object are sent to the server its (bucket,
+object) hashes to on a consistent hash ring, so that what a server caches
+about an object (its S3 connection, headers and data) is reused, and adding
+or removing a server only moves the objects that hashed to it. A server
+that can't be reached, or keeps failing with server errors, is ejected:
+the objects that hashed to it go to the next server on the ring until its
+health record expires (see reductionist.HEALTH_TTL).
+"""
+import bisect
+import hashlib
+import logging
+import threading
+
+from activestorage import reductionist
+
+logger = logging.getLogger(__name__)
+
+
+# Points on the hash ring per server, to spread objects evenly
+REPLICAS = 100
+
+# Consecutive server errors after which a server is ejected
+MAX_FAILURES = 5
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class ServerPool:
+    """
+    A pool of Reductionist servers.
+
+    :param servers: server URLs
+    :param replicas: points on the hash ring per server
+    :param max_failures: consecutive server errors after which a server is
+                         ejected
+    """
+
+    def __init__(self, servers, replicas=REPLICAS, max_failures=MAX_FAILURES):
+        self.servers = list(dict.fromkeys(servers))
+        if not self.servers:
+            raise ValueError("Must give at least one Reductionist server")
+        self.max_failures = max_failures
+        self._ring = sorted((_hash(f"{server}#{i}"), server)
+                            for server in self.servers
+                            for i in range(replicas))
+        self._points = [point for point, _ in self._ring]
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def servers_for(self, bucket, object):
+        """
+        Return the servers in order of preference for the chunks of an
+        object: those not ejected first, each group in ring order.
+        """
+        start = bisect.bisect(self._points, _hash(f"{bucket}/{object}"))
+        order = []
+        for i in range(len(self._ring)):
+            server = self._ring[(start + i) % len(self._ring)][1]
+            if server not in order:
+                order.append(server)
+                if len(order) == len(self.servers):
+                    break
+        healthy = [server for server in order if self.is_healthy(server)]
+        return healthy + [server for server in order if server not in healthy]
+
+    def server_for(self, bucket, object):
+        """Return the server for the chunks of an object."""
+        return self.servers_for(bucket, object)[0]
+
+    def is_healthy(self, server):
+        """Return whether a server is not ejected."""
+        return reductionist.get_health(server) is None
+
+    def healthy_servers(self):
+        """Return the servers not ejected."""
+        return [server for server in self.servers if self.is_healthy(server)]
+
+    def eject(self, server, reason):
+        """Stop sending requests to a server for a while."""
+        logger.warning("Ejecting %s", reason)
+        reductionist.mark_health(server, reason)
+
+    def succeeded(self, server):
+        """Record a successful request to a server."""
+        with self._lock:
+            self._failures.pop(server, None)
+
+    def failed(self, server, exc):
+        """Record a failed request to a server, ejecting it if it can't be
+        reached or keeps failing with server errors."""
+        if reductionist.is_unreachable(exc):
+            self.eject(server, f"Reductionist server {server} unavailable: "
+                               f"{exc}")
+            return
+        if not reductionist.is_overload(exc):
+            return
+        with self._lock:
+            failures = self._failures.get(server, 0) + 1
+            self._failures[server] = failures
+            if failures >= self.max_failures:
+                del self._failures[server]
+        if failures >= self.max_failures:
+            self.eject(server, f"Reductionist server {server} failing: {exc}")
+
+    def check(self, session):
+        """Check the health of every server.
+
+        :param session: a client session object from reductionist.get_session
+        :returns: None if any server is up, or why none is
+        """
+        reasons = [reductionist.check_health(session, server)
+                   for server in self.servers]
+        if any(reason is None for reason in reasons):
+            return None
+        return "; ".join(reasons)
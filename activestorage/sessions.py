@@ -0,0 +1,121 @@
+"""
+Cache of S3 filesystems and Reductionist client sessions.
+
+Creating an s3fs.S3FileSystem resolves credentials and sets up a connection
+pool, and creating a Reductionist session (a requests.Session, or an
+http2.HTTP2Session) means new TCP (and TLS) connections to Reductionist, so
+we do it once per set of credentials and endpoint and share the objects
+between all the code paths that need them, and between Active instances.
+Both are safe to share between threads.
+
+Long-running services can drop everything (for instance after rotating
+credentials) with clear_cache(), or a single entry with evict_filesystem()
+or evict_session().
+"""
+import threading
+
+import fsspec
+import s3fs
+
+from activestorage.config import *
+from activestorage import reductionist
+
+
+_lock = threading.Lock()
+_filesystems = {}
+_sessions = {}
+
+
+def default_storage_options():
+    """Return the pre-configured S3 storage options."""
+    return {
+        'key': S3_ACCESS_KEY,  # eg "minioadmin" for Minio
+        'secret': S3_SECRET_KEY,  # eg "minioadmin" for Minio
+        'client_kwargs': {'endpoint_url': S3_URL},  # eg "http://localhost:9000" for Minio
+    }
+
+
+def _filesystem_key(storage_options):
+    """
+    Key filesystems by endpoint, access key and anon flag, plus a token of
+    all the options, so that eg different secrets never share an entry.
+    """
+    endpoint_url = storage_options.get('endpoint_url')
+    if endpoint_url is None:
+        endpoint_url = storage_options.get('client_kwargs', {}).get('endpoint_url')
+    return (endpoint_url,
+            storage_options.get('key'),
+            bool(storage_options.get('anon', False)),
+            fsspec.utils.tokenize(storage_options))
+
+
+def get_s3_filesystem(storage_options=None):
+    """
+    Return a shared s3fs.S3FileSystem for the storage options.
+
+    :param storage_options: s3fs.S3FileSystem options, or None to use the
+                            pre-configured S3 credentials
+    :returns: an s3fs.S3FileSystem
+    """
+    if storage_options is None:
+        storage_options = default_storage_options()
+    key = _filesystem_key(storage_options)
+    with _lock:
+        fs = _filesystems.get(key)
+        if fs is None:
+            # we manage the lifetime of our instances, not fsspec
+            fs = s3fs.S3FileSystem(skip_instance_cache=True, **storage_options)
+            _filesystems[key] = fs
+    return fs
+
+
+def get_session(username, password, cacert, http2=False):
+    """
+    Return a shared Reductionist client session for the credentials.
+
+    :param username: S3 username / access key
+    :param password: S3 password / secret key
+    :param cacert: Reductionist CA certificate path
+    :param http2: if True, a session multiplexing requests over HTTP/2
+    :returns: a requests.Session, or an http2.HTTP2Session
+    """
+    key = (username, password, cacert, http2)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = reductionist.get_session(username, password, cacert,
+                                               http2=http2)
+            _sessions[key] = session
+    return session
+
+
+def evict_filesystem(storage_options=None):
+    """Drop the cached filesystem for the storage options, if any."""
+    if storage_options is None:
+        storage_options = default_storage_options()
+    with _lock:
+        _filesystems.pop(_filesystem_key(storage_options), None)
+
+
+def evict_session(username, password, cacert, http2=False):
+    """Drop and close the cached session for the credentials, if any."""
+    with _lock:
+        session = _sessions.pop((username, password, cacert, http2), None)
+    if session is not None:
+        session.close()
+
+
+def clear_cache():
+    """Drop all cached filesystems, and close and drop all sessions."""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+        _filesystems.clear()
+    for session in sessions:
+        session.close()
+
+
+def cache_info():
+    """Return the number of cached filesystems and sessions."""
+    with _lock:
+        return {'filesystems': len(_filesystems), 'sessions': len(_sessions)}
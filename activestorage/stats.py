@@ -0,0 +1,113 @@
+"""
+Performance statistics of Active calls.
+
+Each call of Active.get (or aget) records where its time went in a
+CallStats, found in Active.stats afterwards: the chunks touched, the bytes
+read from storage, decoded and returned, the time spent in each stage, and
+a histogram of the latency of the chunks. Recording is a few additions per
+chunk, under a lock, so it is always on.
+
+Stage times are summed over the chunks, which are processed concurrently,
+so together they can exceed the wall time of the call. For chunks reduced
+by Reductionist, the whole request counts as I/O: the client can't tell
+how the server spent it.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+
+# Stages of a call that time is recorded for
+STAGES = ("metadata", "io", "decode", "mask", "reduce", "aggregate")
+
+# Upper bounds, in seconds, of the buckets of the chunk latency histogram,
+# from 100us doubling to about 100s; a last bucket holds slower chunks.
+LATENCY_BOUNDS = tuple(1e-4 * 2 ** i for i in range(21))
+
+
+class CallStats:
+    """Statistics of one call, safe to update from many threads."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+        self.bytes_returned = 0
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.wall_seconds = 0.0
+        self.latencies = [0] * (len(LATENCY_BOUNDS) + 1)
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        """Add seconds spent in a stage."""
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Add the time spent in the body of a with statement to a stage."""
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - began)
+
+    def add_chunk(self, bytes_read, bytes_decoded, bytes_returned, latency):
+        """
+        Record a chunk processed.
+
+        :param bytes_read: bytes read from storage, compressed
+        :param bytes_decoded: bytes of the chunk once decompressed
+        :param bytes_returned: bytes of the result for the chunk
+        :param latency: seconds taken to process the chunk
+        """
+        bucket = bisect.bisect_left(LATENCY_BOUNDS, latency)
+        with self._lock:
+            self.chunks += 1
+            self.bytes_read += bytes_read
+            self.bytes_decoded += bytes_decoded
+            self.bytes_returned += bytes_returned
+            self.latencies[bucket] += 1
+
+    def latency_histogram(self):
+        """Return the chunk latency histogram, as a list of (upper bound in
+        seconds, number of chunks) for the buckets with chunks in."""
+        with self._lock:
+            counts = list(self.latencies)
+        bounds = LATENCY_BOUNDS + (float("inf"),)
+        return [(bound, count) for bound, count in zip(bounds, counts)
+                if count]
+
+    def latency_quantile(self, quantile):
+        """Return an upper bound on a quantile of the chunk latencies, in
+        seconds, or None if no chunk was processed."""
+        with self._lock:
+            counts = list(self.latencies)
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        bounds = LATENCY_BOUNDS + (float("inf"),)
+        for bound, count in zip(bounds, counts):
+            seen += count
+            if seen >= quantile * total:
+                return bound
+        return bounds[-1]
+
+    def as_dict(self):
+        """Return the statistics as a dict."""
+        with self._lock:
+            stats = {
+                "chunks": self.chunks,
+                "bytes_read": self.bytes_read,
+                "bytes_decoded": self.bytes_decoded,
+                "bytes_returned": self.bytes_returned,
+                "seconds": dict(self.seconds),
+                "wall_seconds": self.wall_seconds,
+            }
+        stats["latency_histogram"] = self.latency_histogram()
+        return stats
+
+    def __repr__(self):
+        return f"CallStats({self.as_dict()})"
@@ -1,9 +1,12 @@
 """Active storage module."""
+import time
+
 import numpy as np
 
 from numcodecs.compat import ensure_ndarray
 
-def reduce_chunk(rfile, offset, size, compression, filters, missing, dtype, shape, order, chunk_selection, method=None):
+def reduce_chunk(rfile, offset, size, compression, filters, missing, dtype, shape, order, chunk_selection, method=None,
+                 stats=None):
     """ We do our own read of chunks and decoding etc 
     
     rfile - the actual file with the data 
@@ -21,32 +24,58 @@ def reduce_chunk(rfile, offset, size, compression, filters, missing, dtype, shap
     method - computation desired 
             (in this Python version it's an actual method, in 
             storage implementations we'll change to controlled vocabulary)
+    stats - optional stats.CallStats to add the time spent reading,
+            decoding, masking and reducing to
                     
     """
     
+    began = time.perf_counter()
     #FIXME: for the moment, open the file every time ... we might want to do that, or not
     with open(rfile,'rb') as open_file:
         # get the data
         chunk = read_block(open_file, offset, size)
-        # reverse any compression and filters
-        chunk = filter_pipeline(chunk, compression, filters)
-        # make it a numpy array of bytes
-        chunk = ensure_ndarray(chunk)
-        # convert to the appropriate data type
-        chunk = chunk.view(dtype)
-        # sort out ordering and convert to the parent hyperslab dimensions
-        chunk = chunk.reshape(-1, order='A')
-        chunk = chunk.reshape(shape, order=order)
+    if stats is not None:
+        stats.add_time("io", time.perf_counter() - began)
+
+    return reduce_chunk_bytes(chunk, compression, filters, missing, dtype,
+                              shape, order, chunk_selection, method=method,
+                              stats=stats)
+
+
+def reduce_chunk_bytes(chunk, compression, filters, missing, dtype, shape, order, chunk_selection, method=None,
+                       stats=None):
+    """ As reduce_chunk, for the (possibly compressed and filtered) bytes
+    of a chunk that have already been read, from wherever they are stored. """
+    began = time.perf_counter()
+    # reverse any compression and filters
+    chunk = filter_pipeline(chunk, compression, filters)
+    # make it a numpy array of bytes
+    chunk = ensure_ndarray(chunk)
+    # convert to the appropriate data type
+    chunk = chunk.view(dtype)
+    # sort out ordering and convert to the parent hyperslab dimensions
+    chunk = chunk.reshape(-1, order='A')
+    chunk = chunk.reshape(shape, order=order)
 
     tmp = chunk[chunk_selection]
+    decoded = time.perf_counter()
+    if stats is not None:
+        stats.add_time("decode", decoded - began)
     if method:
         if missing != (None, None, None, None):
             tmp = remove_missing(tmp, missing)
+            masked = time.perf_counter()
+            if stats is not None:
+                stats.add_time("mask", masked - decoded)
+            decoded = masked
         # check on size of tmp; method(empty) returns nan
-        if tmp.any():
-            return method(tmp), tmp.size
+        if tmp.size:
+            result = method(tmp), tmp.size
         else:
-            return tmp, None
+            result = tmp, None
+        if stats is not None:
+            stats.add_time("reduce", time.perf_counter() - decoded)
+        return result
     else:
         return tmp, None
 
@@ -18,6 +18,7 @@ REQUIREMENTS = {
     # Installation dependencies
     # Use with pip install . to install from source
     'install': [
+        'aiohttp',
         'dask',
         'fsspec',
         'h5netcdf',
@@ -42,6 +43,11 @@ REQUIREMENTS = {
         # 'sphinx>=5',
         # 'sphinx_rtd_theme',
     ],
+    # Optional dependencies
+    # Use with pip install .[http2] for the HTTP/2 Reductionist transport
+    'http2': [
+        'httpx[http2]',
+    ],
 }
 
 
@@ -94,5 +100,8 @@ setup(
     include_package_data=True,
     setup_requires=REQUIREMENTS['setup'],
     install_requires=REQUIREMENTS['install'],
+    extras_require={
+        'http2': REQUIREMENTS['http2'],
+    },
     zip_safe=False,
 )
@@ -0,0 +1,43 @@
+import os
+import time
+
+import numpy as np
+
+from activestorage.active import Active
+from numpy.testing import assert_allclose
+from config_minio import *
+from test_s3_reduction import make_tempfile, upload_to_s3
+
+
+def timed(active, index):
+    """Return the result of active[index], and the seconds it took."""
+    began = time.perf_counter()
+    result = active[index]
+    return result, time.perf_counter() - began
+
+
+def test_s3_direct_vs_h5netcdf():
+    """Benchmark the direct S3 mode against reading with h5netcdf."""
+    s3_testfile, local_testfile = make_tempfile()
+    object = os.path.basename(s3_testfile)
+    bucket_file = upload_to_s3(S3_URL, S3_ACCESS_KEY, S3_SECRET_KEY,
+                               S3_BUCKET, object, s3_testfile)
+    s3_testfile_uri = os.path.join("s3://", bucket_file)
+
+    # version 0: the whole selection is read with h5netcdf over s3fs
+    active = Active(s3_testfile_uri, "data", "s3")
+    active._version = 0
+    expected, h5netcdf_seconds = timed(active, np.s_[:, :, :])
+    expected = np.max(expected)
+
+    active = Active(s3_testfile_uri, "data", "s3", s3_mode="direct")
+    active._version = 2
+    active._method = "max"
+    result, direct_seconds = timed(active, np.s_[:, :, :])
+    stats = active._reader.stats()
+    print(f"h5netcdf: {h5netcdf_seconds:.3f}s, direct: {direct_seconds:.3f}s, "
+          f"{stats['requests']} requests, {stats['bytes_fetched']} bytes")
+
+    assert_allclose(result, expected)
+    # 160 chunks read with far fewer requests
+    assert stats["requests"] < 160
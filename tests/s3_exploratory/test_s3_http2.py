@@ -0,0 +1,54 @@
+import os
+import time
+
+import pytest
+
+from activestorage import sessions
+from activestorage.active import Active
+from numpy.testing import assert_allclose
+from config_minio import *
+from test_s3_reduction import make_tempfile, upload_to_s3
+
+
+def requests_connections(session):
+    """Return the connections a requests.Session has made."""
+    pools = session.get_adapter(S3_ACTIVE_STORAGE_URL).poolmanager.pools
+    return sum(pools[key].num_connections for key in pools.keys())
+
+
+def test_s3_http2_vs_requests():
+    """Benchmark the connections made and throughput of the HTTP/2
+    transport against requests."""
+    pytest.importorskip("httpx")
+    if not S3_ACTIVE_STORAGE_URL.startswith("https://"):
+        pytest.skip("HTTP/2 is only used with Reductionist over TLS")
+    s3_testfile, _ = make_tempfile()
+    object = os.path.basename(s3_testfile)
+    bucket_file = upload_to_s3(S3_URL, S3_ACCESS_KEY, S3_SECRET_KEY,
+                               S3_BUCKET, object, s3_testfile)
+    s3_testfile_uri = os.path.join("s3://", bucket_file)
+
+    results = {}
+    for http2 in (False, True):
+        sessions.clear_cache()
+        active = Active(s3_testfile_uri, "data", "s3", http2=http2)
+        active._version = 1
+        active._method = "max"
+        began = time.perf_counter()
+        for _ in range(5):
+            result = active[:, :, :]
+        seconds = time.perf_counter() - began
+        session = sessions.get_session(S3_ACCESS_KEY, S3_SECRET_KEY,
+                                       S3_ACTIVE_STORAGE_CACERT, http2=http2)
+        if http2:
+            connections = session.stats()["connections"]
+        else:
+            connections = requests_connections(session)
+        results[http2] = (result, seconds, connections)
+        print(f"http2={http2}: {5 * 160 / seconds:.0f} requests/s, "
+              f"{connections} connections")
+
+    assert_allclose(results[True][0], results[False][0])
+    # all requests multiplexed over a few connections
+    assert results[True][2] < results[False][2]
+    sessions.clear_cache()
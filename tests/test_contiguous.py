@@ -0,0 +1,119 @@
+import os
+import numpy as np
+import pytest
+
+from netCDF4 import Dataset
+
+from activestorage.active import Active
+from activestorage.config import *
+from activestorage.dummy_data import make_contiguous_ncdata
+from activestorage.netcdf_to_zarr import _virtual_chunk_shape
+
+import utils
+
+
+def create_contiguous_dataset(tmp_path):
+    """Make a vanilla test dataset stored contiguously."""
+    temp_file = str(tmp_path / "test_contiguous.nc")
+    make_contiguous_ncdata(filename=temp_file)
+
+    with Dataset(temp_file) as test_data:
+        assert test_data.variables["data"].chunking() == "contiguous"
+
+    test_file = utils.write_to_storage(temp_file)
+    if USE_S3:
+        os.remove(temp_file)
+    return test_file, temp_file
+
+
+def test_virtual_chunk_shape():
+    """Test the virtual chunk shape for various sizes."""
+    # whole variable fits in a chunk: no split
+    assert _virtual_chunk_shape([10, 10, 10], 8, 8000) is None
+    # split the leading axis only
+    assert _virtual_chunk_shape([10, 10, 10], 8, 1600) == [2, 10, 10]
+    # split along the middle axis
+    assert _virtual_chunk_shape([10, 10, 10], 8, 400) == [1, 5, 10]
+    # largest divisor of the axis length that fits
+    assert _virtual_chunk_shape([12, 10], 8, 700) == [6, 10]
+    # prime axis length would give tiny chunks: no split
+    assert _virtual_chunk_shape([1009, 1], 1, 500) is None
+    # prime leading axis, but the inner rows are big enough on their own
+    assert _virtual_chunk_shape([8761, 100, 100], 4, 4 * 1024 ** 2) == \
+        [1, 100, 100]
+    assert _virtual_chunk_shape([7919, 100, 100], 4, 4 * 1024 ** 2) == \
+        [1, 100, 100]
+
+
+@pytest.mark.parametrize("method", ["min", "max", "mean", "sum"])
+def test_contiguous_reductions(tmp_path, method):
+    """Test reductions on a contiguous variable split into virtual chunks."""
+    test_file, temp_file = create_contiguous_dataset(tmp_path)
+
+    active = Active(test_file, "data", utils.get_storage_type(),
+                    contiguous_chunk_size=400)
+    active._version = 0
+    expected = getattr(np, method)(active[0:2, 4:6, 7:9])
+
+    active = Active(test_file, "data", utils.get_storage_type(),
+                    contiguous_chunk_size=400)
+    active._version = 1
+    active.method = method
+    result = active[0:2, 4:6, 7:9]
+    assert active.zds._chunks == (1, 5, 10)
+    assert result == expected
+
+
+def test_contiguous_selection(tmp_path):
+    """Test a selection from a contiguous variable split into virtual chunks."""
+    test_file, temp_file = create_contiguous_dataset(tmp_path)
+
+    active = Active(test_file, "data", utils.get_storage_type())
+    active._version = 0
+    expected = active[1:9, ::3, 5]
+
+    active = Active(test_file, "data", utils.get_storage_type(),
+                    contiguous_chunk_size=800)
+    active._version = 1
+    result = active[1:9, ::3, 5]
+    assert active.zds._chunks == (1, 10, 10)
+
+    fsref = active.zds.chunk_store.fs.references
+    chunk_keys = [k for k in fsref if k.startswith("data/") and "/." not in k]
+    assert len(chunk_keys) == 10
+    assert len({tuple(fsref[k][1:]) for k in chunk_keys}) == 10
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("method", ["sum", "mean"])
+def test_contiguous_zero_chunks(tmp_path, method):
+    """Test reductions over virtual chunks that are all zeros."""
+    temp_file = str(tmp_path / "test_zeros.nc")
+    data = np.zeros((1000, 1000))
+    data[600:] = 1.0
+    with Dataset(temp_file, "w") as ds:
+        ds.createDimension("x", 1000)
+        ds.createDimension("y", 1000)
+        var = ds.createVariable("data", "f8", ("x", "y"), contiguous=True)
+        var[:] = data
+    test_file = utils.write_to_storage(temp_file)
+
+    active = Active(test_file, "data", utils.get_storage_type())
+    active._version = 1
+    active.method = method
+    result = active[:]
+    assert active.zds._chunks != (1000, 1000)
+    np.testing.assert_allclose(result, getattr(np, method)(data))
+
+
+def test_contiguous_no_split(tmp_path):
+    """Test that splitting can be disabled."""
+    test_file, temp_file = create_contiguous_dataset(tmp_path)
+
+    active = Active(test_file, "data", utils.get_storage_type(),
+                    contiguous_chunk_size=None)
+    active._version = 1
+    active.method = "max"
+    result = active[:]
+    assert active.zds._chunks == (10, 10, 10)
+    assert result == 999.0
@@ -0,0 +1,173 @@
+import os
+import numpy as np
+import pytest
+
+from netCDF4 import Dataset
+
+from activestorage.active import Active
+from activestorage.config import *
+from activestorage import netcdf3
+
+import utils
+
+
+NETCDF3_FORMATS = ["NETCDF3_CLASSIC", "NETCDF3_64BIT_OFFSET", "NETCDF3_64BIT_DATA"]
+
+
+def make_netcdf3_data(filename, file_format, single_record_var=False):
+    """
+    Make a netCDF3 test dataset with a fixed-size variable and record
+    variables of sizes that need padding within each record.
+    """
+    n = 10
+    data = np.arange(n * n * n, dtype="f8").reshape(n, n, n)
+    with Dataset(filename, "w", format=file_format) as ds:
+        ds.title = "netCDF3 test data"
+        ds.createDimension("time", None)
+        for dim in ("xdim", "ydim", "zdim"):
+            ds.createDimension(dim, n)
+        ds.createDimension("three", 3)
+
+        dvar = ds.createVariable("data", "f8", ("xdim", "ydim", "zdim"),
+                                 fill_value=-999.)
+        dvar.missing_value = 999.
+        dvar[:] = data
+        dvar[0, 4, 7] = 999.
+
+        rec_short = ds.createVariable("rec_short", "i2", ("time", "three"))
+        rec_short[0:7] = np.arange(21, dtype="i2").reshape(7, 3)
+        if not single_record_var:
+            rec = ds.createVariable("rec", "f4", ("time", "zdim"))
+            rec[0:7] = np.arange(70, dtype="f4").reshape(7, n) * 1.5
+
+    return filename
+
+
+def create_netcdf3_dataset(tmp_path, file_format, single_record_var=False):
+    temp_file = str(tmp_path / "test_netcdf3.nc")
+    make_netcdf3_data(temp_file, file_format, single_record_var)
+    test_file = utils.write_to_storage(temp_file)
+    if USE_S3:
+        os.remove(temp_file)
+    return test_file, temp_file
+
+
+@pytest.mark.parametrize("file_format", NETCDF3_FORMATS)
+def test_read_header(tmp_path, file_format):
+    """Test parsing of the netCDF3 header."""
+    test_file, temp_file = create_netcdf3_dataset(tmp_path, file_format)
+    with open(temp_file, "rb") as fileobj:
+        assert netcdf3.is_netcdf3(fileobj)
+        header = netcdf3.read_header(fileobj)
+    assert header["numrecs"] == 7
+    assert header["dims"]["time"] is None
+    assert header["dims"]["xdim"] == 10
+    data = header["variables"]["data"]
+    assert data["dims"] == ["xdim", "ydim", "zdim"]
+    assert data["dtype"] == np.dtype(">f8")
+    assert netcdf3._decode_attribute(data["attrs"]["missing_value"]) == 999.
+    assert netcdf3._decode_attribute(header["attrs"]["title"]) == "netCDF3 test data"
+
+
+@pytest.mark.parametrize("file_format", NETCDF3_FORMATS)
+def test_streaming(tmp_path, file_format):
+    """Test that the records of a file still being written are counted."""
+    temp_file = make_netcdf3_data(str(tmp_path / "test_netcdf3.nc"),
+                                  file_format)
+    width = 8 if file_format == "NETCDF3_64BIT_DATA" else 4
+    with open(temp_file, "r+b") as fileobj:
+        fileobj.seek(4)
+        fileobj.write(b"\xff" * width)
+    with open(temp_file, "rb") as fileobj:
+        header = netcdf3.read_header(fileobj)
+        assert header["numrecs"] == 2 ** (8 * width) - 1
+        recsize, numrecs = netcdf3._record_layout(header, fileobj)
+    assert numrecs == 7
+
+
+def test_not_netcdf3():
+    """Test that HDF5 files are not mistaken for netCDF3."""
+    with open("tests/test_data/cesm2_native.nc", "rb") as fileobj:
+        assert not netcdf3.is_netcdf3(fileobj)
+        with pytest.raises(ValueError):
+            netcdf3.read_header(fileobj)
+
+
+@pytest.mark.parametrize("file_format", NETCDF3_FORMATS)
+@pytest.mark.parametrize("method", ["min", "max", "mean", "sum"])
+def test_netcdf3_fixed_variable(tmp_path, file_format, method):
+    """Test reductions on a fixed-size netCDF3 variable with missing data."""
+    test_file, temp_file = create_netcdf3_dataset(tmp_path, file_format)
+    with Dataset(temp_file) as nc:
+        nc_data = nc["data"][0:2, 4:6, 7:9]
+        assert np.ma.count_masked(nc_data) == 1
+    expected = getattr(np.ma, method)(nc_data)
+
+    active = Active(test_file, "data", utils.get_storage_type())
+    active._version = 1
+    active.method = method
+    result = active[0:2, 4:6, 7:9]
+    np.testing.assert_allclose(result, expected)
+
+
+@pytest.mark.parametrize("file_format", NETCDF3_FORMATS)
+@pytest.mark.parametrize("method", ["min", "max", "mean", "sum"])
+def test_netcdf3_record_coordinate(tmp_path, file_format, method):
+    """Test reductions on a 1-D record variable, a chunk per element, with
+    a zero in it, as the time coordinate of most files has."""
+    temp_file = str(tmp_path / "test_netcdf3.nc")
+    with Dataset(temp_file, "w", format=file_format) as ds:
+        ds.createDimension("time", None)
+        time = ds.createVariable("time", "f8", ("time",))
+        time[0:5] = np.arange(5, dtype="f8")
+    test_file = utils.write_to_storage(temp_file)
+
+    active = Active(test_file, "time", utils.get_storage_type())
+    active._version = 1
+    active.method = method
+    assert active[:] == getattr(np, method)(np.arange(5, dtype="f8"))
+
+
+@pytest.mark.parametrize("file_format", NETCDF3_FORMATS)
+@pytest.mark.parametrize("dtype", ["i2", "i4", "f4", "f8"])
+def test_netcdf3_default_fill_value(tmp_path, file_format, dtype):
+    """Test that data never written, so holding the netCDF default fill
+    value of a variable without _FillValue, is missing."""
+    temp_file = str(tmp_path / "test_netcdf3.nc")
+    with Dataset(temp_file, "w", format=file_format) as ds:
+        ds.createDimension("x", 10)
+        var = ds.createVariable("partial", dtype, ("x",))
+        var[0:6] = np.arange(1, 7, dtype=dtype)
+    test_file = utils.write_to_storage(temp_file)
+    with Dataset(temp_file) as nc:
+        expected = nc["partial"][:]
+        assert np.ma.count_masked(expected) == 4
+
+    active = Active(test_file, "partial", utils.get_storage_type())
+    active._version = 1
+    active.method = "sum"
+    assert active[:] == np.ma.sum(expected)
+
+
+@pytest.mark.parametrize("file_format", NETCDF3_FORMATS)
+@pytest.mark.parametrize("single_record_var", [False, True])
+def test_netcdf3_record_variables(tmp_path, file_format, single_record_var):
+    """Test reading interleaved netCDF3 record variables."""
+    test_file, temp_file = create_netcdf3_dataset(tmp_path, file_format,
+                                                  single_record_var)
+    ncvars = ["rec_short"] if single_record_var else ["rec_short", "rec"]
+    for ncvar in ncvars:
+        with Dataset(temp_file) as nc:
+            expected = nc[ncvar][1:6, 1:]
+
+        active = Active(test_file, ncvar, utils.get_storage_type())
+        active._version = 1
+        result = active[1:6, 1:]
+        np.testing.assert_array_equal(result, expected)
+        # one chunk per record
+        assert active.zds._chunks[0] == 1
+
+        active = Active(test_file, ncvar, utils.get_storage_type())
+        active._version = 1
+        active.method = "sum"
+        assert active[1:6, 1:] == np.sum(expected)
@@ -1,11 +1,15 @@
+import asyncio
 import os
 import numpy as np
 import pytest
 import threading
 
+import h5netcdf
+
 from activestorage.active import Active
 from activestorage.active import load_from_s3
 from activestorage.config import *
+from activestorage.dummy_data import make_vanilla_ncdata
 from botocore.exceptions import EndpointConnectionError as botoExc
 from botocore.exceptions import NoCredentialsError as NoCredsExc
 
@@ -137,3 +141,109 @@ def test_get_endpoint_url():
     active = Active(uri, ncvar=ncvar, storage_options=storage_options)
     ep_url = Active._get_endpoint_url(active)
     assert ep_url == "https://cow.moo"
+
+
+def test_aget():
+    """Unit test for Active.aget, compared with __getitem__."""
+    uri = "tests/test_data/cesm2_native.nc"
+    ncvar = "TREFHT"
+    active = Active(uri, ncvar=ncvar)
+    expected = active[3:5]
+    np.testing.assert_array_equal(asyncio.run(active.aget(np.s_[3:5])),
+                                  expected)
+
+    active._method = "mean"
+    active.components = True
+    expected = active[:, 1:3]
+    result = asyncio.run(active.aget(np.s_[:, 1:3]))
+    np.testing.assert_allclose(result["sum"], expected["sum"], rtol=1e-6)
+    np.testing.assert_array_equal(result["n"], expected["n"])
+
+    # version 0 runs in the default executor
+    active._version = 0
+    active._method = None
+    active.components = False
+    np.testing.assert_array_equal(asyncio.run(active.aget(3)), active[3])
+
+
+@pytest.mark.parametrize("method", [None, "max"])
+def test_max_inflight_bytes(method):
+    """Test that the memory used by chunks in flight is bounded."""
+    uri = "tests/test_data/cesm2_native.nc"
+    ncvar = "TREFHT"
+    expected = Active(uri, ncvar=ncvar)
+    expected._method = method
+    expected = expected[:, 1:3]
+
+    active = Active(uri, ncvar=ncvar, max_inflight_bytes=1)
+    active._method = method
+    # chunks larger than the bound are processed one at a time
+    np.testing.assert_array_equal(active[:, 1:3], expected)
+    chunk_bytes = active._chunk_memory(active.zds.chunk_store.fs.references,
+                                       (0, 0, 0))
+    assert active._memory.peak == chunk_bytes
+    assert active._memory.in_use == 0
+
+    active = Active(uri, ncvar=ncvar, max_inflight_bytes=3 * chunk_bytes)
+    active._method = method
+    np.testing.assert_array_equal(active[:, 1:3], expected)
+    assert active._memory.peak <= 3 * chunk_bytes
+    np.testing.assert_array_equal(asyncio.run(active.aget(np.s_[:, 1:3])),
+                                  expected)
+    assert active._memory.peak <= 3 * chunk_bytes
+
+
+def test_stats():
+    """Test that Active records the statistics of each call."""
+    uri = "tests/test_data/cesm2_native.nc"
+    ncvar = "TREFHT"
+    active = Active(uri, ncvar=ncvar)
+    active._method = "max"
+    active[:, 1:3]
+    stats = active.stats
+    assert stats.chunks == len(active.chunk_paths)
+    assert stats.bytes_read > 0
+    assert stats.bytes_decoded >= stats.bytes_read
+    assert stats.bytes_returned > 0
+    for stage in ("metadata", "io", "decode", "reduce", "aggregate"):
+        assert stats.seconds[stage] > 0
+    assert stats.wall_seconds > 0
+    assert sum(count for _, count in stats.latency_histogram()) == stats.chunks
+
+    # each call has its own statistics
+    asyncio.run(active.aget(np.s_[0, 1:3]))
+    assert active.stats is not stats
+    assert active.stats.chunks == len(active.chunk_paths)
+
+
+def test_plan():
+    """Test that a plan has the chunks and bytes a call then reads."""
+    uri = "tests/test_data/cesm2_native.nc"
+    ncvar = "TREFHT"
+    active = Active(uri, ncvar=ncvar)
+    active._method = "max"
+    plan = active.plan(np.s_[:, 1:3])
+    assert plan.backend == "local"
+    assert plan.requests["local"] == plan.nchunks
+    assert plan.coalescing["saved"] == plan.nchunks - plan.requests["s3"]
+
+    active[:, 1:3]
+    assert sorted(chunk[0] for chunk in plan.chunks) == sorted(
+        active.chunk_paths)
+    assert plan.compressed_bytes == active.stats.bytes_read
+    assert plan.decoded_bytes == active.stats.bytes_decoded
+    assert plan.memory["chunk"] == active._chunk_memory(
+        active.zds.chunk_store.fs.references, plan.chunks[0][0])
+
+
+def test_integer_array_selection(tmp_path):
+    """Test selecting data with an unsorted integer array index."""
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+    active = Active(test_file, "data")
+    active._version = 1
+    with h5netcdf.File(test_file) as ds:
+        expected = ds["data"][[1, 4, 7], 2:5, 3][[2, 0, 1]]
+    np.testing.assert_array_equal(active[[7, 1, 4], 2:5, 3], expected)
+    np.testing.assert_array_equal(
+        asyncio.run(active.aget(np.s_[[7, 1, 4], 2:5, 3])), expected)
@@ -0,0 +1,41 @@
+import asyncio
+
+from activestorage import backpressure
+
+
+def test_memory_budget():
+    """Test that chunks fit within the bound, or alone."""
+    memory = backpressure.MemoryBudget(100)
+    assert memory.fits(150)
+    memory.take(60)
+    assert memory.fits(40)
+    assert not memory.fits(41)
+    memory.take(40)
+    memory.release(60)
+    assert memory.in_use == 40
+    assert memory.peak == 100
+
+    unbounded = backpressure.MemoryBudget(None)
+    unbounded.take(10 ** 12)
+    assert unbounded.fits(10 ** 12)
+
+
+def test_memory_budget_acquire():
+    """Test that tasks wait for memory to be released."""
+    memory = backpressure.MemoryBudget(100)
+    order = []
+
+    async def task(name, nbytes, seconds):
+        await memory.acquire(nbytes)
+        order.append(name)
+        await asyncio.sleep(seconds)
+        memory.release(nbytes)
+
+    async def run():
+        await asyncio.gather(task("a", 70, 0.02), task("b", 70, 0.01),
+                             task("c", 30, 0.01))
+
+    asyncio.run(run())
+    assert order == ["a", "c", "b"]
+    assert memory.peak == 100
+    assert memory.in_use == 0
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+from activestorage import cancellation
+
+
+def test_cancel_token():
+    """Test cancelling a token, and its callbacks."""
+    token = cancellation.CancelToken()
+    called = []
+    token.add_callback(lambda: called.append(1))
+    assert not token.cancelled
+    assert token.remaining() is None
+    token.check()
+
+    token.cancel()
+    token.cancel()
+    assert token.cancelled
+    assert called == [1]
+    with pytest.raises(cancellation.Cancelled):
+        token.check()
+    # too late to wait for it
+    token.add_callback(lambda: called.append(2))
+    assert called == [1, 2]
+
+
+def test_deadline():
+    """Test that a token expires at its deadline."""
+    token = cancellation.CancelToken(0.05)
+    assert 0 < token.remaining() <= 0.05
+    token.check()
+    time.sleep(0.06)
+    assert token.remaining() == 0
+    with pytest.raises(cancellation.DeadlineExceeded):
+        token.check()
+    # also a TimeoutError
+    with pytest.raises(TimeoutError):
+        token.check()
+
+
+def test_parent():
+    """Test that cancelling a parent cancels its children, and that
+    children keep the earliest deadline."""
+    parent = cancellation.CancelToken(10)
+    child = cancellation.CancelToken(100, parent=parent)
+    assert child.deadline == parent.deadline
+    threading.Thread(target=parent.cancel).start()
+    time.sleep(0.05)
+    assert child.cancelled
+
+    parent = cancellation.CancelToken()
+    child = cancellation.CancelToken(parent=parent)
+    child.close()
+    parent.cancel()
+    assert not child.cancelled
@@ -0,0 +1,144 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import requests
+
+from activestorage import concurrency
+from activestorage.reductionist import ReductionistError
+
+
+def complete(controller, latency, error=None):
+    """Make a request taking latency seconds."""
+    controller.acquire()
+    controller.release(time.perf_counter() - latency, error)
+
+
+def test_slow_start():
+    """Test that the limit doubles every round trip until a decrease."""
+    controller = concurrency.AIMDController(maximum=100)
+    assert controller.stats()["limit"] == concurrency.INITIAL_LIMIT
+    for _ in range(concurrency.INITIAL_LIMIT):
+        complete(controller, 0.01)
+    assert controller.stats()["limit"] == 2 * concurrency.INITIAL_LIMIT
+    for _ in range(100 - 2 * concurrency.INITIAL_LIMIT):
+        complete(controller, 0.01)
+    assert controller.stats()["limit"] == 100
+    assert controller.stats()["errors"] == 0
+    assert controller.stats()["slow_start"]
+
+    # additive increase after an overload error
+    time.sleep(0.02)
+    complete(controller, 0.01, ReductionistError(503, "busy"))
+    assert controller.stats()["limit"] == 50
+    assert not controller.stats()["slow_start"]
+    for _ in range(55):
+        complete(controller, 0.01)
+    assert controller.stats()["limit"] == 51
+
+
+def test_additive_increase():
+    """Test that the limit grows by about one per limit requests."""
+    controller = concurrency.AIMDController(initial=4, maximum=10,
+                                            slow_start=False)
+    for _ in range(4):
+        complete(controller, 0.01)
+    assert controller.stats()["limit"] == 4
+    for _ in range(20):
+        complete(controller, 0.01)
+    assert 6 <= controller.stats()["limit"] <= 8
+    for _ in range(1000):
+        complete(controller, 0.01)
+    assert controller.stats()["limit"] == 10
+    assert controller.stats()["requests"] == 1024
+    assert controller.stats()["throughput"] > 0
+
+
+def test_multiplicative_decrease():
+    """Test that the limit halves on overload errors, once per round trip."""
+    controller = concurrency.AIMDController(initial=16, maximum=100,
+                                            is_overload=concurrency.reductionist.is_overload)
+    complete(controller, 0.1)
+    complete(controller, 0.01, ReductionistError(503, "busy"))
+    assert controller.stats()["limit"] == 8
+    # in flight at the same time, so no further decrease
+    complete(controller, 0.01, requests.exceptions.ConnectTimeout())
+    assert controller.stats()["limit"] == 8
+    time.sleep(0.11)
+    complete(controller, 0.01, requests.exceptions.ConnectTimeout())
+    assert controller.stats()["limit"] == 4
+    # bad requests are not the server's fault
+    time.sleep(0.11)
+    complete(controller, 0.01, ReductionistError(400, "bad"))
+    assert controller.stats()["limit"] == 4
+    assert controller.stats()["errors"] == 3
+
+
+def test_latency_decrease():
+    """Test that the limit decreases when latency rises."""
+    controller = concurrency.AIMDController(initial=20, maximum=100)
+    for _ in range(10):
+        complete(controller, 0.001)
+    limit = controller.limit
+    for _ in range(10):
+        complete(controller, 0.01)
+    assert controller.limit < limit
+    assert controller.stats()["decreases"] > 0
+
+
+def test_threads_respect_limit():
+    """Test that no more than limit threads make requests at once."""
+    controller = concurrency.AIMDController(initial=3, maximum=3)
+    in_flight = []
+    lock = threading.Lock()
+    running = 0
+
+    def request():
+        nonlocal running
+        with controller.slot():
+            with lock:
+                running += 1
+                in_flight.append(running)
+            time.sleep(0.005)
+            with lock:
+                running -= 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        list(executor.map(lambda _: request(), range(30)))
+    assert max(in_flight) == 3
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_tasks_respect_limit():
+    """Test that no more than limit tasks make requests at once."""
+    controller = concurrency.AIMDController(initial=2, maximum=2)
+    in_flight = []
+    running = 0
+
+    async def request():
+        nonlocal running
+        async with controller.aslot():
+            running += 1
+            in_flight.append(running)
+            await asyncio.sleep(0.005)
+            running -= 1
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(20)))
+
+    asyncio.run(run())
+    assert max(in_flight) == 2
+    assert controller.stats()["in_flight"] == 0
+    assert controller.stats()["requests"] == 20
+
+
+def test_get_controller():
+    """Test that controllers are shared per server."""
+    concurrency.clear_controllers()
+    controller = concurrency.get_controller("https://cow.moo", 10)
+    assert concurrency.get_controller("https://cow.moo", 10) is controller
+    assert concurrency.get_controller("https://bull.moo", 10) is not controller
+    assert controller.maximum == 10
+    concurrency.clear_controllers()
+    assert concurrency.get_controller("https://cow.moo", 10) is not controller
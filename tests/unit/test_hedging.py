@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from activestorage import hedging
+
+
+def warm_up(hedger, latency=0.001):
+    """Measure enough fast requests for hedging to start."""
+    for _ in range(hedger.min_samples):
+        hedger.call(lambda: time.sleep(latency), None)
+
+
+def test_no_hedging_before_min_samples():
+    """Test that requests are not hedged until latencies are known."""
+    hedger = hedging.Hedger(min_samples=5)
+    assert hedger.delay() is None
+    assert hedger.call(lambda: "moo", lambda: "baa") == "moo"
+    warm_up(hedger)
+    assert hedger.delay() is not None
+    assert hedger.stats()["hedges"] == 0
+
+
+def test_call_hedges_straggler():
+    """Test that a slow request is hedged, and the hedge's result taken."""
+    hedger = hedging.Hedger(min_samples=10, max_fraction=0.5)
+    warm_up(hedger)
+    released = threading.Event()
+
+    def straggler():
+        released.wait(10)
+        return "slow"
+
+    assert hedger.call(straggler, lambda: "fast") == "fast"
+    released.set()
+    assert hedger.stats()["hedges"] == 1
+    assert hedger.stats()["hedge_wins"] == 1
+    hedger.close()
+
+
+def test_call_budget():
+    """Test that no more than max_fraction of requests are hedged."""
+    hedger = hedging.Hedger(min_samples=20, max_fraction=0.05)
+    warm_up(hedger)
+
+    def straggler():
+        time.sleep(0.05)
+        return "slow"
+
+    results = [hedger.call(straggler, lambda: "fast") for _ in range(10)]
+    # one hedge allowed for 20 requests
+    assert results.count("fast") == 1
+    assert hedger.stats()["hedges"] == 1
+    hedger.close()
+
+
+def test_call_hedge_fails():
+    """Test that the primary's result is taken if the hedge fails."""
+    hedger = hedging.Hedger(min_samples=10, max_fraction=0.5)
+    warm_up(hedger)
+
+    def straggler():
+        time.sleep(0.05)
+        return "slow"
+
+    def fail():
+        raise ConnectionError()
+
+    assert hedger.call(straggler, fail) == "slow"
+    with pytest.raises(ValueError):
+        hedger.call(lambda: (time.sleep(0.05), int("moo")), fail)
+    hedger.close()
+
+
+def test_acall_hedges_straggler():
+    """Test that a slow coroutine is hedged, and cancelled."""
+    hedger = hedging.Hedger(min_samples=10, max_fraction=0.5)
+    cancelled = []
+
+    async def fast():
+        await asyncio.sleep(0.001)
+        return "fast"
+
+    async def straggler():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "slow"
+
+    async def run():
+        for _ in range(10):
+            await hedger.acall(fast, None)
+        return await hedger.acall(straggler, fast)
+
+    assert asyncio.run(run()) == "fast"
+    # the straggler was cancelled rather than waited for
+    assert cancelled == [True]
+    assert hedger.stats()["hedge_wins"] == 1
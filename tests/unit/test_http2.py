@@ -0,0 +1,225 @@
+import os
+import socket
+from unittest import mock
+
+import numpy as np
+import pytest
+import requests
+
+from activestorage import http2
+from activestorage import local_reductionist
+from activestorage import netcdf_to_zarr
+from activestorage import reductionist
+from activestorage import sessions
+from activestorage.active import Active
+from activestorage.config import *
+from activestorage.dummy_data import make_vanilla_ncdata
+
+
+# Capture the real function before it is mocked.
+old_netcdf_to_zarr = netcdf_to_zarr.load_netcdf_zarr_generic
+
+
+class FakeResponse:
+    """The parts of an httpx.Response used by http2.Response."""
+
+    def __init__(self, status_code, content, http_version="HTTP/2"):
+        self.status_code = status_code
+        self.headers = {"Content-Type": "application/json"}
+        self.content = content
+        self.http_version = http_version
+
+
+def test_response():
+    """Test that responses are decoded as requests responses are."""
+    response = http2.Response(FakeResponse(200, b"{}"))
+    assert response.ok
+    assert response.json() == {}
+
+    response = http2.Response(FakeResponse(503, b'{"error": "busy"}'))
+    assert not response.ok
+    with pytest.raises(reductionist.ReductionistError, match="busy"):
+        reductionist.decode_and_raise_error(response)
+
+    response = http2.Response(FakeResponse(502, b"<html>Bad gateway"))
+    with pytest.raises(reductionist.ReductionistError,
+                       match=r"HTTP 502: -") as exc_info:
+        reductionist.decode_and_raise_error(response)
+    assert reductionist.is_retryable(exc_info.value)
+
+
+class FakeStreamedResponse(FakeResponse):
+    """A streamed httpx.Response, whose body arrives in small pieces."""
+
+    def __init__(self, status_code, content, headers):
+        super().__init__(status_code, content)
+        self.headers = headers
+        self.closed = False
+        self.pieces = 0
+
+    def iter_bytes(self):
+        for start in range(0, len(self.content), 7):
+            self.pieces += 1
+            yield self.content[start:start + 7]
+
+    def read(self):
+        return self.content
+
+    def close(self):
+        self.closed = True
+
+
+def test_response_stream():
+    """Test that a streamed response is read into place as it arrives."""
+    data = np.arange(10, 20, dtype="int32")
+    headers = {"Content-Type": reductionist.FRAME_MEDIA_TYPE}
+    fake = FakeStreamedResponse(200, reductionist.encode_frame(data, 10),
+                                headers)
+    response = http2.Response(fake, stream=True)
+    out = np.zeros_like(data)
+    result, count = reductionist.read_result(response, out)
+    assert result is out
+    np.testing.assert_array_equal(out, data)
+    assert count == 10
+    assert fake.pieces > 1
+    response.close()
+    assert fake.closed
+
+    # errors are read whole, as before
+    fake = FakeStreamedResponse(503, b'{"error": "busy"}', headers)
+    response = http2.Response(fake, stream=True)
+    with pytest.raises(reductionist.ReductionistError, match="busy"):
+        reductionist.decode_and_raise_error(response)
+
+
+@pytest.mark.skipif(http2.httpx is not None, reason="httpx is installed")
+def test_no_httpx():
+    """Test that asking for HTTP/2 without httpx says what is missing."""
+    with pytest.raises(ImportError, match="httpx"):
+        reductionist.get_session("cow", "secretcow", None, http2=True)
+
+
+@mock.patch.object(http2, "HTTP2Session")
+def test_shared_session(mock_session):
+    """Test that HTTP/2 sessions are shared apart from the others."""
+    session = sessions.get_session("cow", "secretcow", None, http2=True)
+    assert session is mock_session.return_value
+    mock_session.assert_called_once_with("cow", "secretcow", None,
+                                         headers=reductionist.ACCEPT_HEADERS)
+    assert sessions.get_session("cow", "secretcow", None, http2=True) is session
+    assert sessions.get_session("cow", "secretcow", None) is not session
+    sessions.evict_session("cow", "secretcow", None, http2=True)
+    session.close.assert_called_once_with()
+    sessions.clear_cache()
+
+
+def test_http2_session(tmp_path):
+    """Test requests to Reductionist through an HTTP2Session, over the
+    HTTP/1.1 that servers without TLS speak."""
+    pytest.importorskip("httpx")
+    data = np.arange(100, dtype="int32")
+    os.makedirs(tmp_path / "bucket")
+    (tmp_path / "bucket" / "object").write_bytes(data.tobytes())
+    with local_reductionist.LocalReductionist(str(tmp_path)) as server:
+        session = reductionist.get_session("cow", "secretcow", None,
+                                           http2=True)
+        assert reductionist.check_health(session, server.url) is None
+        result, count = reductionist.reduce_chunk(
+            session, server.url, "http://s3.example.com", "bucket", "object",
+            0, data.nbytes, None, None, (None, None, None, None), data.dtype,
+            data.shape, "C", (slice(10, 20, 1),), "sum")
+        assert result == sum(range(10, 20)) and count == 10
+        # selections are streamed into place
+        out = np.zeros(10, dtype="int32")
+        result, count = reductionist.reduce_chunk(
+            session, server.url, "http://s3.example.com", "bucket", "object",
+            0, data.nbytes, None, None, (None, None, None, None), data.dtype,
+            data.shape, "C", (slice(10, 20, 1),), None, out=out)
+        assert result is out
+        np.testing.assert_array_equal(out, data[10:20])
+        stats = session.stats()
+        assert stats["requests"] == 3
+        assert stats["http2_responses"] == 0
+        assert stats["connections"] == 1
+
+    # transport errors are raised as requests errors
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    with pytest.raises(requests.exceptions.ConnectionError) as exc_info:
+        session.post(f"http://127.0.0.1:{port}/v1/sum/", json={})
+    assert reductionist.is_unreachable(exc_info.value)
+    session.close()
+
+
+@mock.patch.object(netcdf_to_zarr, "load_netcdf_zarr_generic")
+def test_active_http2(mock_nz, tmp_path):
+    """Test that Active with http2 makes its requests over a few
+    connections."""
+    pytest.importorskip("httpx")
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    os.makedirs(tmp_path / "fake-bucket")
+    test_file = str(tmp_path / "fake-bucket" / "fake-object")
+    make_vanilla_ncdata(test_file)
+
+    with local_reductionist.LocalReductionist(str(tmp_path),
+                                              latency=0.001) as server:
+        storage_options = {
+            "key": "cow",
+            "secret": "http2cow",
+            "client_kwargs": {"endpoint_url": S3_URL},
+        }
+        active = Active("s3://fake-bucket/fake-object", "data", "s3",
+                        storage_options=storage_options,
+                        active_storage_url=server.url, http2=True)
+        # as if the server were reached over TLS
+        active._use_http2 = lambda: True
+        active._version = 1
+        active._method = "max"
+        assert active[::] == 999.0
+        session = sessions.get_session("cow", "http2cow",
+                                       S3_ACTIVE_STORAGE_CACERT, http2=True)
+        stats = session.stats()
+        assert stats["requests"] == 160
+        assert stats["connections"] <= http2.MAX_CONNECTIONS
+    sessions.clear_cache()
+
+
+@mock.patch.object(http2, "HTTP2Session")
+@mock.patch.object(netcdf_to_zarr, "load_netcdf_zarr_generic")
+def test_active_http2_plain_http(mock_nz, mock_session, tmp_path):
+    """Test that Active with http2 keeps a connection per request in flight
+    to servers reached over plain HTTP, which speak HTTP/1.1."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    os.makedirs(tmp_path / "fake-bucket")
+    test_file = str(tmp_path / "fake-bucket" / "fake-object")
+    make_vanilla_ncdata(test_file)
+
+    with local_reductionist.LocalReductionist(str(tmp_path)) as server:
+        storage_options = {
+            "key": "cow",
+            "secret": "plaincow",
+            "client_kwargs": {"endpoint_url": S3_URL},
+        }
+        active = Active("s3://fake-bucket/fake-object", "data", "s3",
+                        storage_options=storage_options,
+                        active_storage_url=server.url, http2=True)
+        active._version = 1
+        active._method = "max"
+        assert active[::] == 999.0
+        assert server.stats()["requests"] == 160
+        mock_session.assert_not_called()
+
+        active.active_storage_url = ["https://cow.moo", server.url]
+        assert not active._use_http2()
+        active.active_storage_url = ["https://cow.moo", "https://bull.moo"]
+        assert active._use_http2()
+    sessions.clear_cache()
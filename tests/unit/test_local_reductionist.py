@@ -0,0 +1,322 @@
+import asyncio
+import os
+from unittest import mock
+
+import fsspec
+import numcodecs
+import numpy as np
+import pytest
+import requests
+
+import activestorage.active
+import activestorage.retry
+from activestorage import local_reductionist
+from activestorage import netcdf_to_zarr
+from activestorage import reductionist
+from activestorage import routing
+from activestorage.active import Active
+from activestorage.config import *
+from activestorage.dummy_data import make_vanilla_ncdata
+
+
+# Capture the real function before it is mocked.
+old_netcdf_to_zarr = netcdf_to_zarr.load_netcdf_zarr_generic
+
+
+@pytest.fixture(autouse=True)
+def healthy_servers():
+    """Start and finish each test with no server ejected."""
+    reductionist.clear_health()
+    reductionist.clear_batch_support()
+    yield
+    reductionist.clear_health()
+    reductionist.clear_batch_support()
+
+
+def write_chunk(root, data, compression=None, filters=None):
+    """Write the bytes of a chunk to an object, and return their size."""
+    chunk = data.tobytes()
+    for filter in filters or []:
+        chunk = filter.encode(chunk)
+    if compression is not None:
+        chunk = compression.encode(chunk)
+    os.makedirs(root / "bucket", exist_ok=True)
+    (root / "bucket" / "chunk").write_bytes(bytes(chunk))
+    return len(chunk)
+
+
+def reduce(session, server, size, data, operation, compression=None,
+           filters=None, missing=(None, None, None, None), selection=None):
+    selection = selection or tuple(slice(0, n, 1) for n in data.shape)
+    return reductionist.reduce_chunk(
+        session, server, "http://s3.example.com", "bucket", "chunk", 0, size,
+        compression, filters, missing, data.dtype, data.shape, "C",
+        selection, operation)
+
+
+def test_reduce(tmp_path):
+    """Test operations on compressed, filtered chunks, with framed and
+    plain responses."""
+    data = np.arange(24, dtype="float64").reshape(4, 6)
+    compression = numcodecs.Zlib()
+    filters = [numcodecs.Shuffle(elementsize=8)]
+    size = write_chunk(tmp_path, data, compression, filters)
+    for frames in (True, False):
+        with local_reductionist.LocalReductionist(
+                str(tmp_path), frames=frames) as server:
+            session = requests.Session()
+            session.headers.update(reductionist.ACCEPT_HEADERS)
+            result, count = reduce(session, server.url, size, data, "max",
+                                   compression, filters)
+            assert result == 23 and count == 24
+            result, count = reduce(session, server.url, size, data, "sum",
+                                   compression, filters,
+                                   missing=(None, None, None, 18.0),
+                                   selection=(slice(0, 4, 1), slice(0, 2, 1)))
+            assert result == 0 + 1 + 6 + 7 + 12 + 13 + 18
+            assert count == 7
+            result, count = reduce(session, server.url, size, data, None,
+                                   compression, filters,
+                                   selection=(slice(1, 3, 1), slice(0, 6, 2)))
+            np.testing.assert_array_equal(result, data[1:3, ::2])
+            assert server.stats() == {"requests": 3, "chunks": 3, "errors": 0,
+                                      "peak_in_flight": 1}
+
+
+def test_errors(tmp_path):
+    """Test that invalid requests and injected errors are answered with
+    Reductionist errors."""
+    data = np.arange(10, dtype="int32")
+    size = write_chunk(tmp_path, data)
+    with local_reductionist.LocalReductionist(str(tmp_path)) as server:
+        session = requests.Session()
+        assert reductionist.check_health(session, server.url) is None
+        with pytest.raises(reductionist.ReductionistError, match="HTTP 404"):
+            reductionist.reduce_chunk(
+                session, server.url, "http://s3.example.com", "bucket",
+                "missing", 0, size, None, None, (None, None, None, None),
+                data.dtype, data.shape, "C", (slice(0, 10, 1),), "max")
+        with pytest.raises(reductionist.ReductionistError, match="HTTP 400"):
+            reduce(session, server.url, size, data, "max",
+                   compression=numcodecs.BZ2())
+        server.error_rate = 1.0
+        with pytest.raises(reductionist.ReductionistError,
+                           match="HTTP 503") as exc_info:
+            reduce(session, server.url, size, data, "max")
+        assert reductionist.is_retryable(exc_info.value)
+        assert server.stats()["errors"] == 1
+
+
+def test_batches(tmp_path):
+    """Test that batches are served, and that clients fall back to single
+    requests when they are not."""
+    data = np.arange(10, dtype="int64")
+    size = write_chunk(tmp_path, data)
+    template = reductionist.RequestTemplate(
+        "http://s3.example.com", "bucket", "chunk", None, None,
+        (None, None, None, None), data.dtype, data.shape, "C")
+    requests_data = [template.encode(0, size, (slice(i, 10, 1),))
+                     for i in range(5)]
+    requests_data.append(reductionist.build_request_data(
+        "http://s3.example.com", "bucket", "missing", 0, size, None, None,
+        (None, None, None, None), data.dtype, data.shape, "C", None))
+    for batches in (True, False):
+        with local_reductionist.LocalReductionist(
+                str(tmp_path), batches=batches) as server:
+            results = reductionist.reduce_chunks(
+                requests.Session(), server.url, requests_data, "min")
+            assert [result for result, count in results[:5]] == list(range(5))
+            assert isinstance(results[5], reductionist.ReductionistError)
+            assert server.stats()["requests"] == (1 if batches else 6)
+
+
+@mock.patch.object(activestorage.retry, "backoff", lambda attempt: 0)
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+def test_active(mock_nz, tmp_path):
+    """Test Active on S3 against the stand-in, injecting errors, with and
+    without batches."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    os.makedirs(tmp_path / "fake-bucket")
+    test_file = str(tmp_path / "fake-bucket" / "fake-object")
+    make_vanilla_ncdata(test_file)
+    data = old_netcdf_to_zarr(test_file, "data", None, None)[0][:]
+
+    with local_reductionist.LocalReductionist(
+            str(tmp_path), latency=0.001, error_rate=0.1, seed=1) as server:
+        storage_options = {
+            "key": S3_ACCESS_KEY,
+            "secret": S3_SECRET_KEY,
+            "client_kwargs": {"endpoint_url": S3_URL},
+        }
+        active = Active("s3://fake-bucket/fake-object", "data", "s3",
+                        storage_options=storage_options,
+                        active_storage_url=server.url, retries=10)
+        active._version = 1
+        active._method = "max"
+        plan = active.plan(np.s_[::])
+        assert plan.backend == "reductionist"
+        assert plan.requests["reductionist"] == 160
+        assert plan.memory["inflight"] == 0
+        assert active[::] == 999.0
+        assert set(active.chunk_paths.values()) == {"reductionist"}
+        assert active.stats.chunks == 160
+        assert active.stats.bytes_read > 0
+        assert active.stats.seconds["io"] > 0
+        expected = np.max(data[0:2, 0:3, 4])
+        assert asyncio.run(active.aget(np.s_[0:2, 0:3, 4])) == expected
+
+        # selections are read straight into the output
+        active._method = None
+        np.testing.assert_array_equal(active[::], data)
+        np.testing.assert_array_equal(
+            asyncio.run(active.aget(np.s_[0:5, 3, :])), data[0:5, 3, :])
+        active._batch_size = 20
+        np.testing.assert_array_equal(active[0:2, 0:3, 4:6],
+                                      data[0:2, 0:3, 4:6])
+        stats = server.stats()
+        assert stats["errors"] > 0
+        assert stats["chunks"] == 160 + 1 + 160 + 20 + 2
+
+
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+def test_active_no_batches(mock_nz, tmp_path):
+    """Test that the chunks of batches for a server without the batch
+    endpoint are sent on their own, at once rather than one by one."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    os.makedirs(tmp_path / "fake-bucket")
+    test_file = str(tmp_path / "fake-bucket" / "fake-object")
+    make_vanilla_ncdata(test_file)
+    data = old_netcdf_to_zarr(test_file, "data", None, None)[0][:]
+
+    storage_options = {
+        "key": S3_ACCESS_KEY,
+        "secret": S3_SECRET_KEY,
+        "client_kwargs": {"endpoint_url": S3_URL},
+    }
+    for aio in (False, True):
+        reductionist.clear_batch_support()
+        with local_reductionist.LocalReductionist(
+                str(tmp_path), latency=0.01, batches=False) as server:
+            active = Active("s3://fake-bucket/fake-object", "data", "s3",
+                            storage_options=storage_options,
+                            active_storage_url=server.url, batch_size=160)
+            active._version = 1
+            active._method = "max"
+            if aio:
+                result = asyncio.run(active.aget(np.s_[::]))
+            else:
+                result = active[::]
+            assert result == np.max(data)
+            assert set(active.chunk_paths.values()) == {"reductionist"}
+            stats = server.stats()
+            assert stats["requests"] == 160
+            # not one by one
+            assert stats["peak_in_flight"] > 1
+
+            # selections too
+            active._method = None
+            np.testing.assert_array_equal(active[0:2, 0:3, 4:6],
+                                          data[0:2, 0:3, 4:6])
+            assert server.stats()["requests"] == 160 + 2
+
+
+@mock.patch.object(activestorage.active.sessions, "get_s3_filesystem")
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+def test_active_auto(mock_nz, mock_fs, tmp_path):
+    """Test that s3_mode="auto" routes chunks the way the cost model
+    expects to be faster, and learns from the timings observed."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_fs.return_value = fsspec.filesystem("file")
+    os.makedirs(tmp_path / "fake-bucket")
+    test_file = str(tmp_path / "fake-bucket" / "fake-object")
+    make_vanilla_ncdata(test_file)
+    data = old_netcdf_to_zarr(test_file, "data", None, None)[0][:]
+
+    with local_reductionist.LocalReductionist(str(tmp_path),
+                                              latency=0.02) as server:
+        storage_options = {
+            "key": S3_ACCESS_KEY,
+            "secret": S3_SECRET_KEY,
+            "client_kwargs": {"endpoint_url": S3_URL},
+        }
+        # A Reductionist request is expected to be much cheaper than a
+        # GET, at first.
+        model = routing.CostModel(reductionist_seconds=1e-5, get_seconds=10)
+        active = Active("s3://fake-bucket/fake-object", "data", "s3",
+                        storage_options=storage_options,
+                        active_storage_url=server.url, s3_mode="auto",
+                        cost_model=model)
+        active._version = 1
+        active._method = "max"
+        plan = active.plan(np.s_[::])
+        assert plan.backend == "auto"
+        assert plan.as_dict()["routes"] == {"reductionist": 160, "client": 0}
+        assert active[::] == 999.0
+        assert set(active.chunk_paths.values()) == {"reductionist"}
+        assert server.stats()["chunks"] == 160
+        # but requests took 20ms
+        assert model.as_dict()["reductionist_seconds"] > 0.01
+
+        model = routing.CostModel(reductionist_seconds=0.02)
+        active = Active("s3://fake-bucket/fake-object", "data", "s3",
+                        storage_options=storage_options,
+                        active_storage_url=server.url, s3_mode="auto",
+                        cost_model=model)
+        active._version = 1
+        active._method = None
+        # the chunks are small and next to each other: one GET reads them
+        np.testing.assert_array_equal(active[::], data)
+        assert set(active.chunk_paths.values()) == {"client"}
+        assert active._reader.stats()["requests"] == 1
+        assert server.stats()["chunks"] == 160
+        np.testing.assert_array_equal(
+            asyncio.run(active.aget(np.s_[0:5, 3, :])), data[0:5, 3, :])
+        assert set(active.chunk_paths.values()) == {"client"}
+
+
+@mock.patch.object(activestorage.retry, "backoff", lambda attempt: 0.1)
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+def test_cost_model_timings(mock_nz, tmp_path):
+    """Test that the Reductionist request times the cost model learns leave
+    out retries, their backoff and the wait for a slot."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    os.makedirs(tmp_path / "fake-bucket")
+    test_file = str(tmp_path / "fake-bucket" / "fake-object")
+    make_vanilla_ncdata(test_file)
+
+    with local_reductionist.LocalReductionist(
+            str(tmp_path), error_rate=0.3, seed=1) as server:
+        storage_options = {
+            "key": S3_ACCESS_KEY,
+            "secret": S3_SECRET_KEY,
+            "client_kwargs": {"endpoint_url": S3_URL},
+        }
+        model = routing.CostModel()
+        # many more chunks than slots
+        active = Active("s3://fake-bucket/fake-object", "data", "s3",
+                        storage_options=storage_options,
+                        active_storage_url=server.url, retries=10,
+                        cost_model=model)
+        active._version = 1
+        active._method = "max"
+        assert active[::] == 999.0
+        assert server.stats()["errors"] > 0
+        assert asyncio.run(active.aget(np.s_[::])) == 999.0
+        # each retry waits 0.1s, but the requests themselves are quick
+        assert model.as_dict()["reductionist_seconds"] < 0.05
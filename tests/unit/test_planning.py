@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from activestorage import planning
+
+
+def test_selected_elements():
+    """Test the count of the elements of a chunk in a selection."""
+    shape = (10, 4, 6)
+    assert planning.selected_elements((slice(0, 10), slice(0, 4),
+                                       slice(0, 6)), shape) == 240
+    assert planning.selected_elements((slice(0, 10, 3), 2, slice(1, 3)),
+                                      shape) == 8
+    assert planning.selected_elements(
+        (np.array([0, 5]), np.array([True, False, True, True]), slice(None)),
+        shape) == 36
+
+
+def test_plan():
+    """Test the bytes, requests and memory of a plan."""
+    chunks = [((0,), "a", 0, 100, 50),
+              ((1,), "a", 100, 100, 50),
+              ((2,), "a", 10 ** 9, 100, 50),
+              ((3,), "b", 0, 200, 25)]
+    plan = planning.Plan(chunks, (50,), np.float64, (175,),
+                         backend="s3", batch_size=2, max_inflight_bytes=1000)
+    assert plan.nchunks == 4
+    assert plan.compressed_bytes == 500
+    assert plan.decoded_bytes == 4 * 400
+    assert plan.selected_bytes == 175 * 8
+    # chunks 0 and 1 are read in one request
+    assert plan.requests == {"local": 4, "s3": 3, "reductionist": 3}
+    assert plan.coalescing == {"ranges": 4, "requests": 3, "saved": 1,
+                               "gap_bytes": 0}
+    assert plan.memory == {"chunk": 600, "inflight": 1000,
+                           "output": 175 * 8, "total": 1000 + 175 * 8}
+
+    # Reductionist reduces the chunks, and returns a value for each.
+    plan = planning.Plan(chunks, (50,), np.float64, (175,), method=np.max,
+                         backend="reductionist", max_inflight_bytes=None)
+    assert plan.requests["reductionist"] == 4
+    assert plan.memory == {"chunk": 0, "inflight": 0, "output": 32,
+                           "total": 32}
+    assert plan.as_dict()["chunks"] == 4
+
+    with pytest.raises(ValueError):
+        planning.Plan(chunks, (50,), np.float64, (175,), backend="gcs")
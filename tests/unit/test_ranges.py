@@ -0,0 +1,55 @@
+import threading
+
+import fsspec
+
+from activestorage import ranges
+
+
+def test_coalesce():
+    """Test that nearby ranges of the same file are merged."""
+    merged = ranges.coalesce([("a", 100, 10), ("a", 0, 10), ("a", 20, 10),
+                              ("b", 10, 10), ("a", 20, 10)],
+                             max_gap=10, max_size=1000)
+    assert merged == [
+        ("a", 0, 30, [(0, 10), (20, 10)]),
+        ("a", 100, 110, [(100, 10)]),
+        ("b", 10, 20, [(10, 10)]),
+    ]
+
+    # no merged range is larger than max_size
+    merged = ranges.coalesce([("a", i * 10, 10) for i in range(10)],
+                             max_gap=0, max_size=40)
+    assert [(start, end) for _, start, end, _ in merged] == [
+        (0, 40), (40, 80), (80, 100)]
+
+
+def test_range_reader(tmp_path):
+    """Test that RangeReader returns the ranges, fetching each block once."""
+    path = str(tmp_path / "data")
+    with open(path, "wb") as f:
+        f.write(bytes(range(256)) * 4)
+    wanted = [(path, i * 64, 32) for i in range(16)]
+    reader = ranges.RangeReader(fsspec.filesystem("file"), wanted,
+                                max_gap=32, max_size=256)
+
+    results = {}
+
+    def read(item):
+        results[item] = reader.read(*item)
+
+    threads = [threading.Thread(target=read, args=(item,)) for item in wanted]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for item in wanted:
+        _, offset, size = item
+        assert results[item] == (bytes(range(256)) * 4)[offset:offset + size]
+    assert reader.stats() == {"requests": 4, "bytes_fetched": 4 * 224}
+    # blocks are dropped once read
+    assert all(block.data is None for block in reader._blocks.values())
+
+    # ranges that were not given are read on their own
+    assert reader.read(path, 1, 2) == bytes([1, 2])
+    assert reader.stats()["requests"] == 5
@@ -1,11 +1,19 @@
+import aiohttp
+import asyncio
+import io
+import json
+import logging
 import os
 import numcodecs
 import numpy as np
 import pytest
 import requests
 import sys
+import time
+from aiohttp import web
 from unittest import mock
 
+from activestorage import local_reductionist
 from activestorage import reductionist
 
 
@@ -256,3 +264,527 @@ def test_reduce_chunk_not_found(mock_request):
 
 
     assert str(exc.value) == 'Reductionist error: HTTP 404: "Not found"'
+
+
+def test_areduce_chunk():
+    """Unit test for areduce_chunk against a local HTTP server."""
+    result = np.arange(6, dtype="int32").reshape(2, 3)
+    requests_received = []
+
+    async def handler(request):
+        requests_received.append((request.path, await request.json()))
+        if request.match_info["operation"] == "max":
+            return web.Response(status=400, body=b'"Bad request"')
+        return web.Response(body=result.tobytes(),
+                            headers={"x-activestorage-dtype": "int32",
+                                     "x-activestorage-shape": "[2, 3]",
+                                     "x-activestorage-count": "6"})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/v1/{operation}/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        server = f"http://127.0.0.1:{port}"
+        args = ("https://s3.example.com", "fake-bucket", "fake-object", 2,
+                128, None, None, (None, None, None, None), np.dtype("int32"),
+                (32, ), "C",
+                [slice(0, 2, 1)])
+        try:
+            async with reductionist.get_async_session("fake-access",
+                                                      "fake-secret",
+                                                      None) as session:
+                tmp, count = await reductionist.areduce_chunk(
+                    session, server, *args, operation=None)
+                with pytest.raises(reductionist.ReductionistError) as exc:
+                    await reductionist.areduce_chunk(session, server, *args,
+                                                     operation="max")
+        finally:
+            await runner.cleanup()
+        return tmp, count, exc
+
+    tmp, count, exc = asyncio.run(run())
+    np.testing.assert_array_equal(tmp, result)
+    assert count == 6
+    assert str(exc.value) == 'Reductionist error: HTTP 400: "Bad request"'
+    path, data = requests_received[0]
+    assert path == "/v1/select/"
+    assert data["offset"] == 2 and data["size"] == 128
+    assert data["selection"] == [[0, 2, 1]]
+
+
+def test_unsupported():
+    """Test detection of codecs and data types Reductionist can't decode."""
+    assert reductionist.unsupported(numcodecs.Zlib(), [numcodecs.Shuffle()],
+                                     np.dtype("float32")) is None
+    assert reductionist.unsupported(None, None, np.dtype(">i8")) is None
+    assert "compression" in reductionist.unsupported(numcodecs.Blosc(), None,
+                                                     np.dtype("float32"))
+    assert "filter" in reductionist.unsupported(
+        None, [numcodecs.Delta(dtype="i4")], np.dtype("int32"))
+    assert "data type" in reductionist.unsupported(None, None,
+                                                   np.dtype("int16"))
+
+
+def test_check_health():
+    """Test the server health check, and that its result is reused."""
+    reductionist.clear_health()
+    session = mock.Mock()
+    session.get.return_value = make_response(b"{}", 200)
+    assert reductionist.check_health(session, "https://a.example.com") is None
+    assert reductionist.check_health(session, "https://a.example.com") is None
+    session.get.assert_called_once_with(
+        "https://a.example.com/.well-known/reductionist-schema",
+        timeout=reductionist.HEALTH_TIMEOUT)
+
+    session.get.return_value = make_response(b"", 503)
+    assert "HTTP 503" in reductionist.check_health(session,
+                                                   "https://b.example.com")
+    session.get.side_effect = requests.exceptions.ConnectionError("refused")
+    assert "refused" in reductionist.check_health(session,
+                                                  "https://c.example.com")
+
+    reductionist.mark_health("https://a.example.com", "down")
+    assert reductionist.check_health(session, "https://a.example.com") == "down"
+    reductionist.clear_health()
+
+
+@mock.patch.object(reductionist, 'request')
+def test_reduce_chunks(mock_request):
+    """Unit test for reduce_chunks with a server supporting batches."""
+    reductionist.clear_batch_support()
+    content = reductionist.encode_batch([
+        (np.arange(4, dtype="int32").reshape(2, 2), 4),
+        (404, "Object not found"),
+        (np.float64(7.5), 3),
+    ])
+    mock_request.return_value = make_response(content, 200)
+
+    requests_data = [{"offset": i, "size": 8} for i in range(3)]
+    results = reductionist.reduce_chunks("session", "https://r.example.com",
+                                         requests_data, "max")
+
+    mock_request.assert_called_once_with(
+        "session", "https://r.example.com/v1/max/batch/",
+        {"chunks": requests_data})
+    np.testing.assert_array_equal(results[0][0], [[0, 1], [2, 3]])
+    assert results[0][1] == 4
+    assert isinstance(results[1], reductionist.ReductionistError)
+    assert results[1].status_code == 404
+    assert results[2] == (7.5, 3)
+
+
+@mock.patch.object(reductionist, 'request')
+def test_reduce_chunks_no_batch(mock_request):
+    """Unit test for reduce_chunks with a server without batches."""
+    reductionist.clear_batch_support()
+    ok = make_response(np.int64(5).tobytes(), 200, "int64", "[]", "1")
+    not_found = make_response(b'"Not found"', 404)
+    mock_request.side_effect = [not_found, ok, not_found]
+
+    requests_data = [{"offset": i, "size": 8} for i in range(2)]
+    results = reductionist.reduce_chunks("session", "https://r.example.com",
+                                         requests_data, None)
+    assert results[0] == (5, 1)
+    assert results[1].status_code == 404
+    assert [call.args[1] for call in mock_request.call_args_list] == [
+        "https://r.example.com/v1/select/batch/",
+        "https://r.example.com/v1/select/",
+        "https://r.example.com/v1/select/",
+    ]
+
+    # the server is known not to support batches
+    mock_request.reset_mock()
+    mock_request.side_effect = [ok]
+    assert reductionist.reduce_chunks("session", "https://r.example.com",
+                                      requests_data[:1], None) == [(5, 1)]
+    assert mock_request.call_args.args[1] == "https://r.example.com/v1/select/"
+
+    # other errors are raised
+    mock_request.side_effect = [make_response(b'"Bad"', 400)]
+    with pytest.raises(reductionist.ReductionistError):
+        reductionist.reduce_chunks("session", "https://s.example.com",
+                                   requests_data, None)
+    reductionist.clear_batch_support()
+
+
+def test_areduce_chunks():
+    """Unit test for areduce_chunks against local HTTP servers with and
+    without the batch endpoint."""
+    reductionist.clear_batch_support()
+
+    async def batch_handler(request):
+        chunks = (await request.json())["chunks"]
+        return web.Response(body=reductionist.encode_batch(
+            [(np.int32(chunk["offset"]), 1) for chunk in chunks]))
+
+    async def handler(request):
+        chunk = await request.json()
+        if chunk["offset"] == 1:
+            return web.Response(status=500, body=b'"Oops"')
+        return web.Response(body=np.int32(chunk["offset"]).tobytes(),
+                            headers={"x-activestorage-dtype": "int32",
+                                     "x-activestorage-shape": "[]",
+                                     "x-activestorage-count": "1"})
+
+    async def serve(batches):
+        app = web.Application()
+        if batches:
+            app.router.add_post("/v1/{operation}/batch/", batch_handler)
+        app.router.add_post("/v1/{operation}/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://127.0.0.1:{port}"
+
+    async def run():
+        results = []
+        requests_data = [{"offset": i} for i in range(3)]
+        for batches in [True, False]:
+            runner, server = await serve(batches)
+            try:
+                async with reductionist.get_async_session(
+                        "fake-access", "fake-secret", None) as session:
+                    results.append(await reductionist.areduce_chunks(
+                        session, server, requests_data, "max"))
+            finally:
+                await runner.cleanup()
+        return results
+
+    with_batches, without_batches = asyncio.run(run())
+    assert with_batches == [(0, 1), (1, 1), (2, 1)]
+    assert without_batches[0] == (0, 1) and without_batches[2] == (2, 1)
+    assert without_batches[1].status_code == 500
+    reductionist.clear_batch_support()
+
+
+TEMPLATE_ARGS = ("https://s3.example.com", "fake-bucket", "fake-object",
+                 numcodecs.Zlib(), [numcodecs.Shuffle(4)],
+                 (np.float32(1e20), None, None, None), np.dtype("float32"),
+                 (3, 3, 1), "C")
+SELECTION = (slice(0, 2, 1), 1, slice(0, 1, 1))
+
+
+def test_request_template():
+    """Test that a RequestTemplate encodes the same data as
+    build_request_data."""
+    template = reductionist.RequestTemplate(*TEMPLATE_ARGS)
+    source, bucket, object, compression, filters, missing, dtype, shape, \
+        order = TEMPLATE_ARGS
+    for offset, size, selection in [(10, 20, SELECTION), (0, 36, None),
+                                    (None, None, None)]:
+        expected = reductionist.build_request_data(
+            source, bucket, object, offset, size, compression, filters,
+            missing, dtype, shape, order, selection)
+        assert json.loads(template.encode(offset, size, selection)) == \
+            json.loads(json.dumps(expected))
+
+
+@mock.patch.object(reductionist, 'request')
+def test_reduce_chunk_template(mock_request):
+    """Unit test for reduce_chunk with a request template."""
+    result = np.int32(134351386)
+    mock_request.return_value = make_response(result.tobytes(), 200, "int32",
+                                              "[]", "2")
+    template = reductionist.RequestTemplate(*TEMPLATE_ARGS)
+    tmp, count = reductionist.reduce_chunk("session", "https://r.example.com",
+                                           *TEMPLATE_ARGS[:3], 10, 20,
+                                           *TEMPLATE_ARGS[3:], SELECTION,
+                                           "max", template=template)
+    assert tmp == result and count == 2
+    mock_request.assert_called_once_with(
+        "session", "https://r.example.com/v1/max/",
+        template.encode(10, 20, SELECTION))
+
+
+def test_request_template_benchmark():
+    """Benchmark the client CPU time spent encoding the request data of a
+    chunk, with and without a template."""
+    source, bucket, object, compression, filters, missing, dtype, shape, \
+        order = TEMPLATE_ARGS
+    n = 2000
+
+    began = time.process_time()
+    for offset in range(n):
+        json.dumps(reductionist.build_request_data(
+            source, bucket, object, offset, 36, compression, filters,
+            missing, dtype, shape, order, SELECTION)).encode()
+    without_template = (time.process_time() - began) / n
+
+    began = time.process_time()
+    template = reductionist.RequestTemplate(*TEMPLATE_ARGS)
+    for offset in range(n):
+        template.encode(offset, 36, SELECTION)
+    with_template = (time.process_time() - began) / n
+
+    print(f"Request data encoding: {without_template * 1e6:.1f}us without "
+          f"template, {with_template * 1e6:.1f}us with template")
+
+
+@pytest.mark.parametrize(
+    "result, count",
+    [
+        (np.arange(6, dtype=">f4").reshape(2, 3), 6),
+        (np.float64(3.5), [1, 2]),
+        (np.zeros((0, 3), dtype="int64"), 0),
+    ]
+)
+def test_frame(result, count):
+    """Test that framed binary responses decode to what was encoded."""
+    tmp, tmp_count = reductionist.decode_frame(
+        reductionist.encode_frame(result, count))
+    np.testing.assert_array_equal(tmp, result)
+    assert tmp.dtype == np.asarray(result).dtype
+    assert tmp_count == count
+
+    with pytest.raises(reductionist.ReductionistError):
+        reductionist.decode_frame(b"{}")
+
+
+@mock.patch.object(reductionist, 'request')
+def test_reduce_chunk_framed(mock_request):
+    """Unit test for reduce_chunk with a framed binary response."""
+    result = np.arange(4, dtype="uint32").reshape(2, 2)
+    response = make_response(reductionist.encode_frame(result, 4), 200)
+    response.headers["Content-Type"] = reductionist.FRAME_MEDIA_TYPE
+    mock_request.return_value = response
+
+    session = reductionist.get_session("fake-access", "fake-secret", None)
+    assert reductionist.FRAME_MEDIA_TYPE in session.headers["Accept"]
+    tmp, count = reductionist.reduce_chunk(
+        session, "https://r.example.com", *TEMPLATE_ARGS[:3], 10, 20,
+        *TEMPLATE_ARGS[3:], SELECTION, None)
+    np.testing.assert_array_equal(tmp, result)
+    assert count == 4
+
+
+def test_areduce_chunk_framed():
+    """Test that framed binary responses are negotiated with a local HTTP
+    server."""
+    result = np.arange(6, dtype="int64").reshape(3, 2)
+
+    async def handler(request):
+        if reductionist.FRAME_MEDIA_TYPE in request.headers.get("Accept", ""):
+            return web.Response(body=reductionist.encode_frame(result, 6),
+                                content_type=reductionist.FRAME_MEDIA_TYPE)
+        return web.Response(body=result.tobytes(),
+                            headers={"x-activestorage-dtype": "int64",
+                                     "x-activestorage-shape": "[3, 2]",
+                                     "x-activestorage-count": "6"})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/v1/{operation}/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        server = f"http://127.0.0.1:{port}"
+        args = (*TEMPLATE_ARGS[:3], 10, 20, *TEMPLATE_ARGS[3:], SELECTION)
+        try:
+            async with reductionist.get_async_session(
+                    "fake-access", "fake-secret", None) as session:
+                framed = await reductionist.areduce_chunk(
+                    session, server, *args, operation=None)
+            async with aiohttp.ClientSession() as session:
+                plain = await reductionist.areduce_chunk(
+                    session, server, *args, operation=None)
+        finally:
+            await runner.cleanup()
+        return framed, plain
+
+    for tmp, count in asyncio.run(run()):
+        np.testing.assert_array_equal(tmp, result)
+        assert count == 6
+
+
+@pytest.mark.parametrize("compression", ["zstd", "zlib"])
+def test_frame_compressed(compression):
+    """Test that compressed framed responses decode to what was encoded."""
+    result = np.linspace(0, 1, 6000, dtype=">f8").reshape(60, 100)
+    frame = reductionist.encode_frame(result, 6000, compression)
+    assert frame.startswith(reductionist.COMPRESSED_FRAME_MAGIC)
+    assert len(frame) < result.nbytes
+    tmp, count = reductionist.decode_frame(frame)
+    np.testing.assert_array_equal(tmp, result)
+    assert tmp.dtype == result.dtype
+    assert count == 6000
+
+
+def test_compression_headers():
+    """Test that only large selects ask for compressed responses."""
+    dtype = np.dtype("float64")
+    shape = (200, 1000)
+    big = (slice(0, 200, 1), slice(0, 1000, 1))
+    small = (slice(0, 2, 1), 5)
+    assert reductionist.selection_nbytes(dtype, shape, small) == 16
+    assert reductionist.selection_nbytes(dtype, shape, None) == 1600000
+    headers = reductionist.compression_headers(None, dtype, shape, big)
+    assert headers == {reductionist.COMPRESSION_HEADER: "zstd, zlib"}
+    assert reductionist.compression_headers("max", dtype, shape, big) is None
+    assert reductionist.compression_headers(None, dtype, shape, small) is None
+    assert reductionist.compression_headers(None, dtype, None, None) is None
+
+
+@mock.patch.object(reductionist, 'request')
+def test_reduce_chunk_select_compressed(mock_request):
+    """Unit test for reduce_chunk selecting a large subarray."""
+    result = np.linspace(0, 1, 200000).reshape(200, 1000)
+    response = make_response(reductionist.encode_frame(result, 1, "zstd"),
+                             200)
+    response.headers["Content-Type"] = reductionist.FRAME_MEDIA_TYPE
+    mock_request.return_value = response
+
+    selection = (slice(0, 200, 1), slice(0, 1000, 1))
+    tmp, count = reductionist.reduce_chunk(
+        "session", "https://r.example.com", "https://s3.example.com",
+        "fake-bucket", "fake-object", 0, 1600000, None, None,
+        (None, None, None, None), np.dtype("float64"), (200, 1000), "C",
+        selection, None)
+    np.testing.assert_array_equal(tmp, result)
+    assert mock_request.call_args.kwargs["headers"] == {
+        reductionist.COMPRESSION_HEADER: "zstd, zlib"}
+
+
+def test_compressed_select_benchmark():
+    """Benchmark select responses over slow links, with and without
+    compression. The transfer time is simulated from the response size."""
+    # a smooth field, as selected from most model output
+    x = np.linspace(0, 4 * np.pi, 1000, dtype="float32")
+    result = (np.sin(x)[:, None] * np.cos(x)[None, :]).round(3)
+    for compression in [None, "zstd", "zlib"]:
+        frame = reductionist.encode_frame(result, 1, compression)
+        began = time.perf_counter()
+        tmp, _ = reductionist.decode_frame(frame)
+        decode_seconds = time.perf_counter() - began
+        np.testing.assert_array_equal(tmp, result)
+        for mbps in [10, 100]:
+            seconds = len(frame) / (mbps * 1e6 / 8) + decode_seconds
+            print(f"{compression}: {len(frame)} bytes, {mbps} Mbit/s link: "
+                  f"{result.nbytes / seconds / 1e6:.1f} MB/s")
+
+
+@pytest.fixture
+def select_server(tmp_path):
+    """A LocalReductionist serving an object of float64 data."""
+    data = np.arange(20000, dtype="float64").reshape(200, 100)
+    os.makedirs(tmp_path / "bucket")
+    (tmp_path / "bucket" / "object").write_bytes(data.tobytes())
+    with local_reductionist.LocalReductionist(str(tmp_path)) as server:
+        yield server, data
+
+
+def select(session, server, data, selection, out=None):
+    return reductionist.reduce_chunk(
+        session, server.url, "http://s3.example.com", "bucket", "object", 0,
+        data.nbytes, None, None, (None, None, None, None), data.dtype,
+        data.shape, "C", selection, None, out=out)
+
+
+@pytest.mark.parametrize("frames", [True, False])
+@pytest.mark.parametrize("threshold", [reductionist.COMPRESSION_THRESHOLD, 0])
+def test_reduce_chunk_into(select_server, frames, threshold):
+    """Test that select responses are read straight into the output when
+    it fits, else into a buffer reused by the thread."""
+    server, data = select_server
+    server.frames = frames
+    session = reductionist.get_session("fake-access", "fake-secret", None)
+    selection = (slice(10, 20, 1), slice(0, 100, 1))
+    with mock.patch.object(reductionist, "COMPRESSION_THRESHOLD", threshold):
+        out = np.zeros((10, 100))
+        tmp, count = select(session, server, data, selection, out=out)
+        assert tmp is out
+        np.testing.assert_array_equal(out, data[10:20])
+        assert count == 1000
+
+        # not contiguous
+        out = np.zeros((20, 200))
+        tmp, _ = select(session, server, data, selection, out=out[:10, :100])
+        np.testing.assert_array_equal(tmp, data[10:20])
+        assert not out.any()
+        if not (frames and threshold == 0):
+            assert np.shares_memory(tmp, reductionist._buffers.buffer)
+
+        # not the same dtype
+        out = np.zeros((10, 100), dtype="float32")
+        tmp, _ = select(session, server, data, selection, out=out)
+        assert tmp is not out
+        np.testing.assert_array_equal(tmp, data[10:20])
+
+    # connections are reused after streamed responses
+    pools = session.get_adapter(server.url).poolmanager.pools
+    assert [pools[key].num_connections for key in pools.keys()] == [1]
+
+
+def test_areduce_chunk_into(select_server):
+    """Test that select responses are read straight into the output when it
+    fits, asynchronously."""
+    server, data = select_server
+    selection = (slice(10, 20, 1), slice(0, 100, 1))
+
+    async def run(out):
+        async with reductionist.get_async_session(
+                "fake-access", "fake-secret", None) as session:
+            return await reductionist.areduce_chunk(
+                session, server.url, "http://s3.example.com", "bucket",
+                "object", 0, data.nbytes, None, None,
+                (None, None, None, None), data.dtype, data.shape, "C",
+                selection, None, out=out)
+
+    for frames in (True, False):
+        server.frames = frames
+        out = np.zeros((10, 100))
+        tmp, count = asyncio.run(run(out))
+        assert tmp is out
+        np.testing.assert_array_equal(out, data[10:20])
+        assert count == 1000
+        out = np.zeros((20, 200))
+        tmp, _ = asyncio.run(run(out[:10, :100]))
+        np.testing.assert_array_equal(tmp, data[10:20])
+        assert not out.any()
+
+
+@mock.patch.object(reductionist, 'request')
+def test_logging_benchmark(mock_request):
+    """Benchmark the client CPU time of a chunk request with its request
+    data logged, as it used to be printed, and not."""
+    result = np.float32(3.5)
+    mock_request.return_value = make_response(result.tobytes(), 200,
+                                              "float32", "[]", "2")
+    source, bucket, object, compression, filters, missing, dtype, shape, \
+        order = TEMPLATE_ARGS
+    n = 2000
+    logger = logging.getLogger("activestorage.reductionist")
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+
+    def run():
+        began = time.process_time()
+        for offset in range(n):
+            reductionist.reduce_chunk(
+                "session", "https://r.example.com", source, bucket, object,
+                offset, 36, compression, filters, missing, dtype, shape,
+                order, SELECTION, "max")
+        return (time.process_time() - began) / n
+
+    level = logger.level
+    logger.addHandler(handler)
+    try:
+        logger.setLevel(logging.DEBUG)
+        logged = run()
+        assert stream.getvalue().count("request data") == n
+        logger.setLevel(logging.WARNING)
+        quiet = run()
+        assert stream.getvalue().count("request data") == n
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+    print(f"Chunk request: {logged * 1e6:.1f}us with debug logging, "
+          f"{quiet * 1e6:.1f}us without")
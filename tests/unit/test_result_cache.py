@@ -0,0 +1,96 @@
+import os
+import time
+
+import numpy as np
+
+from activestorage import result_cache
+
+
+REQUEST = {"source": "https://s3.example.com", "bucket": "bucket",
+           "object": "file.nc", "dtype": "int32", "offset": 0, "size": 40,
+           "selection": [[0, 10, 1]]}
+
+
+def test_cache_key():
+    """Test that keys do not depend on the order or encoding of the request
+    data, but do on its content, the operation and the ETag."""
+    key = result_cache.cache_key("max", REQUEST, "etag1")
+    reordered = dict(reversed(list(REQUEST.items())))
+    assert result_cache.cache_key("max", reordered, "etag1") == key
+    encoded = (b'{"offset": 0, "size": 40, "source": "https://s3.example.com",'
+               b' "bucket": "bucket", "object": "file.nc", "dtype": "int32",'
+               b' "selection": [[0, 10, 1]]}')
+    assert result_cache.cache_key("max", encoded, "etag1") == key
+    numpy = dict(REQUEST, size=np.int64(40))
+    assert result_cache.cache_key("max", numpy, "etag1") == key
+
+    assert result_cache.cache_key("min", REQUEST, "etag1") != key
+    assert result_cache.cache_key("max", REQUEST, "etag2") != key
+    assert result_cache.cache_key("max", dict(REQUEST, offset=40),
+                                  "etag1") != key
+
+
+def test_get_put():
+    """Test that results are cached, and hits and misses counted."""
+    cache = result_cache.ResultCache()
+    assert cache.get("a") is None
+    cache.put("a", np.int32(7), 10)
+    assert not cache.contains("b")
+    assert cache.contains("a")
+    result, count = cache.get("a")
+    assert result == 7 and result.dtype == np.int32
+    assert count == 10
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1,
+                             "size": 4}
+
+
+def test_bounded_size():
+    """Test that the least recently used entries are dropped to keep the
+    memory used under the bound."""
+    cache = result_cache.ResultCache(max_size=3 * 800)
+    for key in "abc":
+        cache.put(key, np.zeros(100), 100)
+    cache.get("a")
+    cache.put("d", np.zeros(100), 100)
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.stats()["size"] == 3 * 800
+    # results larger than the bound are not cached
+    cache.put("e", np.zeros(1000), 1000)
+    assert cache.get("e") is None
+    assert cache.stats()["entries"] == 3
+
+
+def test_ttl():
+    """Test that expired entries are not used."""
+    cache = result_cache.ResultCache(ttl=0.05)
+    cache.put("a", np.float64(1.5), 1)
+    assert cache.get("a") is not None
+    time.sleep(0.1)
+    assert not cache.contains("a")
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_directory(tmp_path):
+    """Test that entries kept in a directory are used by another cache, and
+    expire there too."""
+    directory = str(tmp_path / "cache")
+    cache = result_cache.ResultCache(directory=directory)
+    cache.put("a", np.arange(6, dtype=np.int16).reshape(2, 3), 6)
+    assert os.listdir(directory) == ["a.frame"]
+
+    other = result_cache.ResultCache(directory=directory)
+    assert other.contains("a")
+    result, count = other.get("a")
+    np.testing.assert_array_equal(result, np.arange(6).reshape(2, 3))
+    assert result.dtype == np.int16
+    assert count == 6
+    assert other.stats()["entries"] == 1
+
+    expired = result_cache.ResultCache(ttl=0, directory=directory)
+    assert expired.get("a") is None
+    assert os.listdir(directory) == []
+
+    cache.clear()
+    assert cache.get("a") is None
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from activestorage import retry
+
+
+class Flaky:
+    """Fails with the given errors, then succeeds."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "moo"
+
+
+def is_retryable(exc):
+    return isinstance(exc, ConnectionError)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(retry, "backoff", lambda attempt: 0)
+
+
+def test_backoff():
+    """Test that delays are jittered below an exponentially growing bound."""
+    for attempt in range(10):
+        delays = [retry.backoff(attempt) for _ in range(100)]
+        bound = min(retry.BACKOFF_BASE * 2 ** attempt, retry.BACKOFF_CAP)
+        assert 0 <= min(delays) < max(delays) <= bound
+
+
+def test_call(no_backoff):
+    """Test retrying a function until it succeeds."""
+    func = Flaky(ConnectionError(), ConnectionError())
+    assert retry.call(func, is_retryable) == "moo"
+    assert func.calls == 3
+
+
+def test_call_gives_up(no_backoff):
+    """Test that retries stop after the last one, or on other errors."""
+    func = Flaky(*[ConnectionError()] * 3)
+    with pytest.raises(ConnectionError):
+        retry.call(func, is_retryable, retries=2)
+    assert func.calls == 3
+
+    func = Flaky(ValueError())
+    with pytest.raises(ValueError):
+        retry.call(func, is_retryable)
+    assert func.calls == 1
+
+
+def test_acall(no_backoff):
+    """Test retrying a coroutine function until it succeeds."""
+    func = Flaky(ConnectionError())
+
+    async def afunc():
+        return func()
+
+    assert asyncio.run(retry.acall(afunc, is_retryable)) == "moo"
+    assert func.calls == 2
@@ -0,0 +1,50 @@
+import numpy as np
+
+from activestorage import planning
+from activestorage import routing
+
+
+def test_linear_fit():
+    """Test that a fit starts from its default and follows observations."""
+    fit = routing._LinearFit(0.01, 1e-8)
+    assert fit(0) == 0.01
+    for _ in range(200):
+        for nbytes in (0, 10 ** 6, 2 * 10 ** 6):
+            fit.observe(nbytes, 0.1 + 1e-7 * nbytes)
+    np.testing.assert_allclose(fit.intercept, 0.1, rtol=0.05)
+    np.testing.assert_allclose(fit.slope, 1e-7, rtol=0.05)
+
+    # observations all of the same size keep the slope
+    fit = routing._LinearFit(0.01, 1e-8)
+    for _ in range(500):
+        fit.observe(1000, 0.5)
+    np.testing.assert_allclose(fit.slope, 1e-8)
+    np.testing.assert_allclose(fit(1000), 0.5, rtol=1e-3)
+
+
+def test_route():
+    """Test that chunks are routed the way expected to be faster."""
+    # 10 small chunks next to each other, and a large one far away
+    chunks = [((i,), "a", 100 * i, 100, 25) for i in range(10)]
+    chunks.append(((10,), "a", 10 ** 9, 10 ** 8, 25))
+    plan = planning.Plan(chunks, (1000,), np.float64, (275,), method=np.max,
+                         backend="auto")
+    model = routing.CostModel(reductionist_seconds=0.01,
+                              get_seconds=0.05)
+    routes = model.route(plan)
+    assert plan.routes is routes
+    # the small chunks share a GET, but the large one is cheaper to reduce
+    # where the data is than to fetch
+    assert routes == {**{(i,): False for i in range(10)}, (10,): True}
+    assert plan.as_dict()["routes"] == {"reductionist": 1, "client": 10}
+    assert plan.memory["chunk"] == 100 + 8000
+
+    # batches share the overhead of Reductionist requests too
+    routes = model.route(plan, batch_size=20)
+    assert all(routes.values())
+
+    # a slow Reductionist sends everything client side
+    for _ in range(100):
+        model.observe_reductionist(10.0, 1000)
+    assert not any(model.route(plan, batch_size=20).values())
+    assert model.as_dict()["reductionist_seconds"] > 1
@@ -0,0 +1,72 @@
+import pytest
+import requests
+
+from activestorage import reductionist
+from activestorage import servers
+
+
+@pytest.fixture(autouse=True)
+def healthy_servers():
+    """Start and finish each test with no server ejected."""
+    reductionist.clear_health()
+    yield
+    reductionist.clear_health()
+
+
+URLS = [f"https://reductionist{i}.example.com" for i in range(4)]
+OBJECTS = [("bucket", f"file{i}.nc") for i in range(1000)]
+
+
+def test_consistent_hashing():
+    """Test that objects are spread over the servers, and that few move when
+    a server is added."""
+    pool = servers.ServerPool(URLS)
+    assignment = {key: pool.server_for(*key) for key in OBJECTS}
+    counts = [list(assignment.values()).count(url) for url in URLS]
+    assert all(150 < count < 350 for count in counts)
+    # the same object always goes to the same server
+    assert all(pool.server_for(*key) == assignment[key] for key in OBJECTS)
+
+    bigger = servers.ServerPool(URLS + ["https://reductionist4.example.com"])
+    moved = [key for key in OBJECTS if bigger.server_for(*key) != assignment[key]]
+    assert 100 < len(moved) < 300
+    assert all(bigger.server_for(*key) == "https://reductionist4.example.com"
+               for key in moved)
+
+    order = pool.servers_for("bucket", "file0.nc")
+    assert sorted(order) == URLS
+
+    with pytest.raises(ValueError):
+        servers.ServerPool([])
+
+
+def test_ejection():
+    """Test that unreachable and failing servers are ejected."""
+    pool = servers.ServerPool(URLS, max_failures=3)
+    first, second = pool.servers_for("bucket", "file0.nc")[:2]
+
+    pool.failed(first, requests.exceptions.ConnectionError("refused"))
+    assert not pool.is_healthy(first)
+    assert pool.server_for("bucket", "file0.nc") == second
+    assert pool.servers_for("bucket", "file0.nc")[-1] == first
+    assert len(pool.healthy_servers()) == 3
+
+    error = reductionist.ReductionistError(503, "Busy")
+    pool.failed(second, error)
+    pool.failed(second, error)
+    pool.succeeded(second)
+    pool.failed(second, error)
+    pool.failed(second, error)
+    assert pool.is_healthy(second)
+    pool.failed(second, error)
+    assert not pool.is_healthy(second)
+
+    # bad requests are not the server's fault
+    third = pool.server_for("bucket", "file0.nc")
+    for _ in range(5):
+        pool.failed(third, reductionist.ReductionistError(400, "Bad"))
+    assert pool.is_healthy(third)
+
+    # ejection lasts until the health record expires
+    reductionist.clear_health()
+    assert pool.server_for("bucket", "file0.nc") == first
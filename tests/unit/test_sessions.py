@@ -0,0 +1,58 @@
+import pytest
+
+from activestorage import sessions
+from activestorage.config import *
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Start and finish each test with an empty cache."""
+    sessions.clear_cache()
+    yield
+    sessions.clear_cache()
+
+
+def test_get_s3_filesystem():
+    """Test that filesystems are shared per set of storage options."""
+    storage_options = {
+        'key': "cow",
+        'secret': "secretcow",
+        'client_kwargs': {'endpoint_url': "https://cow.moo"},
+    }
+    fs = sessions.get_s3_filesystem(storage_options)
+    assert sessions.get_s3_filesystem(dict(storage_options)) is fs
+    assert fs.key == "cow"
+
+    # different secret, different filesystem
+    other = dict(storage_options, secret="othercow")
+    assert sessions.get_s3_filesystem(other) is not fs
+
+    # anonymous access
+    anon = {'anon': True, 'client_kwargs': {'endpoint_url': "https://cow.moo"}}
+    assert sessions.get_s3_filesystem(anon).anon
+    assert sessions.cache_info() == {'filesystems': 3, 'sessions': 0}
+
+    sessions.evict_filesystem(storage_options)
+    assert sessions.get_s3_filesystem(storage_options) is not fs
+
+
+def test_get_s3_filesystem_default():
+    """Test the pre-configured S3 credentials."""
+    fs = sessions.get_s3_filesystem()
+    assert fs.key == S3_ACCESS_KEY
+    assert sessions.get_s3_filesystem(sessions.default_storage_options()) is fs
+
+
+def test_get_session():
+    """Test that Reductionist sessions are shared per set of credentials."""
+    session = sessions.get_session("cow", "secretcow", None)
+    assert session.auth == ("cow", "secretcow")
+    assert sessions.get_session("cow", "secretcow", None) is session
+    assert sessions.get_session("cow", "othercow", None) is not session
+    assert sessions.cache_info() == {'filesystems': 0, 'sessions': 2}
+
+    sessions.evict_session("cow", "secretcow", None)
+    assert sessions.get_session("cow", "secretcow", None) is not session
+
+    sessions.clear_cache()
+    assert sessions.cache_info() == {'filesystems': 0, 'sessions': 0}
@@ -0,0 +1,54 @@
+import threading
+import time
+
+from activestorage import stats
+
+
+def test_call_stats():
+    """Test the counters, stage times and latency histogram of CallStats."""
+    call_stats = stats.CallStats()
+    assert call_stats.latency_quantile(0.5) is None
+    call_stats.add_chunk(100, 400, 8, 0.00005)
+    call_stats.add_chunk(100, 400, 8, 0.00015)
+    call_stats.add_chunk(0, 0, 8, 1000)
+    call_stats.add_time("io", 0.5)
+    with call_stats.timer("reduce"):
+        time.sleep(0.001)
+
+    assert call_stats.chunks == 3
+    assert call_stats.bytes_read == 200
+    assert call_stats.bytes_decoded == 800
+    assert call_stats.bytes_returned == 24
+    assert call_stats.seconds["io"] == 0.5
+    assert call_stats.seconds["reduce"] >= 0.001
+    assert call_stats.latency_histogram() == [
+        (0.0001, 1), (0.0002, 1), (float("inf"), 1)]
+    assert call_stats.latency_quantile(0.3) == 0.0001
+    assert call_stats.latency_quantile(0.5) == 0.0002
+    assert call_stats.latency_quantile(1) == float("inf")
+
+    as_dict = call_stats.as_dict()
+    assert as_dict["chunks"] == 3
+    assert as_dict["seconds"]["io"] == 0.5
+    assert "CallStats" in repr(call_stats)
+
+
+def test_call_stats_threads():
+    """Test that CallStats counts the chunks of many threads, and report
+    the cost of recording a chunk."""
+    call_stats = stats.CallStats()
+
+    def add():
+        for _ in range(10000):
+            call_stats.add_chunk(1, 2, 3, 0.01)
+
+    began = time.perf_counter()
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    print(f"add_chunk: {elapsed / 40000 * 1e6:.2f} us per chunk")
+    assert call_stats.chunks == 40000
+    assert call_stats.bytes_returned == 120000
@@ -2,13 +2,19 @@
 # active storage server is available. Therefore, we mock out the remote service
 # interaction and replace with local file operations.
 
+import aiohttp
+import asyncio
 import botocore
+import fsspec
 import contextlib
 import os
 import h5netcdf
+import json
 import numpy as np
 import pytest
 import requests.exceptions
+import threading
+import time
 from unittest import mock
 
 
@@ -16,8 +22,12 @@ import activestorage.active
 from activestorage.active import Active
 from activestorage.config import *
 from activestorage.dummy_data import make_vanilla_ncdata
+from activestorage import cancellation
 from activestorage import netcdf_to_zarr
+from activestorage import result_cache
+import activestorage.ranges
 import activestorage.reductionist
+import activestorage.retry
 import activestorage.storage
 
 
@@ -25,6 +35,14 @@ import activestorage.storage
 old_netcdf_to_zarr = netcdf_to_zarr.load_netcdf_zarr_generic
 
 
+@pytest.fixture(autouse=True)
+def healthy_servers():
+    """Start and finish each test with no Reductionist server ejected."""
+    activestorage.reductionist.clear_health()
+    yield
+    activestorage.reductionist.clear_health()
+
+
 @mock.patch.object(activestorage.active, "load_from_s3")
 @mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
 @mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
@@ -58,6 +76,7 @@ def test_s3(mock_reduce, mock_nz, mock_load, tmp_path):
         order,
         chunk_selection,
         operation,
+        template=None,
     ):
         return activestorage.storage.reduce_chunk(
             test_file,
@@ -111,6 +130,7 @@ def test_s3(mock_reduce, mock_nz, mock_load, tmp_path):
         "C",
         mock.ANY,
         operation="max",
+        template=mock.ANY,
     )
 
 
@@ -204,3 +224,601 @@ def test_reductionist_bad_request(mock_reduce, mock_nz, mock_load, tmp_path):
 
     with pytest.raises(activestorage.reductionist.ReductionistError):
         assert active[::]
+
+
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "areduce_chunk")
+def test_s3_aget(mock_reduce, mock_nz, tmp_path):
+    """Test stack when Active.aget is used with storage_type == s3."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    async def reduce_chunk(session, server, source, bucket, object, offset,
+                           size, compressor, filters, missing, dtype, shape,
+                           order, chunk_selection, operation, template=None):
+        assert isinstance(session, aiohttp.ClientSession)
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = reduce_chunk
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    active = Active(uri, "data", "s3")
+    active._version = 1
+    active._method = "max"
+
+    result = asyncio.run(active.aget(np.s_[::]))
+
+    assert result == 999.0
+    mock_nz.assert_called_once_with(uri, "data", "s3", None)
+    assert mock_reduce.call_count > 1
+
+
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "areduce_chunk")
+def test_s3_aget_bad_request(mock_reduce, mock_nz, tmp_path):
+    """Test that Active.aget raises the first error and cancels the rest."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = activestorage.reductionist.ReductionistError(400, "Bad request")
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    active = Active(uri, "data", "s3")
+    active._version = 1
+    active._method = "max"
+
+    with pytest.raises(activestorage.reductionist.ReductionistError):
+        asyncio.run(active.aget(np.s_[::]))
+
+
+@mock.patch.object(activestorage.retry, "backoff", lambda attempt: 0)
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_reductionist_retry_and_resume(mock_reduce, mock_nz, tmp_path):
+    """Test that transient failures are retried, and that a call after
+    persistent failures only processes the chunks that failed."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    failures = {}
+
+    def reduce_chunk(session, server, source, bucket, object, offset, size,
+                     compressor, filters, missing, dtype, shape, order,
+                     chunk_selection, operation, template=None):
+        # fail the first few requests for the chunk at offset
+        if failures.get(offset, 0) > 0:
+            failures[offset] -= 1
+            raise activestorage.reductionist.ReductionistError(503, "Busy")
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = reduce_chunk
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    active = Active(uri, "data", "s3", retries=2)
+    active._version = 1
+    active._method = "max"
+    active._load_kerchunk()
+    refs = active.zds.chunk_store.fs.references
+    offsets = sorted(ref[1] for key, ref in refs.items()
+                     if key.startswith("data/") and not key.endswith("zarray")
+                     and not key.endswith("zattrs"))
+    nchunks = len(offsets)
+
+    # retried until they succeed
+    failures.update({offsets[0]: 2, offsets[1]: 1})
+    assert active[::] == 999.0
+    assert mock_reduce.call_count == nchunks + 3
+
+    # still failing after the retries
+    mock_reduce.reset_mock()
+    failures.update({offsets[0]: 3, offsets[1]: 5})
+    with pytest.raises(activestorage.reductionist.ReductionistError):
+        active[::]
+    assert mock_reduce.call_count == nchunks + 4
+
+    # the next call only processes the two failed chunks
+    mock_reduce.reset_mock()
+    assert active[::] == 999.0
+    assert mock_reduce.call_count == 1 + 3
+
+
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_reductionist_hedging(mock_reduce, mock_nz, tmp_path):
+    """Test that a straggling request is hedged to the hedge server."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    calls = []
+    released = threading.Event()
+
+    def reduce_chunk(session, server, source, bucket, object, offset, size,
+                     compressor, filters, missing, dtype, shape, order,
+                     chunk_selection, operation, template=None):
+        calls.append((server, chunk_coords(offset)))
+        # the main server is slow to answer for the last chunk
+        if server == S3_ACTIVE_STORAGE_URL and chunk_coords(offset) == (3, 3, 9):
+            released.wait(10)
+        else:
+            time.sleep(0.01)
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = reduce_chunk
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    active = Active(uri, "data", "s3", max_threads=4, hedge_quantile=0.99,
+                    hedge_server="https://hedge.example.com")
+    active._version = 1
+    active._method = "max"
+    active._load_kerchunk()
+    refs = active.zds.chunk_store.fs.references
+    coords = {ref[1]: tuple(int(c) for c in key[5:].split("."))
+              for key, ref in refs.items()
+              if key.startswith("data/") and ".z" not in key}
+    chunk_coords = coords.get
+
+    assert active[::] == 999.0
+    # the hedge answered for the last chunk, before the main server did
+    assert ("https://hedge.example.com", (3, 3, 9)) in calls
+    stats = active._hedger.stats()
+    released.set()
+    assert stats["hedge_wins"] >= 1
+    assert 1 <= stats["hedges"] <= 0.05 * stats["requests"]
+
+
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_reductionist_deadline_and_cancel(mock_reduce, mock_nz, tmp_path):
+    """Test that slow reductions can be given a deadline or cancelled, and
+    resumed afterwards."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    delay = 0.1
+
+    def reduce(session, server, source, bucket, object, offset, size,
+               compressor, filters, missing, dtype, shape, order,
+               chunk_selection, operation, timeout=None,
+               template=None):
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    def reduce_chunk(*args, **kwargs):
+        time.sleep(delay)
+        return reduce(*args, **kwargs)
+
+    async def areduce_chunk(*args, **kwargs):
+        await asyncio.sleep(delay)
+        return reduce(*args, **kwargs)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = reduce_chunk
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    # 160 chunks, 4 at a time
+    active = Active(uri, "data", "s3", max_threads=4)
+    active._version = 1
+    active._method = "max"
+    active._load_kerchunk()
+
+    with pytest.raises(cancellation.DeadlineExceeded):
+        active.get(np.s_[::], timeout=0.5)
+    # the chunks left undone were not started
+    assert mock_reduce.call_count < 160
+    # a deadline is passed on to the requests
+    assert mock_reduce.call_args.kwargs["timeout"] <= 0.5
+
+    token = cancellation.CancelToken()
+    threading.Timer(0.3, token.cancel).start()
+    with pytest.raises(cancellation.Cancelled):
+        active.get(np.s_[::], cancel_token=token)
+    assert len(active._resume[3]) < 160
+    with pytest.raises(cancellation.Cancelled):
+        active.get(np.s_[::], cancel_token=token)
+
+    # only the chunks not done yet are processed
+    delay = 0
+    ncalls = mock_reduce.call_count
+    assert active[::] == 999.0
+    assert mock_reduce.call_count - ncalls < 160 - 4
+
+    with mock.patch.object(activestorage.active.reductionist, "areduce_chunk",
+                           side_effect=areduce_chunk):
+        delay = 0.1
+        with pytest.raises(cancellation.DeadlineExceeded):
+            asyncio.run(active.aget(np.s_[::], timeout=0.3))
+        assert len(active.chunk_paths) < 160
+
+
+@mock.patch.object(activestorage.active.sessions, "get_s3_filesystem")
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_s3_direct(mock_reduce, mock_nz, mock_fs, tmp_path):
+    """Test that s3_mode="direct" reduces chunks client side, with
+    coalesced ranged reads."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_fs.return_value = fsspec.filesystem("file")
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    for method in ["max", "mean", None]:
+        local = Active(test_file, "data")
+        local._version = 2
+        local._method = method
+        direct = Active(uri, "data", "s3", s3_mode="direct")
+        direct._version = 2
+        direct._method = method
+        np.testing.assert_array_equal(direct[0:2, 4:6, :], local[0:2, 4:6, :])
+
+    mock_reduce.assert_not_called()
+    # 8 chunks of the selection, close together in the file
+    stats = direct._reader.stats()
+    assert 0 < stats["requests"] < 8
+
+    result = asyncio.run(direct.aget(np.s_[::]))
+    np.testing.assert_array_equal(result, local[::])
+    mock_reduce.assert_not_called()
+
+    with pytest.raises(ValueError):
+        Active(uri, "data", "s3", s3_mode="nearby")
+
+
+@mock.patch.object(activestorage.active.sessions, "get_s3_filesystem")
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+def test_s3_direct_resume(mock_nz, mock_fs, tmp_path):
+    """Test that a call after a failed one only reads the chunks that were
+    not processed."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    fs = fsspec.filesystem("file")
+    failing = set()
+
+    def cat_file(path, start=None, end=None):
+        if start in failing:
+            raise PermissionError("Access denied")
+        return fs.cat_file(path, start=start, end=end)
+
+    def coalesce(ranges, max_gap, max_size):
+        # a read per chunk
+        return old_coalesce(ranges, 0, 1)
+
+    old_coalesce = activestorage.ranges.coalesce
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_fs.return_value.cat_file.side_effect = cat_file
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    active = Active(uri, "data", "s3", s3_mode="direct", max_threads=1)
+    active._version = 1
+    active._method = "max"
+    active._load_kerchunk()
+    refs = active.zds.chunk_store.fs.references
+    offsets = sorted(ref[1] for key, ref in refs.items()
+                     if key.startswith("data/") and not key.endswith("zarray")
+                     and not key.endswith("zattrs"))
+    nchunks = len(offsets)
+
+    with mock.patch.object(activestorage.ranges, "coalesce", coalesce):
+        failing.add(offsets[-1])
+        with pytest.raises(PermissionError):
+            active[::]
+        completed = len(active._resume[3])
+        assert 0 < completed < nchunks
+
+        # the reader only has the chunks left, and reads each of them
+        failing.clear()
+        assert active[::] == 999.0
+        assert len(active._reader._blocks) == nchunks - completed
+        assert active._reader.stats()["requests"] == nchunks - completed
+
+
+@mock.patch.object(activestorage.retry, "backoff", lambda attempt: 0)
+@mock.patch.object(activestorage.active.reductionist, "check_health")
+@mock.patch.object(activestorage.active.sessions, "get_s3_filesystem")
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_reductionist_fallback(mock_reduce, mock_nz, mock_fs, mock_health,
+                               tmp_path):
+    """Test that with fallback, chunks Reductionist can't reduce are
+    reduced client side."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    failing = {}
+
+    def reduce_chunk(session, server, source, bucket, object, offset, size,
+                     compressor, filters, missing, dtype, shape, order,
+                     chunk_selection, operation, template=None):
+        if offset in failing:
+            raise failing[offset]
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = reduce_chunk
+    mock_fs.return_value = fsspec.filesystem("file")
+    mock_health.return_value = None
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    active = Active(uri, "data", "s3", retries=1, fallback=True,
+                    max_threads=1)
+    active._version = 1
+    active._method = "max"
+    active._load_kerchunk()
+    refs = active.zds.chunk_store.fs.references
+    offsets = sorted(ref[1] for key, ref in refs.items()
+                     if key.startswith("data/") and not key.endswith("zarray")
+                     and not key.endswith("zattrs"))
+    nchunks = len(offsets)
+
+    # a chunk failing with a server error
+    failing[offsets[0]] = activestorage.reductionist.ReductionistError(
+        500, "Oops")
+    assert active[::] == 999.0
+    paths = list(active.chunk_paths.values())
+    assert len(paths) == nchunks
+    assert paths.count("client") == 1
+    assert mock_reduce.call_count == nchunks
+
+    # a bad request is not a reason to fall back
+    failing[offsets[0]] = activestorage.reductionist.ReductionistError(
+        400, "Bad request")
+    with pytest.raises(activestorage.reductionist.ReductionistError):
+        active[::]
+    del failing[offsets[0]]
+    active._resume = None
+
+    # the server becoming unreachable: the other chunks are not sent to it
+    mock_reduce.reset_mock()
+    failing.update({offset: requests.exceptions.ConnectionError("refused")
+                    for offset in offsets})
+    assert active[::] == 999.0
+    assert mock_reduce.call_count == 2
+    assert set(active.chunk_paths.values()) == {"client"}
+
+    # the server found unavailable before the call
+    mock_reduce.reset_mock()
+    mock_health.return_value = "Reductionist server unavailable"
+    assert active[::] == 999.0
+    assert asyncio.run(active.aget(np.s_[::])) == 999.0
+    mock_reduce.assert_not_called()
+    assert set(active.chunk_paths.values()) == {"client"}
+    assert len(active.chunk_paths) == nchunks
+
+
+@mock.patch.object(activestorage.retry, "backoff", lambda attempt: 0)
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_reductionist_pool(mock_reduce, mock_nz, tmp_path):
+    """Test that the chunks of an object go to one server of a pool, and
+    to another one when it can't be reached."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    down = set()
+
+    def reduce_chunk(session, server, source, bucket, object, offset, size,
+                     compressor, filters, missing, dtype, shape, order,
+                     chunk_selection, operation, template=None):
+        if server in down:
+            raise requests.exceptions.ConnectionError("refused")
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = reduce_chunk
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    urls = [f"https://reductionist{i}.example.com" for i in range(3)]
+    storage_options = {
+        "key": S3_ACCESS_KEY,
+        "secret": S3_SECRET_KEY,
+        "client_kwargs": {"endpoint_url": S3_URL},
+    }
+    active = Active(uri, "data", "s3", storage_options=storage_options,
+                    active_storage_url=urls)
+    active._version = 1
+    active._method = "max"
+
+    assert active[::] == 999.0
+    used = {call.args[1] for call in mock_reduce.call_args_list}
+    assert len(used) == 1
+    assert used < set(urls)
+
+    # the server goes down: it is ejected, and its objects move
+    mock_reduce.reset_mock()
+    down.update(used)
+    assert active[::] == 999.0
+    now_used = {call.args[1] for call in mock_reduce.call_args_list}
+    assert len(now_used - used) == 1
+    assert not active._get_pool().is_healthy(used.pop())
+
+
+@mock.patch.object(activestorage.retry, "backoff", lambda attempt: 0)
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "areduce_chunks")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunks")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_reductionist_batches(mock_reduce, mock_reduce_batch,
+                              mock_areduce_batch, mock_nz, tmp_path):
+    """Test that chunks are sent to Reductionist in batches, and that chunks
+    that fail in a batch are sent again on their own."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    def reduce(request_data):
+        request_data = json.loads(request_data)
+        return activestorage.storage.reduce_chunk(
+            test_file, request_data["offset"], request_data["size"], None,
+            None, (None, None, None, None), np.dtype(request_data["dtype"]),
+            tuple(request_data["shape"]), request_data["order"],
+            tuple(slice(*s) for s in request_data["selection"]), np.max)
+
+    def reduce_chunks(session, server, requests_data, operation, split=True):
+        # the first chunk of each batch fails
+        return ([activestorage.reductionist.ReductionistError(500, "Oops")]
+                + [reduce(request_data) for request_data in requests_data[1:]])
+
+    async def areduce_chunks(session, server, requests_data, operation,
+                             split=True):
+        return [reduce(request_data) for request_data in requests_data]
+
+    def reduce_chunk(session, server, source, bucket, object, offset, size,
+                     compressor, filters, missing, dtype, shape, order,
+                     chunk_selection, operation, template=None):
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce_batch.side_effect = reduce_chunks
+    mock_areduce_batch.side_effect = areduce_chunks
+    mock_reduce.side_effect = reduce_chunk
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    active = Active(uri, "data", "s3", batch_size=50)
+    active._version = 1
+    active._method = "max"
+
+    # 160 chunks in batches of 50, 50, 50 and 10
+    assert active[::] == 999.0
+    assert mock_reduce_batch.call_count == 4
+    assert mock_reduce.call_count == 4
+    assert set(active.chunk_paths.values()) == {"reductionist"}
+    assert len(active.chunk_paths) == 160
+
+    assert asyncio.run(active.aget(np.s_[::])) == 999.0
+    assert mock_areduce_batch.call_count == 4
+    assert mock_reduce.call_count == 4
+
+
+@mock.patch.object(activestorage.active.sessions, "get_s3_filesystem")
+@mock.patch.object(activestorage.netcdf_to_zarr, "load_netcdf_zarr_generic")
+@mock.patch.object(activestorage.active.reductionist, "areduce_chunks")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunks")
+@mock.patch.object(activestorage.active.reductionist, "reduce_chunk")
+def test_reductionist_result_cache(mock_reduce, mock_reduce_batch,
+                                   mock_areduce_batch, mock_nz, mock_fs,
+                                   tmp_path):
+    """Test that the results of Reductionist requests are cached, for the
+    same version of the object only."""
+
+    def load_netcdf_zarr_generic(uri, ncvar, storage_type, storage_options=None):
+        return old_netcdf_to_zarr(test_file, ncvar, None, None)
+
+    def reduce_chunk(session, server, source, bucket, object, offset, size,
+                     compressor, filters, missing, dtype, shape, order,
+                     chunk_selection, operation, template=None):
+        return activestorage.storage.reduce_chunk(
+            test_file, offset, size, compressor, filters, missing, dtype,
+            shape, order, chunk_selection, np.max)
+
+    def reduce_chunks(session, server, requests_data, operation, split=True):
+        return [reduce_chunk(None, None, None, None, None,
+                             request_data["offset"], request_data["size"],
+                             None, None, (None, None, None, None),
+                             np.dtype(request_data["dtype"]),
+                             tuple(request_data["shape"]),
+                             request_data["order"],
+                             tuple(slice(*s)
+                                   for s in request_data["selection"]),
+                             operation)
+                for request_data in map(json.loads, requests_data)]
+
+    mock_nz.side_effect = load_netcdf_zarr_generic
+    mock_reduce.side_effect = reduce_chunk
+    mock_reduce_batch.side_effect = reduce_chunks
+    mock_fs.return_value.info.return_value = {"ETag": '"abc"'}
+
+    uri = "s3://fake-bucket/fake-object"
+    test_file = str(tmp_path / "test.nc")
+    make_vanilla_ncdata(test_file)
+
+    cache = result_cache.ResultCache()
+    active = Active(uri, "data", "s3", result_cache=cache)
+    active._version = 1
+    active._method = "max"
+
+    assert active[::] == 999.0
+    assert mock_reduce.call_count == 160
+    assert set(active.chunk_paths.values()) == {"reductionist"}
+
+    # the same request, from another instance, is served from the cache
+    mock_reduce.reset_mock()
+    other = Active(uri, "data", "s3", result_cache=cache, batch_size=50)
+    other._version = 1
+    other._method = "max"
+    assert other[::] == 999.0
+    assert asyncio.run(other.aget(np.s_[::])) == 999.0
+    assert mock_reduce.call_count == 0
+    assert mock_reduce_batch.call_count == 0
+    assert set(other.chunk_paths.values()) == {"cache"}
+    assert mock_fs.return_value.info.call_count == 3
+
+    # a new version of the object is not
+    mock_fs.return_value.info.return_value = {"ETag": '"def"'}
+    assert other[::] == 999.0
+    assert mock_reduce_batch.call_count == 4
+    assert set(other.chunk_paths.values()) == {"reductionist"}
+    assert cache.stats()["entries"] == 320
+
+    # without an ETag, nothing is cached
+    mock_reduce.reset_mock()
+    mock_fs.return_value.info.return_value = {}
+    assert active[::] == 999.0
+    assert mock_reduce.call_count == 160